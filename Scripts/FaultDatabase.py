@@ -0,0 +1,1445 @@
+"""
+#############################################################
+# Client for the ShakerMaker fault database.                #
+#                                                           #
+# A realization is a directory of the database holding a    #
+# faultInfo.json, the fault segment files it lists and the  #
+# source time function script. Files are fetched            #
+# concurrently over one pooled HTTP session, from the       #
+# online database or a local mirror of it.                  #
+# ###########################################################
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import stat
+import sys
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import formatdate
+from urllib.parse import unquote, urlparse
+
+import numpy as np
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from FaultSources import link_or_copy
+
+# Default location of the fault database, overridden by the SHAKERMAKER_DATABASE
+# environment variable (a URL or the directory of a local mirror)
+DATABASE_URL = 'https://raw.githubusercontent.com/amnp95/ShakerMakerFaultDatabase/Pythoninterface'
+
+# Size of the chunks streamed to disk
+CHUNK_SIZE = 1 << 20
+
+# Default size cap of the local realization cache
+CACHE_MAX_BYTES = 10 * 1024**3
+
+# Default bandwidth cap of the prefetcher in bytes per second
+PREFETCH_MAX_RATE = 2 * 1024**2
+
+# Realization bundle compressions, in order of preference
+BUNDLE_COMPRESSIONS = ('zst', 'gz')
+
+
+def database_url(location=None):
+    '''
+    Return the base URL of the fault database.
+
+    location defaults to the SHAKERMAKER_DATABASE environment variable, then to
+    DATABASE_URL. A local directory is turned into a file:// URL.
+    '''
+    if location is None:
+        location = os.environ.get('SHAKERMAKER_DATABASE', DATABASE_URL)
+    if '://' not in location:
+        location = 'file://' + os.path.abspath(os.path.expanduser(location)).replace('\\', '/')  # noqa: PTH100, PTH111
+    return location.rstrip('/')
+
+
+def realization_path(country, fault, magnitude, type, realization):  # noqa: A002
+    '''
+    Return the path of a realization relative to the database root.
+    '''
+    return f'{country}/{fault}/M_{magnitude}_type_{type}_number_{realization}'
+
+
+def realization_files(faultinfo):
+    '''
+    Return the names of the files of a realization, besides faultInfo.json.
+    '''
+    return list(faultinfo['Faultfilenames']) + [faultinfo['SourceTimeFunction']['filename']]
+
+
+def realization_checksums(faultinfo):
+    '''
+    Return the SHA-256 digests published in the "checksums" entry of faultInfo.json
+    as a dict of filename -> hex digest. Realizations without checksums give {}.
+    '''
+    checksums = faultinfo.get('checksums', {})
+    return {
+        name: digest.split(':', 1)[-1].lower() for name, digest in checksums.items()
+    }
+
+
+def iter_catalog(data):
+    '''
+    Yield the (country, fault, magnitude, type, realization) tuple of every
+    realization listed in a DatabaseMetadata.json catalog.
+    '''
+    for country in data['Countries']:
+        for fault in data[country]['Faults']:
+            for magnitude in data[country][fault]['Magnitudes']:
+                for type in data[country][fault][magnitude]['Types']:  # noqa: A001
+                    for realization in data[country][fault][magnitude][type]['Realizations']:
+                        yield country, fault, magnitude, type, realization
+
+
+def catalog_realizations(data, countries=None, faults=None, magnitudes=None, types=None):
+    '''
+    Return the paths of the realizations listed in a DatabaseMetadata.json catalog,
+    optionally restricted to the given countries, faults, magnitudes and types.
+    '''
+    def keep(name, selected):
+        return selected is None or name in selected
+
+    return [
+        realization_path(*entry)
+        for entry in iter_catalog(data)
+        if keep(entry[0], countries)
+        and keep(entry[1], faults)
+        and keep(entry[2], magnitudes)
+        and keep(entry[3], types)
+    ]
+
+
+class CatalogIndex:
+    '''
+    Flat, sortable and searchable index of the realizations of a catalog.
+
+    Each field is stored as sorted categories (the distinct values) and one integer
+    code per realization, so a query is evaluated on the few distinct values and
+    mapped to all rows with one vectorized lookup.
+
+    Queries are whitespace separated terms, all of which must match:
+
+    - ``text`` matches realizations with text in any field (case-insensitive)
+    - ``field:text`` matches text in one field, ``field=text`` the whole value
+    - ``field>=7`` (also ``>``, ``<``, ``<=``) compares numeric values
+
+    Fields are country, fault, magnitude (m), type (t) and realization (r); quote
+    values containing spaces, e.g. ``country:"United States" m>=7 type=hf``.
+    '''
+
+    fields = ('country', 'fault', 'magnitude', 'type', 'realization')
+    aliases = {'c': 'country', 'f': 'fault', 'm': 'magnitude', 'mag': 'magnitude', 't': 'type', 'r': 'realization'}
+    operators = ('>=', '<=', '>', '<', '=', ':')
+
+    def __init__(self, data):
+        entries = list(iter_catalog(data))
+        self.size = len(entries)
+        self.categories = {}
+        self.codes = {}
+        self.numbers = {}
+        self.ranks = {}
+        for k, field in enumerate(self.fields):
+            values = np.array([entry[k] for entry in entries], dtype=str)
+            categories, codes = np.unique(values, return_inverse=True)
+            numbers = np.array([_to_number(value) for value in categories], dtype=float)
+            # Numeric values sort by number, before the other values in text order
+            order = np.lexsort((np.arange(len(categories)), numbers, np.isnan(numbers)))
+            ranks = np.empty(len(categories), dtype=np.intp)
+            ranks[order] = np.arange(len(categories))
+            self.categories[field] = categories
+            self.codes[field] = codes.astype(np.intp)
+            self.numbers[field] = numbers
+            self.ranks[field] = ranks
+        self._lower = {field: np.char.lower(self.categories[field]) for field in self.fields}
+
+    def __len__(self):
+        return self.size
+
+    def value(self, row, field):
+        return self.categories[field][self.codes[field][row]]
+
+    def entry(self, row):
+        '''
+        Return the (country, fault, magnitude, type, realization) tuple of a row.
+        '''
+        return tuple(str(self.value(row, field)) for field in self.fields)
+
+    def path(self, row):
+        return realization_path(*self.entry(row))
+
+    def _term(self, term):
+        # Boolean mask over the rows matching one query term
+        for operator in self.operators:
+            field, found, text = term.partition(operator)
+            field = self.aliases.get(field.lower(), field.lower())
+            if found and field in self.fields:
+                break
+        else:
+            text = term.lower()
+            mask = np.zeros(self.size, dtype=bool)
+            for field in self.fields:
+                mask |= (np.char.find(self._lower[field], text) >= 0)[self.codes[field]]
+            return mask
+
+        if operator in (':', '='):
+            lower = self._lower[field]
+            selected = lower == text.lower() if operator == '=' else np.char.find(lower, text.lower()) >= 0
+        else:
+            number = _to_number(text)
+            if np.isnan(number):
+                return np.zeros(self.size, dtype=bool)
+            numbers = self.numbers[field]
+            with np.errstate(invalid='ignore'):
+                selected = {
+                    '>=': numbers >= number,
+                    '<=': numbers <= number,
+                    '>': numbers > number,
+                    '<': numbers < number,
+                }[operator]
+        return selected[self.codes[field]]
+
+    def filter(self, query):
+        '''
+        Return the rows matching a query, in catalog order.
+        '''
+        try:
+            terms = shlex.split(query)
+        except ValueError:
+            terms = query.split()
+        mask = np.ones(self.size, dtype=bool)
+        for term in terms:
+            mask &= self._term(term)
+        return np.flatnonzero(mask)
+
+    def sort(self, rows, field, descending=False):
+        '''
+        Return rows ordered by a field; ties keep their order.
+        '''
+        keys = self.ranks[field][self.codes[field][rows]]
+        if descending:
+            keys = -keys
+        return rows[np.argsort(keys, kind='stable')]
+
+
+def _to_number(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+
+def prune_catalog(data, paths):
+    '''
+    Return a copy of a catalog that only lists the realizations at paths.
+    '''
+    paths = set(paths)
+    pruned = {'Countries': []}
+    for country in data['Countries']:
+        faults = {}
+        for fault in data[country]['Faults']:
+            magnitudes = {}
+            for magnitude in data[country][fault]['Magnitudes']:
+                types = {}
+                for type in data[country][fault][magnitude]['Types']:  # noqa: A001
+                    realizations = [
+                        r
+                        for r in data[country][fault][magnitude][type]['Realizations']
+                        if realization_path(country, fault, magnitude, type, r) in paths
+                    ]
+                    if realizations:
+                        types[type] = {'Realizations': realizations}
+                if types:
+                    magnitudes[magnitude] = dict(types, Types=list(types))
+            if magnitudes:
+                faults[fault] = dict(magnitudes, Magnitudes=list(magnitudes))
+        if faults:
+            pruned['Countries'].append(country)
+            pruned[country] = dict(faults, Faults=list(faults))
+    return pruned
+
+
+def bundle_compression(filename):
+    '''
+    Return the compression of a realization bundle from its name, 'zst' or 'gz'.
+    '''
+    for compression in BUNDLE_COMPRESSIONS:
+        if filename.endswith(f'.tar.{compression}'):
+            return compression
+    raise ValueError(f'{filename}: not a realization bundle')  # noqa: EM102, TRY003
+
+
+def realization_bundle(faultinfo):
+    '''
+    Return the entry of the preferred bundle listed in faultInfo.json that can be
+    unpacked here, or None. zstd bundles need the zstandard package.
+    '''
+    bundles = {bundle_compression(b['filename']): b for b in faultinfo.get('bundles', [])}
+    for compression in BUNDLE_COMPRESSIONS:
+        if compression in bundles and (compression != 'zst' or zstandard is not None):
+            return bundles[compression]
+    return None
+
+
+def file_sha256(filename):
+    '''
+    Return the hex SHA-256 digest of a file.
+    '''
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:  # noqa: PTH123
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DatabaseError(Exception):
+    '''
+    Raised when files of the fault database cannot be retrieved.
+    '''
+
+
+class DownloadCancelled(DatabaseError):
+    '''
+    Raised when a transfer is stopped through its cancel event.
+    '''
+
+
+class LocalFileAdapter(BaseAdapter):
+    '''
+    Serve file:// URLs from a local directory, so a database mirror on a shared
+    filesystem is read through the same client as the online database.
+
+    Supports the subset of HTTP the client relies on: ETag and Last-Modified
+    validators, If-None-Match / If-Modified-Since (304), and Range / If-Range
+    requests of the form bytes=start-.
+    '''
+
+    def send(self, request, **kwargs):  # noqa: ARG002
+        filename = unquote(urlparse(request.url).path)
+        if os.name == 'nt' and filename.startswith('/'):
+            filename = filename[1:]
+
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.connection = self
+        if not os.path.isfile(filename):  # noqa: PTH113
+            return self._empty(response, 404, 'Not Found')
+
+        st = os.stat(filename)  # noqa: PTH116
+        etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+        last_modified = formatdate(st.st_mtime, usegmt=True)
+        response.headers['ETag'] = etag
+        response.headers['Last-Modified'] = last_modified
+
+        headers = request.headers
+        if headers.get('If-None-Match') == etag or (
+            'If-None-Match' not in headers and headers.get('If-Modified-Since') == last_modified
+        ):
+            return self._empty(response, 304, 'Not Modified')
+
+        start = 0
+        ranged = headers.get('Range', '')
+        if ranged.startswith('bytes=') and ranged.endswith('-') and headers.get('If-Range', etag) in (etag, last_modified):
+            start = int(ranged[len('bytes=') : -1])
+            if start >= st.st_size:
+                return self._empty(response, 416, 'Range Not Satisfiable')
+
+        f = open(filename, 'rb')  # noqa: PTH123, SIM115
+        f.seek(start)
+        response.raw = f
+        response.headers['Content-Length'] = str(st.st_size - start)
+        if start:
+            response.status_code = 206
+            response.reason = 'Partial Content'
+        else:
+            response.status_code = 200
+            response.reason = 'OK'
+        return response
+
+    def _empty(self, response, status_code, reason):
+        response.status_code = status_code
+        response.reason = reason
+        response.raw = None
+        response._content = b''  # noqa: SLF001
+        response._content_consumed = True  # noqa: SLF001
+        return response
+
+    def close(self):
+        pass
+
+
+class DatabaseClient:
+    '''
+    Fetch files of the fault database.
+
+    One requests.Session with a connection pool of max_workers keep-alive connections
+    is shared by all transfers, and realization files are downloaded by a pool of
+    max_workers threads.
+
+    Incomplete transfers are kept in partial_dir, named after their URL, and are
+    resumed with HTTP Range requests. Without partial_dir they are kept next to the
+    destination as destination.part.
+
+    base_url is resolved by database_url, so it may also be the directory of a
+    local mirror.
+    '''
+
+    def __init__(self, base_url=None, max_workers=8, timeout=60, partial_dir=None):
+        self.base_url = database_url(base_url)
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.partial_dir = partial_dir
+        if partial_dir is not None:
+            os.makedirs(partial_dir, exist_ok=True)  # noqa: PTH103
+
+        self.session = requests.Session()
+        retries = Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504))
+        adapter = HTTPAdapter(
+            pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retries
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.mount('file://', LocalFileAdapter())
+
+    def url(self, path):
+        '''
+        Return the URL of a database path.
+        '''
+        return f'{self.base_url}/{path}'
+
+    def get(self, path, ok_status=(200,), **kwargs):
+        '''
+        GET a database path and raise DatabaseError if the response status is not
+        one of ok_status.
+        '''
+        try:
+            response = self.session.get(self.url(path), timeout=self.timeout, **kwargs)
+        except requests.exceptions.RequestException as e:
+            raise DatabaseError(f'{path}: {e}') from e  # noqa: EM102, TRY003
+        if response.status_code not in ok_status:
+            response.close()
+            raise DatabaseError(f'{path}: HTTP {response.status_code} {response.reason}')  # noqa: EM102, TRY003
+        return response
+
+    def partial_file(self, path, destination):
+        '''
+        Return the file an incomplete transfer of path to destination is kept in.
+        '''
+        if self.partial_dir is None:
+            return destination + '.part'
+        key = hashlib.sha256(self.url(path).encode('utf-8')).hexdigest()
+        return os.path.join(self.partial_dir, key + '.part')  # noqa: PTH118
+
+    def download(self, path, destination, checksum=None, progress=None, cancel=None):
+        '''
+        Stream a database path to the destination file.
+
+        The content is written to a partial file and moved to destination once
+        complete, so an interrupted transfer never leaves a truncated file under the
+        final name. An existing partial file is resumed with a Range request guarded
+        by If-Range, so a file that changed on the server is fetched from scratch.
+
+        checksum is the expected hex SHA-256 of the file; a mismatch discards the
+        partial file and raises DatabaseError. progress(path, done, total) is called
+        after every chunk, total being None when the server does not send a length.
+        Setting the cancel event raises DownloadCancelled and keeps the partial file
+        for a later resume.
+        '''
+        partial = self.partial_file(path, destination)
+        validator_file = partial + '.validator'
+
+        # Resume only transfers whose server version is known
+        offset = 0
+        headers = {'Accept-Encoding': 'identity'}
+        if os.path.exists(partial) and os.path.exists(validator_file):  # noqa: PTH110
+            with open(validator_file) as f:  # noqa: PTH123
+                validator = f.read().strip()
+            offset = os.path.getsize(partial)  # noqa: PTH202
+            if offset and validator:
+                headers['Range'] = f'bytes={offset}-'
+                headers['If-Range'] = validator
+            else:
+                offset = 0
+
+        with self.get(path, ok_status=(200, 206, 416), stream=True, headers=headers) as response:
+            if response.status_code == 416:  # noqa: PLR2004
+                # The partial file already holds the whole content
+                total = offset
+            else:
+                if response.status_code == 200:  # noqa: PLR2004
+                    offset = 0
+                    validator = response.headers.get('ETag') or response.headers.get('Last-Modified', '')
+                    with open(validator_file, 'w') as f:  # noqa: PTH123
+                        f.write(validator)
+                length = response.headers.get('Content-Length')
+                total = offset + int(length) if length is not None else None
+
+                done = offset
+                try:
+                    with open(partial, 'ab' if offset else 'wb') as f:  # noqa: PTH123
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            if cancel is not None and cancel.is_set():
+                                raise DownloadCancelled(f'{path}: cancelled')  # noqa: EM102, TRY003
+                            if chunk:  # Only write non-empty chunks
+                                f.write(chunk)
+                                done += len(chunk)
+                                if progress is not None:
+                                    progress(path, done, total)
+                except requests.exceptions.RequestException as e:
+                    raise DatabaseError(f'{path}: {e}') from e  # noqa: EM102, TRY003
+
+        if total is not None and os.path.getsize(partial) != total:  # noqa: PTH202
+            raise DatabaseError(f'{path}: incomplete transfer')  # noqa: EM102, TRY003
+        if checksum is not None and file_sha256(partial) != checksum:
+            os.remove(partial)  # noqa: PTH107
+            os.remove(validator_file)  # noqa: PTH107
+            raise DatabaseError(f'{path}: checksum mismatch')  # noqa: EM102, TRY003
+
+        shutil.move(partial, destination)
+        os.remove(validator_file)  # noqa: PTH107
+        return destination
+
+    def download_bundle(self, path, faultinfo, directory, progress=None, cancel=None):  # noqa: PLR0913
+        '''
+        Stream the bundle of a realization and unpack it into directory as it
+        arrives.
+
+        Only the files listed in faultinfo are extracted, each under a temporary
+        name that is renamed once the whole bundle matched its SHA-256 and every
+        file its checksum. Returns the names of the unpacked files.
+        '''
+        bundle = realization_bundle(faultinfo)
+        expected = set(realization_files(faultinfo))
+        checksums = realization_checksums(faultinfo)
+        digest = hashlib.sha256()
+        extracted = []
+        # Temporary files written so far, including the member being written
+        partials = []
+
+        def discard():
+            for partial in partials:
+                if os.path.exists(partial):  # noqa: PTH110
+                    os.remove(partial)  # noqa: PTH107
+
+        with self.get(f'{path}/{bundle["filename"]}', stream=True, headers={'Accept-Encoding': 'identity'}) as response:
+            length = response.headers.get('Content-Length')
+            total = int(length) if length is not None else None
+            received = 0
+
+            class Reader:
+                # Hash the compressed stream, report progress and honour cancel
+                def read(self, size=-1):
+                    nonlocal received
+                    if cancel is not None and cancel.is_set():
+                        raise DownloadCancelled(f'{path}: cancelled')  # noqa: EM102, TRY003
+                    data = response.raw.read(size if size is not None and size >= 0 else None)
+                    digest.update(data)
+                    received += len(data)
+                    if progress is not None and data:
+                        progress(path, received, total)
+                    return data
+
+            reader = Reader()
+            if bundle_compression(bundle['filename']) == 'zst':
+                stream = zstandard.ZstdDecompressor().stream_reader(reader)
+                mode = 'r|'
+            else:
+                stream = reader
+                mode = 'r|gz'
+
+            try:
+                with tarfile.open(fileobj=stream, mode=mode) as tar:
+                    for member in tar:
+                        if not member.isfile() or member.name not in expected:
+                            continue
+                        source = tar.extractfile(member)
+                        target = os.path.join(directory, member.name + '.part')  # noqa: PTH118
+                        partials.append(target)
+                        file_digest = hashlib.sha256()
+                        with open(target, 'wb') as f:  # noqa: PTH123
+                            for block in iter(lambda: source.read(CHUNK_SIZE), b''):  # noqa: B023
+                                file_digest.update(block)
+                                f.write(block)
+                        extracted.append(member.name)
+                        if member.name in checksums and file_digest.hexdigest() != checksums[member.name]:
+                            raise DatabaseError(f'{path}/{member.name}: checksum mismatch')  # noqa: EM102, TRY003, TRY301
+                # Drain the stream so the bundle digest covers the whole file
+                while stream.read(CHUNK_SIZE):
+                    pass
+                while reader.read(CHUNK_SIZE):
+                    pass
+                if 'sha256' in bundle and digest.hexdigest() != bundle['sha256']:
+                    raise DatabaseError(f'{path}/{bundle["filename"]}: checksum mismatch')  # noqa: EM102, TRY003, TRY301
+                missing = expected - set(extracted)
+                if missing:
+                    raise DatabaseError(f'{path}/{bundle["filename"]}: missing {", ".join(sorted(missing))}')  # noqa: EM102, TRY003, TRY301
+            except (tarfile.TarError, OSError, requests.exceptions.RequestException, ValueError) as e:
+                discard()
+                raise DatabaseError(f'{path}/{bundle["filename"]}: {e}') from e  # noqa: EM102, TRY003
+            except BaseException:
+                # DatabaseError, DownloadCancelled, or an interrupt
+                discard()
+                raise
+
+        for name in extracted:
+            os.replace(os.path.join(directory, name + '.part'), os.path.join(directory, name))  # noqa: PTH118
+        return [name for name in realization_files(faultinfo) if name in extracted]
+
+    def fetch_faultinfo(self, path, directory=None):
+        '''
+        Fetch the faultInfo.json of a realization and return it as a dict.
+        When directory is given the file is also written there.
+        '''
+        response = self.get(f'{path}/faultInfo.json')
+        content = response.content
+        try:
+            faultinfo = json.loads(content)
+        except ValueError as e:
+            raise DatabaseError(f'{path}/faultInfo.json: {e}') from e  # noqa: EM102, TRY003
+        if directory is not None:
+            with open(os.path.join(directory, 'faultInfo.json'), 'wb') as f:  # noqa: PTH118, PTH123
+                f.write(content)
+        return faultinfo
+
+    def download_files(self, path, filenames, directory, checksums=None, progress=None, cancel=None):  # noqa: PLR0913
+        '''
+        Download files of a database directory concurrently.
+
+        checksums maps filenames to their expected SHA-256; progress and cancel are
+        passed to download. Returns (downloaded, errors): the names of the files
+        written to directory, in the order of filenames, and a list of
+        (filename, message) for every file that failed. A failure does not stop the
+        other transfers.
+        '''
+        checksums = checksums or {}
+
+        def fetch(filename):
+            try:
+                self.download(
+                    f'{path}/{filename}',
+                    os.path.join(directory, filename),  # noqa: PTH118
+                    checksum=checksums.get(filename),
+                    progress=progress,
+                    cancel=cancel,
+                )
+            except (DatabaseError, OSError) as e:
+                return str(e)
+            return None
+
+        workers = max(1, min(self.max_workers, len(filenames)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(fetch, filenames))
+
+        downloaded = [f for f, error in zip(filenames, results) if error is None]
+        errors = [(f, error) for f, error in zip(filenames, results) if error is not None]
+        return downloaded, errors
+
+    def download_realization(self, path, directory, progress=None, cancel=None):
+        '''
+        Download a realization (faultInfo.json, fault files and source time function)
+        into directory. Files are verified against the checksums of faultInfo.json.
+
+        The realization bundle is used when faultInfo.json lists one that can be
+        unpacked here; the files are downloaded one by one otherwise, or when the
+        bundle fails.
+
+        Returns (faultinfo, downloaded, errors) as described in download_files.
+        Raises DatabaseError if faultInfo.json itself cannot be retrieved.
+        '''
+        faultinfo = self.fetch_faultinfo(path, directory)
+        if realization_bundle(faultinfo) is not None:
+            try:
+                return faultinfo, self.download_bundle(path, faultinfo, directory, progress, cancel), []
+            except DownloadCancelled as e:
+                return faultinfo, [], [(realization_bundle(faultinfo)['filename'], str(e))]
+            except DatabaseError:
+                pass
+        downloaded, errors = self.download_files(
+            path,
+            realization_files(faultinfo),
+            directory,
+            checksums=realization_checksums(faultinfo),
+            progress=progress,
+            cancel=cancel,
+        )
+        return faultinfo, downloaded, errors
+
+    def load_realization(self, path, directory, cache=None, progress=None, cancel=None):  # noqa: PLR0913
+        '''
+        Place a realization in directory, from the cache when it holds it and from
+        the database otherwise. Downloaded realizations are added to the cache.
+
+        Returns (faultinfo, files, errors, cached) where cached tells whether the
+        realization came from the cache.
+        '''
+        if cache is not None and cache.checkout(path, directory):
+            with open(os.path.join(directory, 'faultInfo.json')) as f:  # noqa: PTH118, PTH123
+                faultinfo = json.load(f)
+            return faultinfo, realization_files(faultinfo), [], True
+
+        faultinfo, downloaded, errors = self.download_realization(path, directory, progress, cancel)
+        if cache is not None and not errors:
+            cache.add(path, directory, ['faultInfo.json'] + downloaded)
+        return faultinfo, downloaded, errors, False
+
+    def close(self):
+        '''
+        Close the pooled connections.
+        '''
+        self.session.close()
+
+
+# ======================================================================================
+# Bundles
+# ======================================================================================
+def pack_realization(directory, compressions=('gz',), level=None):
+    '''
+    Pack the files of the realization in directory into one bundle per compression
+    ('zst' or 'gz') and list the bundles and the file checksums in its
+    faultInfo.json. Returns the names of the bundles.
+    '''
+    faultinfo_filename = os.path.join(directory, 'faultInfo.json')  # noqa: PTH118
+    with open(faultinfo_filename) as f:  # noqa: PTH123
+        faultinfo = json.load(f)
+    filenames = realization_files(faultinfo)
+
+    checksums = {name: file_sha256(os.path.join(directory, name)) for name in filenames}  # noqa: PTH118
+    bundles = []
+    for compression in compressions:
+        name = f'realization.tar.{compression}'
+        filename = os.path.join(directory, name)  # noqa: PTH118
+        with open(filename + '.part', 'wb') as f:  # noqa: PTH123
+            if compression == 'zst':
+                if zstandard is None:
+                    raise ImportError('zstd bundles need the zstandard package')  # noqa: EM101, TRY003
+                compressor = zstandard.ZstdCompressor(level=level or 19, threads=-1)
+                with compressor.stream_writer(f, closefd=False) as writer, tarfile.open(fileobj=writer, mode='w|') as tar:
+                    for name_ in filenames:
+                        tar.add(os.path.join(directory, name_), arcname=name_)  # noqa: PTH118
+            else:
+                with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=level or 9) as gz, tarfile.open(fileobj=gz, mode='w|') as tar:
+                    for name_ in filenames:
+                        tar.add(os.path.join(directory, name_), arcname=name_)  # noqa: PTH118
+        os.replace(filename + '.part', filename)
+        bundles.append({'filename': name, 'sha256': file_sha256(filename), 'size': os.path.getsize(filename)})  # noqa: PTH202
+
+    faultinfo['checksums'] = checksums
+    faultinfo['bundles'] = bundles
+    with open(faultinfo_filename + '.part', 'w') as f:  # noqa: PTH123
+        json.dump(faultinfo, f, indent=4)
+    os.replace(faultinfo_filename + '.part', faultinfo_filename)
+    return [b['filename'] for b in bundles]
+
+
+def pack_database(root, compressions=('gz',), level=None):
+    '''
+    Pack every realization (directory with a faultInfo.json) below root.
+    Yields (directory, bundles) as each realization is packed.
+    '''
+    for directory, _, names in os.walk(root):
+        if 'faultInfo.json' in names:
+            yield directory, pack_realization(directory, compressions, level)
+
+
+# ======================================================================================
+# Mirror
+# ======================================================================================
+@contextmanager
+def mirror_lock(root):
+    '''
+    Hold an exclusive lock on a database mirror, so several users syncing the same
+    shared directory take turns. Platforms without fcntl are not locked.
+    '''
+    os.makedirs(os.path.join(root, '.mirror'), exist_ok=True)  # noqa: PTH103, PTH118
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(os.path.join(root, '.mirror', 'lock'), 'w') as f:  # noqa: PTH118, PTH123
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print(f'{root}: waiting for another mirror to finish')
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class DatabaseMirror:
+    '''
+    Incremental copy of the fault database, or part of it, in a local directory.
+
+    The mirror has the layout of the database, so it can be used as the database
+    location of DatabaseClient (and of the GUI through SHAKERMAKER_DATABASE).
+    Files whose checksum is published and matches are not requested again; other
+    files are revalidated with conditional requests using the validators stored in
+    .mirror/state.json. Files are transferred by a pool of max_workers threads.
+    '''
+
+    def __init__(self, client, root, max_workers=8):
+        self.client = client
+        self.root = root
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self.state_file = os.path.join(root, '.mirror', 'state.json')  # noqa: PTH118
+        self.state = {'realizations': [], 'validators': {}}
+
+    def _local(self, path):
+        return os.path.join(self.root, *path.split('/'))  # noqa: PTH118
+
+    def _load_state(self):
+        try:
+            with open(self.state_file) as f:  # noqa: PTH123
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {'realizations': [], 'validators': {}}
+
+    def _save_state(self):
+        with open(self.state_file + '.part', 'w') as f:  # noqa: PTH123
+            json.dump(self.state, f, indent=4)
+        os.replace(self.state_file + '.part', self.state_file)
+
+    def fetch(self, path, checksum=None):
+        '''
+        Bring one database file up to date. Returns True if it was transferred and
+        False if the local copy was already current.
+        '''
+        local = self._local(path)
+        exists = os.path.exists(local)  # noqa: PTH110
+        if exists and checksum is not None and file_sha256(local) == checksum:
+            return False
+
+        headers = {'Accept-Encoding': 'identity'}
+        with self._lock:
+            validators = self.state['validators'].get(path, {})
+        if exists:
+            if 'etag' in validators:
+                headers['If-None-Match'] = validators['etag']
+            if 'last_modified' in validators:
+                headers['If-Modified-Since'] = validators['last_modified']
+
+        with self.client.get(path, ok_status=(200, 304), stream=True, headers=headers) as response:
+            if response.status_code == 304:  # noqa: PLR2004
+                return False
+            os.makedirs(os.path.dirname(local), exist_ok=True)  # noqa: PTH103, PTH120
+            try:
+                with open(local + '.part', 'wb') as f:  # noqa: PTH123
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        f.write(chunk)
+            except requests.exceptions.RequestException as e:
+                raise DatabaseError(f'{path}: {e}') from e  # noqa: EM102, TRY003
+            validators = {}
+            if 'ETag' in response.headers:
+                validators['etag'] = response.headers['ETag']
+            if 'Last-Modified' in response.headers:
+                validators['last_modified'] = response.headers['Last-Modified']
+
+        if checksum is not None and file_sha256(local + '.part') != checksum:
+            os.remove(local + '.part')  # noqa: PTH107
+            raise DatabaseError(f'{path}: checksum mismatch')  # noqa: EM102, TRY003
+        os.replace(local + '.part', local)
+        with self._lock:
+            self.state['validators'][path] = validators
+        return True
+
+    def _run(self, function, items):
+        # Apply function to items on the pool; return results and (item, message) errors
+        def call(item):
+            try:
+                return function(item), None
+            except (DatabaseError, OSError, ValueError, KeyError) as e:
+                return None, str(e)
+
+        workers = max(1, min(self.max_workers, len(items)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(call, items))
+        errors = [(item, error) for item, (_, error) in zip(items, results) if error is not None]
+        return [result for result, _ in results], errors
+
+    def sync(self, countries=None, faults=None, magnitudes=None, types=None):
+        '''
+        Mirror the realizations of the catalog matching the filters (all when no
+        filter is given). The mirrored catalog lists every realization mirrored so
+        far, including those of earlier syncs with other filters.
+
+        Returns a dict with the number of realizations, of files transferred and
+        unchanged, and the list of (path, message) errors.
+        '''
+        with mirror_lock(self.root):
+            self._load_state()
+            data = json.loads(self.client.get(MetadataStore.filename).content)
+            paths = catalog_realizations(data, countries, faults, magnitudes, types)
+
+            # faultInfo.json of every realization, then all of their files
+            def realization(path):
+                self.fetch(f'{path}/faultInfo.json')
+                with open(self._local(f'{path}/faultInfo.json')) as f:  # noqa: PTH123
+                    faultinfo = json.load(f)
+                checksums = realization_checksums(faultinfo)
+                bundles = faultinfo.get('bundles', [])
+                files = [(f'{path}/{name}', checksums.get(name)) for name in realization_files(faultinfo)]
+                files += [(f'{path}/{b["filename"]}', b.get('sha256')) for b in bundles]
+                return files
+
+            listed, errors = self._run(realization, paths)
+            files = [item for files in listed if files is not None for item in files]
+            transferred, file_errors = self._run(lambda item: self.fetch(*item), files)
+
+            # a realization is mirrored only when its faultInfo.json and all its files are
+            failed = {path for path, _message in errors}
+            failed |= {path.rsplit('/', 1)[0] for (path, _checksum), _message in file_errors}
+            errors += [(path, message) for (path, _checksum), message in file_errors]
+            mirrored = set(self.state['realizations']) | {p for p in paths if p not in failed}
+            self.state['realizations'] = sorted(mirrored)
+
+            catalog = self._local(MetadataStore.filename)
+            with open(catalog + '.part', 'w') as f:  # noqa: PTH123
+                json.dump(prune_catalog(data, mirrored), f, indent=4)
+            os.replace(catalog + '.part', catalog)
+            self._save_state()
+
+        return {
+            'realizations': len(paths),
+            'transferred': sum(1 for t in transferred if t),
+            'unchanged': sum(1 for t in transferred if t is False),
+            'errors': errors,
+        }
+
+
+# ======================================================================================
+# Metadata snapshot
+# ======================================================================================
+class MetadataStore:
+    '''
+    Persisted snapshot of DatabaseMetadata.json, the catalog of the database.
+
+    The snapshot is stored with the ETag and Last-Modified headers of the response
+    it came from, so refresh can revalidate it with a conditional request. When the
+    catalog has not changed the server answers 304 and nothing is downloaded or parsed.
+    '''
+
+    filename = 'DatabaseMetadata.json'
+
+    def __init__(self, root, client):
+        self.root = root
+        self.client = client
+        os.makedirs(root, exist_ok=True)  # noqa: PTH103
+
+    @property
+    def snapshot_file(self):
+        return os.path.join(self.root, self.filename)  # noqa: PTH118
+
+    @property
+    def headers_file(self):
+        return os.path.join(self.root, 'DatabaseMetadata.headers.json')  # noqa: PTH118
+
+    def load_snapshot(self):
+        '''
+        Return the saved catalog, or None if there is no usable snapshot.
+        '''
+        try:
+            with open(self.snapshot_file) as f:  # noqa: PTH123
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _validators(self):
+        try:
+            with open(self.headers_file) as f:  # noqa: PTH123
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def refresh(self):
+        '''
+        Revalidate the snapshot against the database.
+
+        Returns the new catalog if it changed, or None if the snapshot is current.
+        Raises DatabaseError if the database cannot be reached.
+        '''
+        headers = {}
+        if os.path.exists(self.snapshot_file):  # noqa: PTH110
+            validators = self._validators()
+            if 'etag' in validators:
+                headers['If-None-Match'] = validators['etag']
+            if 'last_modified' in validators:
+                headers['If-Modified-Since'] = validators['last_modified']
+
+        response = self.client.get(self.filename, ok_status=(200, 304), headers=headers)
+        if response.status_code == 304:  # noqa: PLR2004
+            response.close()
+            return None
+
+        content = response.content
+        try:
+            data = json.loads(content)
+        except ValueError as e:
+            raise DatabaseError(f'{self.filename}: {e}') from e  # noqa: EM102, TRY003
+
+        # Save the snapshot before its validators so a crash never pairs new
+        # validators with an old snapshot
+        with open(self.snapshot_file + '.part', 'wb') as f:  # noqa: PTH123
+            f.write(content)
+        os.replace(self.snapshot_file + '.part', self.snapshot_file)
+        validators = {}
+        if 'ETag' in response.headers:
+            validators['etag'] = response.headers['ETag']
+        if 'Last-Modified' in response.headers:
+            validators['last_modified'] = response.headers['Last-Modified']
+        with open(self.headers_file, 'w') as f:  # noqa: PTH123
+            json.dump(validators, f, indent=4)
+        return data
+
+
+# ======================================================================================
+# Local cache
+# ======================================================================================
+class RealizationCache:
+    '''
+    Content-addressed on-disk cache of database realizations.
+
+    Every file is stored once under objects/ by its SHA-256, so files shared by
+    several realizations (for example the source time function script) take space
+    once. A manifest per realization under realizations/ maps its file names to
+    content hashes and records when it was last used. When the stored objects exceed
+    max_bytes, the least recently used realizations are dropped together with the
+    objects no other realization references.
+
+    Objects are read-only and are copied (or reflinked) in and out of the cache,
+    never hard-linked, so writing to a checked-out file cannot alter the cache.
+    The manifests record the size and mtime of their objects; an object that no
+    longer matches is checked against its hash before it is handed out. Several
+    instances, in this process or others, can share a root: add, checkout and
+    evict hold an exclusive lock on the root.
+    '''
+
+    def __init__(self, root, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._lockfile = None
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)  # noqa: PTH103, PTH118
+        os.makedirs(os.path.join(root, 'realizations'), exist_ok=True)  # noqa: PTH103, PTH118
+
+    @contextmanager
+    def locked(self):
+        '''
+        Hold the lock of the cache root, shared with the other processes and
+        instances using it. Reentrant within an instance. Platforms without fcntl
+        are only locked within the instance.
+        '''
+        with self._lock:
+            if self._depth == 0:
+                try:
+                    import fcntl
+                except ImportError:
+                    fcntl = None
+                if fcntl is not None:
+                    self._lockfile = open(os.path.join(self.root, 'lock'), 'w')  # noqa: PTH118, PTH123, SIM115
+                    fcntl.flock(self._lockfile, fcntl.LOCK_EX)
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0 and self._lockfile is not None:
+                    self._lockfile.close()
+                    self._lockfile = None
+
+    def _object(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest)  # noqa: PTH118
+
+    def _manifest(self, path):
+        key = hashlib.sha256(path.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, 'realizations', f'{key}.json')  # noqa: PTH118
+
+    def _read_manifest(self, filename):
+        try:
+            with open(filename) as f:  # noqa: PTH123
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_manifest(self, filename, manifest):
+        partial = filename + '.part'
+        with open(partial, 'w') as f:  # noqa: PTH123
+            json.dump(manifest, f, indent=4)
+        os.replace(partial, filename)
+
+    def _fingerprint(self, digest):
+        # [size, mtime] of an object, None if it is missing
+        try:
+            st = os.stat(self._object(digest))  # noqa: PTH116
+        except OSError:
+            return None
+        return [st.st_size, st.st_mtime_ns]
+
+    @staticmethod
+    def _remove(filename):
+        # Read-only files cannot be removed or replaced on Windows
+        os.chmod(filename, stat.S_IREAD | stat.S_IWRITE)  # noqa: PTH101
+        os.remove(filename)  # noqa: PTH107
+
+    def _valid_object(self, digest, fingerprint=None, verify=False):
+        # Whether an object is present and intact. Like the checkpoints of the DRM
+        # pipeline, an object whose size and mtime match the recorded fingerprint is
+        # trusted; it is hashed again only on a mismatch or when verify is set.
+        current = self._fingerprint(digest)
+        if current is None:
+            return False
+        if not verify and fingerprint is not None and list(fingerprint) == current:
+            return True
+        if file_sha256(self._object(digest)) != digest:
+            # Corrupted object: drop it so the realization is downloaded again
+            self._remove(self._object(digest))
+            return False
+        return True
+
+    def lookup(self, path, verify=False):
+        '''
+        Return the manifest of a cached realization, or None if it is not cached
+        or one of its objects is missing or does not match its hash.
+
+        Objects unchanged since their fingerprint was recorded are not hashed
+        again, unless verify is set.
+        '''
+        with self.locked():
+            manifest = self._read_manifest(self._manifest(path))
+            if manifest is None:
+                return None
+            fingerprints = manifest.setdefault('fingerprints', {})
+            changed = False
+            for digest in manifest['files'].values():
+                recorded = fingerprints.get(digest)
+                if not self._valid_object(digest, recorded, verify):
+                    return None
+                current = self._fingerprint(digest)
+                if recorded != current:
+                    # Hashed again and intact; trust the new fingerprint from now on
+                    fingerprints[digest] = current
+                    changed = True
+            if changed:
+                self._write_manifest(self._manifest(path), manifest)
+            return manifest
+
+    def __contains__(self, path):
+        return self.lookup(path) is not None
+
+    def add(self, path, directory, filenames):
+        '''
+        Store files of directory as the realization at path.
+        '''
+        # Hash outside of the lock; the files of directory are not shared
+        digests = {}
+        for filename in filenames:
+            digests[filename] = file_sha256(os.path.join(directory, filename))  # noqa: PTH118
+
+        with self.locked():
+            fingerprints = {}
+            for filename, digest in digests.items():
+                target = self._object(digest)
+                if not self._valid_object(digest, verify=True):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)  # noqa: PTH103, PTH120
+                    if os.path.lexists(target + '.part'):  # noqa: PTH122
+                        self._remove(target + '.part')
+                    link_or_copy(os.path.join(directory, filename), target + '.part', hardlink=False)  # noqa: PTH118
+                    os.chmod(target + '.part', stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)  # noqa: PTH101
+                    os.replace(target + '.part', target)
+                fingerprints[digest] = self._fingerprint(digest)
+
+            manifest = {'path': path, 'files': digests, 'fingerprints': fingerprints, 'last_used': time.time()}
+            self._write_manifest(self._manifest(path), manifest)
+            self.evict(keep=path)
+            return manifest
+
+    def checkout(self, path, directory):
+        '''
+        Copy (or reflink) the files of a cached realization into directory.
+        Returns False if the realization is not cached.
+        '''
+        with self.locked():
+            manifest = self.lookup(path)
+            if manifest is None:
+                return False
+            for filename, digest in manifest['files'].items():
+                destination = os.path.join(directory, filename)  # noqa: PTH118
+                link_or_copy(self._object(digest), destination, hardlink=False)
+                os.chmod(destination, 0o644)  # noqa: PTH101
+            manifest['last_used'] = time.time()
+            self._write_manifest(self._manifest(path), manifest)
+            return True
+
+    def manifests(self):
+        '''
+        Return the manifests of all cached realizations.
+        '''
+        folder = os.path.join(self.root, 'realizations')  # noqa: PTH118
+        manifests = []
+        for name in os.listdir(folder):
+            if name.endswith('.json'):
+                manifest = self._read_manifest(os.path.join(folder, name))  # noqa: PTH118
+                if manifest is not None:
+                    manifests.append(manifest)
+        return manifests
+
+    def size(self):
+        '''
+        Return the total size in bytes of the stored objects.
+        '''
+        total = 0
+        for folder, _, names in os.walk(os.path.join(self.root, 'objects')):  # noqa: PTH118
+            total += sum(os.path.getsize(os.path.join(folder, name)) for name in names)  # noqa: PTH118, PTH202
+        return total
+
+    def evict(self, keep=None):
+        '''
+        Drop least recently used realizations until the objects fit in max_bytes,
+        never dropping the realization at path keep. Unreferenced objects are removed;
+        temporary .part files being written are left alone.
+        '''
+        with self.locked():
+            manifests = sorted(self.manifests(), key=lambda m: m['last_used'], reverse=True)
+            objects = {}
+            for folder, _, names in os.walk(os.path.join(self.root, 'objects')):  # noqa: PTH118
+                for name in names:
+                    if not name.endswith('.part'):
+                        objects[name] = os.path.getsize(os.path.join(folder, name))  # noqa: PTH118, PTH202
+
+            # Keep the most recently used realizations that fit in the cap
+            kept = set()
+            total = 0
+            for manifest in manifests:
+                digests = set(manifest['files'].values()) - kept
+                size = sum(objects.get(d, 0) for d in digests)
+                if manifest['path'] == keep or total + size <= self.max_bytes:
+                    kept |= digests
+                    total += size
+                else:
+                    os.remove(self._manifest(manifest['path']))  # noqa: PTH107
+
+            for digest in objects:
+                if digest not in kept:
+                    self._remove(self._object(digest))
+
+
+# ======================================================================================
+# Prefetch
+# ======================================================================================
+class RealizationPrefetcher:
+    '''
+    Low-priority background download of realizations into the cache.
+
+    request(paths) replaces the list of realizations to fetch; one worker thread
+    downloads them one file at a time, at most max_rate bytes per second. Foreground
+    loads run inside foreground(), which stops the current prefetch transfer and
+    holds the worker until every foreground load has finished. A stopped transfer
+    keeps its partial file, which the foreground load or a later prefetch resumes.
+    '''
+
+    def __init__(self, client, cache, max_rate=PREFETCH_MAX_RATE):
+        self.client = client
+        self.cache = cache
+        self.max_rate = max_rate
+        self.staging = os.path.join(cache.root, 'prefetch')  # noqa: PTH118
+        os.makedirs(self.staging, exist_ok=True)  # noqa: PTH103
+
+        self._pending = []
+        self._condition = threading.Condition()
+        self._busy = threading.Lock()
+        self._cancel = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._foreground = 0
+        self._stopped = False
+        self._thread = None
+
+        # Token bucket of the bandwidth cap
+        self._received = {}
+        self._budget_start = time.monotonic()
+        self._budget_bytes = 0
+
+    def request(self, paths):
+        '''
+        Prefetch the realizations at paths, in order, skipping cached ones. Pending
+        requests from an earlier call are dropped.
+        '''
+        with self._condition:
+            self._pending = list(paths)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='prefetch', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    @contextmanager
+    def foreground(self):
+        '''
+        Context for a foreground load: the prefetch transfer in progress is stopped
+        before the body runs and the worker waits until the body is done.
+        '''
+        with self._condition:
+            self._foreground += 1
+            self._idle.clear()
+            self._cancel.set()
+        # Wait for the worker to leave its transfer
+        with self._busy:
+            pass
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._foreground -= 1
+                if self._foreground == 0:
+                    self._cancel.clear()
+                    self._idle.set()
+                    self._condition.notify()
+
+    def close(self):
+        '''
+        Stop the worker thread.
+        '''
+        with self._condition:
+            self._stopped = True
+            self._pending = []
+            self._cancel.set()
+            self._idle.set()
+            self._condition.notify()
+
+    def _next(self):
+        with self._condition:
+            while not self._stopped and (not self._pending or self._foreground):
+                self._condition.wait()
+            if self._stopped:
+                return None
+            return self._pending.pop(0)
+
+    def _throttle(self, path, done, total):  # noqa: ARG002
+        # Sleep as long as the bytes received run ahead of max_rate
+        delta = done - self._received.get(path, 0)
+        self._received[path] = done
+        self._budget_bytes += delta
+        ahead = self._budget_bytes / self.max_rate - (time.monotonic() - self._budget_start)
+        if ahead > 0:
+            self._cancel.wait(ahead)
+
+    def _fetch(self, path):
+        directory = os.path.join(self.staging, hashlib.sha256(path.encode('utf-8')).hexdigest())  # noqa: PTH118
+        os.makedirs(directory, exist_ok=True)  # noqa: PTH103
+        try:
+            faultinfo = self.client.fetch_faultinfo(path, directory)
+            checksums = realization_checksums(faultinfo)
+            filenames = realization_files(faultinfo)
+            if realization_bundle(faultinfo) is not None:
+                self.client.download_bundle(path, faultinfo, directory, progress=self._throttle, cancel=self._cancel)
+                filenames = []
+            for filename in filenames:
+                self.client.download(
+                    f'{path}/{filename}',
+                    os.path.join(directory, filename),  # noqa: PTH118
+                    checksum=checksums.get(filename),
+                    progress=self._throttle,
+                    cancel=self._cancel,
+                )
+            self.cache.add(path, directory, ['faultInfo.json'] + realization_files(faultinfo))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _run(self):
+        while True:
+            path = self._next()
+            if path is None:
+                return
+            if path in self.cache:
+                continue
+            with self._busy:
+                if self._cancel.is_set():
+                    # A foreground load started; fetch this realization later
+                    with self._condition:
+                        if path not in self._pending:
+                            self._pending.insert(0, path)
+                    continue
+                self._received = {}
+                self._budget_start = time.monotonic()
+                self._budget_bytes = 0
+                try:
+                    self._fetch(path)
+                except DownloadCancelled:
+                    with self._condition:
+                        if not self._stopped and path not in self._pending:
+                            self._pending.insert(0, path)
+                except (DatabaseError, OSError):
+                    # Prefetching is best effort; a foreground load reports errors
+                    pass
+            self._idle.wait()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Maintenance tools for the fault database.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    pack = commands.add_parser(
+        'pack', help='pack the realizations of a local database checkout into bundles'
+    )
+    pack.add_argument('root', help='database checkout, or a single realization directory')
+    pack.add_argument(
+        '--compression',
+        nargs='+',
+        choices=BUNDLE_COMPRESSIONS,
+        default=['gz'],
+        help='bundle compressions to produce (zst needs the zstandard package)',
+    )
+    pack.add_argument('--level', type=int, default=None, help='compression level')
+
+    mirror = commands.add_parser(
+        'mirror', help='incrementally copy the database, or part of it, to a local directory'
+    )
+    mirror.add_argument('root', help='mirror directory, for example on a shared filesystem')
+    mirror.add_argument(
+        '--source',
+        default=None,
+        help='database URL or directory (default: SHAKERMAKER_DATABASE or the online database)',
+    )
+    mirror.add_argument('--country', nargs='+', default=None, help='only mirror these countries')
+    mirror.add_argument('--fault', nargs='+', default=None, help='only mirror these faults')
+    mirror.add_argument('--magnitude', nargs='+', default=None, help='only mirror these magnitudes')
+    mirror.add_argument('--type', nargs='+', default=None, help='only mirror these types')
+    mirror.add_argument('--workers', type=int, default=8, help='number of parallel transfers')
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        for directory, bundles in pack_database(args.root, args.compression, args.level):
+            print(f'{directory}: {", ".join(bundles)}')
+    elif args.command == 'mirror':
+        client = DatabaseClient(args.source, max_workers=args.workers)
+        summary = DatabaseMirror(client, args.root, max_workers=args.workers).sync(
+            args.country, args.fault, args.magnitude, args.type
+        )
+        print(
+            f'{summary["realizations"]} realizations: {summary["transferred"]} files transferred, '
+            f'{summary["unchanged"]} unchanged'
+        )
+        for path, message in summary['errors']:
+            print(f'Error: {path}: {message}')
+        sys.exit(1 if summary['errors'] else 0)
+    sys.exit(0)
@@ -0,0 +1,941 @@
+"""
+#############################################################
+# Fault source I/O shared by the ShakerMaker GUI and the    #
+# ShakerMakermodel.py script.                               #
+#                                                           #
+# A fault file is either the database JSON format (a list   #
+# of per-subfault dicts) or a columnar NPZ file holding one #
+# contiguous array per attribute plus an STF parameter      #
+# matrix. Uncompressed NPZ files are memory-mapped on load. #
+# ###########################################################
+"""
+
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+
+# Per-subfault scalar attributes stored as one float64 column each
+FAULT_COLUMNS = ('x', 'y', 'z', 'strike', 'dip', 'rake', 't0', 'slip')
+
+# Supported fault file formats (file extension)
+FAULT_FORMATS = ('json', 'npz')
+
+# Columnar format version written into every NPZ file
+FAULT_NPZ_VERSION = 1
+
+
+def fault_file_format(filename):
+    '''
+    Return the format of a fault file ("json" or "npz") based on its extension.
+    '''
+    return filename.split('.')[-1].lower()
+
+
+def faultsources_to_arrays(faultsources):
+    '''
+    Convert a list of per-subfault dicts (the JSON database format) into the
+    columnar representation.
+
+    The returned dict holds one float64 array per entry of FAULT_COLUMNS and
+    the source time function description:
+        stf_params     (n, k) float64, NaN padded parameter matrix
+        stf_nparams    (n,)   int32, number of valid parameters per subfault
+        stf_types      (m,)   unicode, distinct STF types
+        stf_type_index (n,)   int32, index into stf_types per subfault
+    '''
+    n = len(faultsources)
+    arrays = {name: np.empty(n, dtype=np.float64) for name in FAULT_COLUMNS}
+    stf_nparams = np.empty(n, dtype=np.int32)
+    stf_type_index = np.empty(n, dtype=np.int32)
+    stf_types = {}
+    params = []
+
+    for i, source in enumerate(faultsources):
+        for name in FAULT_COLUMNS:
+            arrays[name][i] = source[name]
+        stf = source['stf']
+        stf_nparams[i] = len(stf['parameters'])
+        stf_type_index[i] = stf_types.setdefault(stf['type'], len(stf_types))
+        params.append(stf['parameters'])
+
+    maxparams = int(stf_nparams.max()) if n > 0 else 0
+    stf_params = np.full((n, maxparams), np.nan, dtype=np.float64)
+    for i, p in enumerate(params):
+        stf_params[i, : len(p)] = p
+
+    arrays['stf_params'] = stf_params
+    arrays['stf_nparams'] = stf_nparams
+    arrays['stf_types'] = np.array(list(stf_types), dtype=np.str_)
+    arrays['stf_type_index'] = stf_type_index
+    return arrays
+
+
+def arrays_to_faultsources(arrays):
+    '''
+    Convert the columnar representation back to a list of per-subfault dicts
+    in the JSON database format.
+    '''
+    columns = {name: np.asarray(arrays[name]).tolist() for name in FAULT_COLUMNS}
+    stf_params = np.asarray(arrays['stf_params'])
+    stf_nparams = np.asarray(arrays['stf_nparams'])
+    stf_types = [str(t) for t in arrays['stf_types']]
+    stf_type_index = np.asarray(arrays['stf_type_index'])
+
+    faultsources = []
+    for i in range(len(columns['x'])):
+        source = {name: columns[name][i] for name in FAULT_COLUMNS}
+        nparams = int(stf_nparams[i])
+        source['stf'] = {
+            'type': stf_types[stf_type_index[i]],
+            'parameters': stf_params[i, :nparams].tolist(),
+            'numParameters': nparams,
+        }
+        faultsources.append(source)
+    return faultsources
+
+
+def num_fault_sources(arrays):
+    '''
+    Return the number of subfaults held in a columnar fault dict.
+    '''
+    return len(arrays['x'])
+
+
+def select_fault_sources(arrays, index):
+    '''
+    Return a new columnar fault dict with the subfaults selected by index
+    (a boolean mask or an integer index array).
+    '''
+    selected = {}
+    for name, array in arrays.items():
+        selected[name] = array if name == 'stf_types' else np.asarray(array)[index]
+    return selected
+
+
+def empty_fault_arrays(n, maxparams):
+    '''
+    Allocate a columnar fault dict for n subfaults and up to maxparams STF parameters.
+    The STF type table is left empty and is filled by copy_fault_arrays.
+    '''
+    arrays = {name: np.empty(n, dtype=np.float64) for name in FAULT_COLUMNS}
+    arrays['stf_params'] = np.full((n, maxparams), np.nan, dtype=np.float64)
+    arrays['stf_nparams'] = np.empty(n, dtype=np.int32)
+    arrays['stf_types'] = np.array([], dtype=np.str_)
+    arrays['stf_type_index'] = np.empty(n, dtype=np.int32)
+    return arrays
+
+
+def copy_fault_arrays(out, start, arrays):
+    '''
+    Copy the subfaults of arrays into the preallocated dict out, starting at row start.
+    The STF types of arrays are merged into the type table of out.
+    Returns the row following the copied subfaults.
+    '''
+    count = num_fault_sources(arrays)
+    stop = start + count
+    for name in FAULT_COLUMNS:
+        out[name][start:stop] = arrays[name]
+
+    params = np.asarray(arrays['stf_params'])
+    out['stf_params'][start:stop, : params.shape[1]] = params
+    out['stf_nparams'][start:stop] = arrays['stf_nparams']
+
+    stf_types = {str(t): i for i, t in enumerate(out['stf_types'])}
+    remap = np.array(
+        [stf_types.setdefault(str(t), len(stf_types)) for t in arrays['stf_types']],
+        dtype=np.int32,
+    )
+    if count > 0:
+        out['stf_type_index'][start:stop] = remap[np.asarray(arrays['stf_type_index'])]
+    out['stf_types'] = np.array(list(stf_types), dtype=np.str_)
+    return stop
+
+
+def concatenate_fault_arrays(arrays_list):
+    '''
+    Concatenate columnar fault dicts into a single one.
+
+    STF parameter matrices of different widths are NaN padded and the STF type
+    tables are merged.
+    '''
+    if len(arrays_list) == 0:
+        return faultsources_to_arrays([])
+
+    n = sum(num_fault_sources(a) for a in arrays_list)
+    maxparams = max(a['stf_params'].shape[1] for a in arrays_list)
+    out = empty_fault_arrays(n, maxparams)
+    start = 0
+    for a in arrays_list:
+        start = copy_fault_arrays(out, start, a)
+    return out
+
+
+def aggregate_fault_points(x, y, max_points=20000):
+    '''
+    Aggregate fault points on a regular grid so that at most about max_points remain.
+
+    Points falling in the same cell are replaced by their mean position. Returns the
+    aggregated x, y and the number of points of each cell. Point sets already smaller
+    than max_points are returned unchanged with unit counts.
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(x) <= max_points:
+        return x, y, np.ones(len(x), dtype=np.int64)
+
+    # Start with a cell size that would give max_points cells over the bounding box,
+    # then refine while the (often thin and elongated) fault occupies too few cells
+    xmin, ymin = x.min(), y.min()
+    extent = max(x.max() - xmin, y.max() - ymin)
+    if extent == 0:
+        return x[:1], y[:1], np.array([len(x)], dtype=np.int64)
+
+    cell = extent / np.sqrt(max_points)
+    previous = 0
+    for _ in range(12):
+        ix = ((x - xmin) / cell).astype(np.int64)
+        iy = ((y - ymin) / cell).astype(np.int64)
+        keys = ix * (int(iy.max()) + 1) + iy
+        cells, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        # Stop when enough cells are occupied or refining no longer separates points
+        if len(cells) > max_points / 2 or len(cells) == previous:
+            break
+        previous = len(cells)
+        cell = max(cell / np.sqrt(max_points / len(cells)), extent * 1e-6)
+
+    while len(cells) > max_points:
+        cell *= np.sqrt(len(cells) / max_points) * 1.05
+        ix = ((x - xmin) / cell).astype(np.int64)
+        iy = ((y - ymin) / cell).astype(np.int64)
+        keys = ix * (int(iy.max()) + 1) + iy
+        cells, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+
+    inverse = inverse.ravel()
+    xm = np.bincount(inverse, weights=x) / counts
+    ym = np.bincount(inverse, weights=y) / counts
+    return xm, ym, counts
+
+
+# ======================================================================================
+# Readers and writers
+# ======================================================================================
+def read_fault_json(filename):
+    '''
+    Read a JSON fault file into the columnar representation.
+    '''
+    with open(filename) as f:  # noqa: PTH123
+        faultsources = json.load(f)
+    if faultsources is None:
+        faultsources = []
+    return faultsources_to_arrays(faultsources)
+
+
+def write_fault_json(filename, arrays):
+    '''
+    Write the columnar representation as a JSON fault file.
+    '''
+    with open(filename, 'w') as f:  # noqa: PTH123
+        json.dump(arrays_to_faultsources(arrays), f, separators=(',', ':'))
+
+
+def write_fault_npz(filename, arrays, compressed=False):
+    '''
+    Write the columnar representation as an NPZ fault file.
+
+    Uncompressed files (the default) can be memory-mapped by read_fault_npz.
+    '''
+    data = {name: np.ascontiguousarray(arrays[name]) for name in arrays}
+    data['version'] = np.array(FAULT_NPZ_VERSION)
+    # np.savez appends .npz to names without the extension, write through a handle instead
+    with open(filename, 'wb') as f:  # noqa: PTH123
+        if compressed:
+            np.savez_compressed(f, **data)
+        else:
+            np.savez(f, **data)
+
+
+def _memmap_npz_member(filename, zf, info):
+    '''
+    Memory-map an uncompressed (stored) .npy member of an NPZ archive.
+    '''
+    with open(filename, 'rb') as f:  # noqa: PTH123
+        # The member data starts after the zip local file header
+        f.seek(info.header_offset)
+        header = f.read(30)
+        name_len = int.from_bytes(header[26:28], 'little')
+        extra_len = int.from_bytes(header[28:30], 'little')
+        f.seek(info.header_offset + 30 + name_len + extra_len)
+
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    if dtype.hasobject:
+        return None
+    if int(np.prod(shape)) == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(
+        filename,
+        dtype=dtype,
+        mode='r',
+        offset=offset,
+        shape=shape,
+        order='F' if fortran_order else 'C',
+    )
+
+
+def read_fault_npz(filename, mmap=True):
+    '''
+    Read an NPZ fault file into the columnar representation.
+
+    When mmap is True, members stored without compression are memory-mapped
+    instead of being read into memory.
+    '''
+    arrays = {}
+    with zipfile.ZipFile(filename) as zf:
+        for info in zf.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            array = None
+            if mmap and info.compress_type == zipfile.ZIP_STORED:
+                array = _memmap_npz_member(filename, zf, info)
+            if array is None:
+                with zf.open(info) as member:
+                    array = np.lib.format.read_array(member, allow_pickle=False)
+            arrays[name] = array
+
+    version = int(arrays.pop('version', 0))
+    if version > FAULT_NPZ_VERSION:
+        raise ValueError(  # noqa: TRY003
+            f'Fault file {filename} has format version {version}, '  # noqa: EM102
+            f'only versions up to {FAULT_NPZ_VERSION} are supported'
+        )
+    missing = [name for name in FAULT_COLUMNS if name not in arrays]
+    if missing:
+        raise ValueError(f'Fault file {filename} is missing the columns {missing}')  # noqa: EM102, TRY003
+    return arrays
+
+
+def load_fault_file(filename, mmap=True):
+    '''
+    Load a fault file of any supported format into the columnar representation.
+    '''
+    file_format = fault_file_format(filename)
+    if file_format == 'json':
+        return read_fault_json(filename)
+    if file_format == 'npz':
+        return read_fault_npz(filename, mmap=mmap)
+    raise ValueError(f'Unknown fault file format: {filename}')  # noqa: EM102, TRY003
+
+
+def write_fault_file(filename, arrays):
+    '''
+    Write the columnar representation in the format given by the file extension.
+    '''
+    file_format = fault_file_format(filename)
+    if file_format == 'json':
+        write_fault_json(filename, arrays)
+    elif file_format == 'npz':
+        write_fault_npz(filename, arrays)
+    else:
+        raise ValueError(f'Unknown fault file format: {filename}')  # noqa: EM102, TRY003
+
+
+# ======================================================================================
+# Streaming readers
+# ======================================================================================
+# Separators skipped between the elements of the top level JSON list
+_JSON_SEPARATORS = re.compile(r'[\s,]*')
+
+
+def iter_fault_json(filename, block_size=1 << 20):
+    '''
+    Yield the subfault dicts of a JSON fault file one at a time.
+
+    The file is read in blocks of block_size characters and decoded incrementally,
+    so only the current block and subfault are held in memory.
+    '''
+    decoder = json.JSONDecoder()
+    with open(filename) as f:  # noqa: PTH123
+        buffer = f.read(block_size)
+        pos = _JSON_SEPARATORS.match(buffer).end()
+        if buffer[pos : pos + 4] == 'null':
+            return
+        if buffer[pos : pos + 1] != '[':
+            raise ValueError(f'Fault file {filename} is not a JSON list')  # noqa: EM102, TRY003
+        pos += 1
+        eof = False
+
+        while True:
+            pos = _JSON_SEPARATORS.match(buffer, pos).end()
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                source, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The subfault is split over the end of the block
+                if eof:
+                    raise
+                source = None
+            if source is None or (end == len(buffer) and not eof):
+                # Read the next block, dropping what has already been decoded
+                block = f.read(block_size)
+                eof = block == ''
+                buffer = buffer[pos:] + block
+                pos = 0
+                continue
+            pos = end
+            yield source
+
+
+def iter_fault_chunks(filename, chunk_size=10000, minslip=None):
+    '''
+    Yield the subfaults of a fault file as columnar dicts of at most chunk_size rows.
+
+    When minslip is given only subfaults with slip > minslip are yielded. Memory
+    use depends on chunk_size and not on the size of the file: JSON files are
+    decoded incrementally and NPZ files are memory-mapped and sliced.
+    '''
+    file_format = fault_file_format(filename)
+
+    if file_format == 'npz':
+        arrays = read_fault_npz(filename, mmap=True)
+        for start in range(0, num_fault_sources(arrays), chunk_size):
+            chunk = select_fault_sources(arrays, slice(start, start + chunk_size))
+            if minslip is not None:
+                chunk = select_fault_sources(chunk, chunk['slip'] > minslip)
+            if num_fault_sources(chunk) > 0:
+                yield chunk
+        return
+
+    if file_format != 'json':
+        raise ValueError(f'Unknown fault file format: {filename}')  # noqa: EM102, TRY003
+
+    sources = []
+    for source in iter_fault_json(filename):
+        if minslip is not None and not source['slip'] > minslip:
+            continue
+        sources.append(source)
+        if len(sources) == chunk_size:
+            yield faultsources_to_arrays(sources)
+            sources = []
+    if sources:
+        yield faultsources_to_arrays(sources)
+
+
+def count_fault_sources(filename, minslip=None):
+    '''
+    Count the subfaults of a fault file with slip > minslip without decoding them.
+
+    Returns (count, maxparams) where maxparams is the widest STF parameter list.
+    NPZ files are counted from their memory-mapped slip column; JSON files are
+    streamed once, keeping only the running counts.
+    '''
+    file_format = fault_file_format(filename)
+
+    if file_format == 'npz':
+        arrays = read_fault_npz(filename, mmap=True)
+        count = num_fault_sources(arrays)
+        if minslip is not None:
+            count = int(np.count_nonzero(np.asarray(arrays['slip']) > minslip))
+        return count, arrays['stf_params'].shape[1]
+
+    if file_format != 'json':
+        raise ValueError(f'Unknown fault file format: {filename}')  # noqa: EM102, TRY003
+
+    count = 0
+    maxparams = 0
+    for source in iter_fault_json(filename):
+        if minslip is not None and not source['slip'] > minslip:
+            continue
+        count += 1
+        maxparams = max(maxparams, len(source['stf']['parameters']))
+    return count, maxparams
+
+
+def read_fault_sources(filename, minslip=None, chunk_size=10000):
+    '''
+    Read the subfaults of a fault file with slip > minslip into packed columnar arrays.
+
+    The file is counted first, then streamed with iter_fault_chunks straight into
+    the preallocated arrays, so only the kept subfaults and one decoded chunk are
+    held in memory.
+    '''
+    return assemble_fault_sources([filename], minslip=minslip, chunk_size=chunk_size)[0]
+
+
+def assemble_fault_sources(filenames, minslip=None, chunk_size=10000):
+    '''
+    Assemble the subfaults of every fault segment file into one set of columnar arrays.
+
+    The kept subfaults (slip > minslip) of all segments are counted first with
+    count_fault_sources, then the output arrays are allocated once and every
+    segment is streamed into them with iter_fault_chunks. Peak memory is the output
+    arrays plus one decoded chunk; JSON segments are decoded twice to achieve this.
+
+    Returns (arrays, counts) where counts[i] is the number of subfaults kept from
+    filenames[i]. Rows of arrays are ordered by segment.
+    '''
+    # First pass: count the kept subfaults of every segment
+    sizes = [count_fault_sources(filename, minslip=minslip) for filename in filenames]
+    counts = [count for count, _ in sizes]
+    maxparams = max((maxparams for _, maxparams in sizes), default=0)
+
+    # Second pass: fill the preallocated arrays chunk by chunk
+    out = empty_fault_arrays(sum(counts), maxparams)
+    start = 0
+    for filename, count in zip(filenames, counts):
+        stop = start + count
+        for chunk in iter_fault_chunks(filename, chunk_size=chunk_size, minslip=minslip):
+            start = copy_fault_arrays(out, start, chunk)
+        if start != stop:
+            raise ValueError(f'Fault file {filename} changed while it was read')  # noqa: EM102, TRY003
+    return out, counts
+
+
+# ======================================================================================
+# Source time functions
+# ======================================================================================
+def stf_parameter_keys(arrays, type_codes=None):
+    '''
+    Return one hashable byte key per subfault identifying its STF type and parameters.
+
+    type_codes maps the entries of arrays['stf_types'] to codes shared by several
+    sets of arrays (whose type tables may differ); by default the type index is used.
+    '''
+    params = np.nan_to_num(np.asarray(arrays['stf_params'], dtype=np.float64), nan=0.0)
+    types = np.asarray(arrays['stf_type_index'])
+    if type_codes is not None:
+        types = np.asarray(type_codes)[types] if len(types) else types
+    keys = np.column_stack(
+        [
+            np.asarray(types, dtype=np.float64),
+            np.asarray(arrays['stf_nparams'], dtype=np.float64),
+            params,
+        ]
+    )
+    keys = np.ascontiguousarray(keys)
+    return keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+
+
+def database_stf_batch(params, a=1.0, b=100.0):
+    '''
+    Vectorized source time function of the fault database realizations.
+
+    params is the (m, 5) matrix of the parameters Tp, Te, Tr, dt and slip of the
+    database SourceTimeFunction.py. Returns (data, lengths, dt) as expected by
+    SourceTimeFunctionEngine: the zero padded (m, nmax) slip rates, the number of
+    samples of every row (that of np.arange(0, Tr, dt)) and the time steps.
+    '''
+    params = np.asarray(params, dtype=np.float64)
+    tp, te, tr, dt, slip = (params[:, k, None] for k in range(5))
+    lengths = np.ceil(tr[:, 0] / dt[:, 0]).astype(np.int64)
+    t = np.arange(lengths.max(initial=0), dtype=np.float64)[None, :] * dt
+    valid = np.arange(t.shape[1])[None, :] < lengths[:, None]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rise = t / tp * np.sqrt(a + b / tp**2) * np.sin(np.pi * t / (2 * tp))
+        plateau = np.sqrt(a + b / t**2)
+        fall = plateau * np.sin(5 / 3 * np.pi * (tr - t) / tr)
+    svf = np.where(t < tp, rise, np.where(t < te, plateau, fall))
+    svf = np.where(valid, svf, 0.0)
+
+    # Trapezoidal area of the valid samples of every row
+    rows = np.arange(len(params))
+    last = svf[rows, np.maximum(lengths - 1, 0)]
+    area = (svf.sum(axis=1) - (svf[:, 0] + last) / 2) * dt[:, 0]
+    data = svf / area[:, None] * slip
+    return data, lengths, dt[:, 0]
+
+
+def _stf_samples(stf):
+    # (data, t) of a Discrete object, None if they are not exposed
+    for data, t in (('data', 't'), ('_data', '_t')):
+        if hasattr(stf, data) and hasattr(stf, t):
+            return np.asarray(getattr(stf, data)), np.asarray(getattr(stf, t))
+    return None
+
+
+class SourceTimeFunctionEngine:
+    '''
+    Build source time functions once per distinct parameter set.
+
+    source_time_function(*params) is the function of the SourceTimeFunction.py file
+    of the realization and returns a Discrete object. Subfaults with identical STF
+    parameters share one object, and objects are memoized across calls to evaluate,
+    so the work and memory scale with the number of distinct STFs.
+
+    If SourceTimeFunction.py also provides a vectorized
+        source_time_function_batch(params) -> (data, lengths, dt)
+    taking the (m, k) matrix of distinct parameter sets and returning a zero padded
+    (m, nmax) slip rate matrix, the number of valid samples per row and the time step
+    (scalar or per row), all distinct STFs are evaluated in one call and each Discrete
+    object is built on views into that shared buffer.
+
+    Otherwise database_stf_batch is used, once it has reproduced the output of
+    source_time_function for the first distinct parameter set; realizations with
+    another source time function are evaluated one parameter set at a time.
+    '''
+
+    def __init__(self, source_time_function, discrete=None, batch_function=None):
+        self.source_time_function = source_time_function
+        self.discrete = discrete
+        self.batch_function = batch_function if discrete is not None else None
+        # database_stf_batch stands in for a missing batch function once verified
+        self._candidate = database_stf_batch if discrete is not None and batch_function is None else None
+        self.nsources = 0
+        self._cache = {}
+        self._buffers = []
+        # STF type names to codes, shared by the arrays of every call
+        self._types = {}
+
+    def _verify_candidate(self, params):
+        # Compare the candidate batch function with source_time_function on params
+        candidate, self._candidate = self._candidate, None
+        expected = _stf_samples(self.source_time_function(*params))
+        if expected is None or len(params) != 5:  # noqa: PLR2004
+            return
+        try:
+            data, lengths, dt = candidate(np.asarray(params, dtype=np.float64)[None, :])
+        except (ValueError, IndexError, FloatingPointError):
+            return
+        n = int(lengths[0])
+        times = np.arange(n, dtype=np.float64) * float(np.ravel(dt)[0])
+        if (
+            n == len(expected[0]) == len(expected[1])
+            and np.allclose(data[0, :n], expected[0], rtol=1e-9, atol=1e-12)
+            and np.allclose(times, expected[1], rtol=1e-9, atol=1e-12)
+        ):
+            self.batch_function = candidate
+
+    def evaluate(self, arrays):
+        '''
+        Return (stfs, inverse): the distinct STF objects of the subfaults in arrays
+        and, for every subfault, the index of its STF in stfs.
+        '''
+        type_codes = [self._types.setdefault(str(t), len(self._types)) for t in arrays['stf_types']]
+        keys = stf_parameter_keys(arrays, type_codes)
+        unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        unique_bytes = [key.tobytes() for key in unique]
+        self.nsources += len(keys)
+
+        stf_params = np.asarray(arrays['stf_params'])
+        stf_nparams = np.asarray(arrays['stf_nparams'])
+        missing = [i for i, key in enumerate(unique_bytes) if key not in self._cache]
+
+        if missing and self._candidate is not None:
+            row = first[missing[0]]
+            self._verify_candidate(stf_params[row, : stf_nparams[row]])
+
+        batch = self.batch_function
+        if batch is database_stf_batch and (
+            len(arrays['stf_types']) > 1 or (stf_nparams[first[missing]] != 5).any()  # noqa: PLR2004
+        ):
+            # Only the single five-parameter STF it was verified on is batched
+            batch = None
+
+        if missing and batch is not None:
+            params = stf_params[first[missing]]
+            data, lengths, dt = batch(params)
+            data = np.asarray(data, dtype=np.float64)
+            dt = np.broadcast_to(np.asarray(dt, dtype=np.float64), (len(missing),))
+            times = np.arange(data.shape[1], dtype=np.float64)[None, :] * dt[:, None]
+            self._buffers.append((data, times))
+            for row, i in enumerate(missing):
+                n = int(lengths[row])
+                self._cache[unique_bytes[i]] = self.discrete(data[row, :n], times[row, :n])
+        else:
+            for i in missing:
+                row = first[i]
+                params = stf_params[row, : stf_nparams[row]]
+                self._cache[unique_bytes[i]] = self.source_time_function(*params)
+
+        stfs = [self._cache[key] for key in unique_bytes]
+        return stfs, inverse.ravel()
+
+    @property
+    def ndistinct(self):
+        '''
+        Number of distinct source time functions built so far.
+        '''
+        return len(self._cache)
+
+
+# ======================================================================================
+# MPI distribution
+# ======================================================================================
+# Largest message sent in a single MPI call (MPI counts are 32-bit integers)
+_MPI_MAX_BYTES = 1 << 30
+
+
+def broadcast_fault_arrays(comm, arrays, root=0):
+    '''
+    Broadcast columnar fault arrays from the root rank to every rank of comm.
+
+    Only the root rank needs to pass the arrays, the others pass None. The layout
+    (names, dtypes, shapes and STF types) is sent once and each numeric array is sent
+    as one contiguous buffer, so no rank has to touch the fault files.
+    '''
+    rank = comm.Get_rank()
+    if rank == root:
+        layout = {
+            name: (np.asarray(array).dtype.str, np.asarray(array).shape)
+            for name, array in arrays.items()
+            if name != 'stf_types'
+        }
+        header = (layout, [str(t) for t in arrays['stf_types']])
+    else:
+        header = None
+    layout, stf_types = comm.bcast(header, root=root)
+
+    received = {}
+    for name, (dtype, shape) in layout.items():
+        if rank == root:
+            buffer = np.ascontiguousarray(arrays[name])
+        else:
+            buffer = np.empty(shape, dtype=np.dtype(dtype))
+        raw = buffer.reshape(-1).view(np.uint8)
+        for start in range(0, raw.size, _MPI_MAX_BYTES):
+            comm.Bcast(raw[start : start + _MPI_MAX_BYTES], root=root)
+        received[name] = buffer
+    received['stf_types'] = np.array(stf_types, dtype=np.str_)
+    return received
+
+
+def broadcast_fault_chunks(comm, arrays, chunk_size=10000, root=0):
+    '''
+    Broadcast columnar fault arrays from the root rank in chunks of chunk_size rows.
+
+    Yields the chunks on every rank, so the ranks other than root never hold more
+    than one chunk of the packed arrays. Only the root rank passes the arrays.
+    '''
+    rank = comm.Get_rank()
+    n = comm.bcast(num_fault_sources(arrays) if rank == root else None, root=root)
+    for start in range(0, n, chunk_size):
+        chunk = select_fault_sources(arrays, slice(start, start + chunk_size)) if rank == root else None
+        yield broadcast_fault_arrays(comm, chunk, root=root)
+
+
+# ======================================================================================
+# Staging
+# ======================================================================================
+# Linux ioctl request for cloning a file (reflink) on btrfs/xfs
+_FICLONE = 0x40049409
+
+
+def link_or_copy(source, destination, hardlink=True):
+    '''
+    Place source at destination without rewriting its content when possible.
+
+    A hard link is tried first, then a reflink (copy-on-write clone) and finally
+    a regular copy. An existing destination is replaced, never written through,
+    so a previously linked file is not modified. With hardlink=False the
+    destination never shares its inode with source, so writing to one cannot
+    change the other.
+    '''
+    if os.path.lexists(destination):  # noqa: PTH122
+        if os.path.exists(destination) and os.path.samefile(source, destination):  # noqa: PTH110
+            return destination
+        os.remove(destination)  # noqa: PTH107
+
+    if hardlink:
+        try:
+            os.link(source, destination)
+            return destination
+        except OSError:
+            pass
+
+    try:
+        import fcntl
+
+        with open(source, 'rb') as src, open(destination, 'wb') as dst:  # noqa: PTH123
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        shutil.copystat(source, destination)
+        return destination
+    except (ImportError, OSError):
+        pass
+
+    shutil.copy2(source, destination)
+    return destination
+
+
+def stage_fault_file(filename, directory, minslip=0.0, arrays=None):
+    '''
+    Stage a fault file into a model directory, keeping subfaults with slip > minslip.
+
+    When the filter removes nothing, the file is linked into the directory unchanged.
+    Otherwise the kept subfaults are written as an uncompressed NPZ file. The
+    arrays of the file can be given to avoid decoding it again.
+
+    Returns (staged file name, number of kept subfaults, number of subfaults).
+    '''
+    if arrays is None:
+        arrays = load_fault_file(filename)
+    total = num_fault_sources(arrays)
+    basename = os.path.basename(filename)  # noqa: PTH119
+
+    keep = None
+    if minslip > 0:
+        keep = np.asarray(arrays['slip']) > minslip
+        if keep.all():
+            keep = None
+
+    if keep is None:
+        link_or_copy(filename, os.path.join(directory, basename))  # noqa: PTH118
+        return basename, total, total
+
+    staged = os.path.splitext(basename)[0] + '.npz'  # noqa: PTH122
+    destination = os.path.join(directory, staged)  # noqa: PTH118
+    if os.path.lexists(destination):  # noqa: PTH122
+        os.remove(destination)  # noqa: PTH107
+    write_fault_npz(destination, select_fault_sources(arrays, keep))
+    return staged, int(np.count_nonzero(keep)), total
+
+
+# ======================================================================================
+# Fault source store
+# ======================================================================================
+class FaultSourceStore:
+    '''
+    In-memory cache of decoded fault files.
+
+    Entries are keyed by the absolute path, size and modification time of the file,
+    so an edited or replaced file is decoded again. The total size of the cached
+    arrays is kept below max_bytes by evicting the least recently used files.
+    Cached arrays are shared between callers and are marked read-only. The store
+    can be used from several threads; files are decoded outside of the lock.
+    '''
+
+    def __init__(self, max_bytes=2 * 1024**3):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def file_key(filename):
+        '''
+        Return the (path, size, mtime) key identifying the current content of a file.
+        '''
+        stat = os.stat(filename)  # noqa: PTH116
+        return (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)  # noqa: PTH100
+
+    def get(self, filename):
+        '''
+        Return the columnar arrays of a fault file, decoding it only on a cache miss.
+        '''
+        key = self.file_key(filename)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+
+        arrays = load_fault_file(filename)
+        for array in arrays.values():
+            array.flags.writeable = False
+        nbytes = sum(array.nbytes for array in arrays.values())
+
+        with self._lock:
+            # Drop older versions of the same file before inserting the new one
+            for old_key in [k for k in self._entries if k[0] == key[0]]:
+                self.nbytes -= self._entries.pop(old_key)[1]
+
+            self._entries[key] = (arrays, nbytes)
+            self.nbytes += nbytes
+            self._evict()
+        return arrays
+
+    def _evict(self):
+        # Always keep the most recent entry, even if it alone exceeds the cap
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self.nbytes -= nbytes
+
+    def clear(self):
+        '''
+        Remove all cached fault files.
+        '''
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# ======================================================================================
+# Converter
+# ======================================================================================
+def convert_fault_file(filename, output=None):
+    '''
+    Convert a JSON fault file to the columnar NPZ format.
+    Returns the name of the written file.
+    '''
+    if output is None:
+        output = os.path.splitext(filename)[0] + '.npz'  # noqa: PTH122
+    write_fault_npz(output, read_fault_json(filename))
+    return output
+
+
+def convert_realization(faultinfo_filename, remove_json=False):
+    '''
+    Convert every fault file listed in a faultInfo.json to NPZ and point the
+    "Faultfilenames" entry of the faultInfo.json to the converted files.
+    '''
+    directory = os.path.dirname(os.path.abspath(faultinfo_filename))  # noqa: PTH100, PTH120
+    with open(faultinfo_filename) as f:  # noqa: PTH123
+        faultinfo = json.load(f)
+
+    converted = []
+    for filename in faultinfo['Faultfilenames']:
+        if fault_file_format(filename) != 'json':
+            converted.append(filename)
+            continue
+        source = os.path.join(directory, filename)  # noqa: PTH118
+        output = convert_fault_file(source)
+        converted.append(os.path.basename(output))  # noqa: PTH119
+        if remove_json:
+            os.remove(source)  # noqa: PTH107
+
+    # Replace the file rather than truncating it, as it may be linked elsewhere
+    faultinfo['Faultfilenames'] = converted
+    with open(faultinfo_filename + '.part', 'w') as f:  # noqa: PTH123
+        json.dump(faultinfo, f, indent=4)
+    os.replace(faultinfo_filename + '.part', faultinfo_filename)
+    return converted
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Convert JSON fault files to the columnar NPZ fault format.'
+    )
+    parser.add_argument(
+        'files',
+        nargs='+',
+        help='JSON fault files, or faultInfo.json files to convert a whole realization',
+    )
+    parser.add_argument(
+        '--remove-json',
+        action='store_true',
+        help='remove the JSON fault files of a realization after conversion',
+    )
+    args = parser.parse_args()
+
+    for filename in args.files:
+        if os.path.basename(filename) == 'faultInfo.json':  # noqa: PTH119
+            files = convert_realization(filename, remove_json=args.remove_json)
+            print(f'{filename}: {len(files)} fault files converted')
+        else:
+            print(f'{filename} -> {convert_fault_file(filename)}')
+    sys.exit(0)
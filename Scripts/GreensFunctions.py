@@ -0,0 +1,526 @@
+"""
+#############################################################
+# Checkpoints of the DRM pipeline of ShakerMakermodel.py.   #
+#                                                           #
+# The pairs, the Green's function database and the DRM load #
+# are computed in three phases. A manifest is written after #
+# each phase with a key of its inputs and the files it      #
+# produced; on restart, phases whose manifest still matches #
+# their inputs and files are skipped. Databases can be kept #
+# in a shared store and reused by models of the same site.  #
+# ###########################################################
+"""
+
+import glob
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from FaultSources import link_or_copy
+
+# Phases of the DRM pipeline, in order
+PHASES = ('pairs', 'database', 'drm')
+
+# Directory of the manifests of the phases
+MANIFEST_DIRECTORY = 'results/manifests'
+
+# Default size cap of a shared Green's function database store
+STORE_MAX_BYTES = 500 * 1024**3
+
+# Source positions as rows, for the subset test of the store
+_POSITION = np.dtype([('x', 'f8'), ('y', 'f8'), ('z', 'f8')])
+
+# Coordinates of the pairs of a database written by gen_greens_function_database_pairs:
+# horizontal distance, receiver depth and source depth
+PAIR_FIELDS = ('dh_of_pairs', 'zrec_of_pairs', 'zsrc_of_pairs')
+
+# Datasets of a database with one entry per pair that do not depend on the geometry
+PAIR_DATASETS = PAIR_FIELDS + ('dv_of_pairs',)
+
+# Dataset of a database with the (station, source) indices of the combination each
+# pair was computed from, which refer to the geometry of the model
+PAIR_INDEX = 'pairs_to_compute'
+
+# Group of the Green's functions of a database, members named "<pair>_<name>"
+GF_GROUP = 'tdata_dict'
+
+# Attribute of a database with the digest of the parameters it was computed with
+PARAMETERS_ATTRIBUTE = 'gf_parameters'
+
+
+def digest(*items):
+    '''
+    Return the sha256 hex digest of items: numpy arrays (dtype, shape and data),
+    bytes, or JSON serializable values (with sorted keys).
+    '''
+    h = hashlib.sha256()
+    for item in items:
+        if isinstance(item, np.ndarray):
+            h.update(f'{item.dtype.str}{item.shape}'.encode())
+            h.update(np.ascontiguousarray(item).tobytes())
+        elif isinstance(item, bytes):
+            h.update(item)
+        else:
+            h.update(json.dumps(item, sort_keys=True, default=float).encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def pipeline_keys(parameters, geometry, fault):
+    '''
+    Return the key of every phase of the DRM pipeline.
+
+    parameters holds the crust and the frequency-wavenumber and delta parameters,
+    geometry the digest of the source and receiver positions and fault the digest
+    of everything else about the sources (mechanisms, times, source time
+    functions). The keys are chained, so a change of the inputs of a phase also
+    invalidates the phases after it.
+    '''
+    pairs = digest('pairs', parameters, geometry)
+    database = digest('database', pairs)
+    drm = digest('drm', database, fault)
+    return {'pairs': pairs, 'database': database, 'drm': drm}
+
+
+def fingerprint(path):
+    '''
+    Return the size and modification time of a file; the files of a phase are
+    too large to be hashed on every restart.
+    '''
+    st = os.stat(path)
+    return {'path': path, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def artifact_files(*patterns):
+    '''
+    Return the sorted files matching the glob patterns.
+    '''
+    return sorted({path for pattern in patterns for path in glob.glob(pattern) if os.path.isfile(path)})  # noqa: PTH113, PTH207
+
+
+def detach(paths):
+    '''
+    Replace hard-linked files by private copies, so a phase that writes them in
+    place leaves the other links (a shared store) unchanged.
+    '''
+    for path in paths:
+        if os.stat(path).st_nlink > 1:
+            shutil.copy2(path, path + '.detach')
+            os.replace(path + '.detach', path)
+
+
+class PipelineCheckpoint:
+    '''
+    Manifests of the phases of the DRM pipeline.
+
+    A manifest records the key of the inputs of a phase and the fingerprints of
+    the files it produced. It is valid while the key is the same and the files are
+    unchanged. Only one process (rank 0) should read and write the manifests.
+    '''
+
+    def __init__(self, directory=MANIFEST_DIRECTORY):
+        self.directory = directory
+
+    def manifest_path(self, phase):
+        return os.path.join(self.directory, f'{phase}.json')  # noqa: PTH118
+
+    def load(self, phase):
+        try:
+            with open(self.manifest_path(phase)) as file:  # noqa: PTH123
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def is_valid(self, phase, key):
+        '''
+        Whether the manifest of phase matches key and its files are unchanged.
+        '''
+        manifest = self.load(phase)
+        if manifest is None or manifest.get('key') != key or not manifest.get('artifacts'):
+            return False
+        for artifact in manifest['artifacts']:
+            try:
+                if fingerprint(artifact['path']) != artifact:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def completed(self, keys):
+        '''
+        Return the set of phases that need not run again for the phase keys.
+
+        A later phase may modify the files of an earlier one, so the phases are
+        checked from the last: a valid phase completes every phase before it.
+        '''
+        for n in range(len(PHASES), 0, -1):
+            phase = PHASES[n - 1]
+            if self.is_valid(phase, keys[phase]):
+                return set(PHASES[:n])
+        return set()
+
+    def invalidate(self, phase):
+        '''
+        Remove the manifests of phase and of the phases after it, before it runs.
+        '''
+        for later in PHASES[PHASES.index(phase) :]:
+            try:
+                os.remove(self.manifest_path(later))  # noqa: PTH107
+            except FileNotFoundError:
+                pass
+
+    def record(self, phase, key, artifacts, elapsed=None):
+        '''
+        Write the manifest of a completed phase with the fingerprints of the files
+        it produced.
+        '''
+        os.makedirs(self.directory, exist_ok=True)  # noqa: PTH103
+        manifest = {
+            'phase': phase,
+            'key': key,
+            'completed': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'elapsed': elapsed,
+            'artifacts': [fingerprint(path) for path in artifacts],
+        }
+        path = self.manifest_path(phase)
+        with open(path + '.tmp', 'w') as file:  # noqa: PTH123
+            json.dump(manifest, file, indent=4)
+        os.replace(path + '.tmp', path)
+        return manifest
+
+
+# ======================================================================================
+# Shared Green's function databases
+# ======================================================================================
+def _positions(points):
+    # Sorted unique rows of an (n, 3) array of positions
+    points = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 3)
+    return np.unique(points.view(_POSITION).ravel())
+
+
+class GreensFunctionStore:
+    '''
+    Shared on-disk store of Green's function databases.
+
+    A database depends on the crust, the frequency-wavenumber and delta parameters
+    and the source and receiver positions, not on the slip or the source time
+    functions. Databases are stored under root/<key>/<sources>/, key being the
+    digest of the parameters and of the receivers, with the source positions they
+    were computed for: a model whose sources are a subset of them uses the database
+    as is. When the stored databases exceed max_bytes, the least recently used ones
+    are removed. Only one process (rank 0) of a model should use the store.
+    '''
+
+    def __init__(self, root, max_bytes=STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)  # noqa: PTH103
+
+    def _read_entry(self, entry):
+        try:
+            with open(os.path.join(entry, 'entry.json')) as file:  # noqa: PTH118, PTH123
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_entry(self, entry, info):
+        path = os.path.join(entry, 'entry.json')  # noqa: PTH118
+        with open(path + '.tmp', 'w') as file:  # noqa: PTH123
+            json.dump(info, file, indent=4)
+        os.replace(path + '.tmp', path)
+
+    def entries(self):
+        '''
+        Return the (directory, info) of every complete stored database.
+        '''
+        entries = []
+        for key in os.listdir(self.root):
+            folder = os.path.join(self.root, key)  # noqa: PTH118
+            if not os.path.isdir(folder):  # noqa: PTH112
+                continue
+            for name in os.listdir(folder):
+                if name.endswith('.part'):
+                    continue
+                entry = os.path.join(folder, name)  # noqa: PTH118
+                info = self._read_entry(entry)
+                if info is not None:
+                    entries.append((entry, info))
+        return entries
+
+    def lookup(self, key, sources):
+        '''
+        Return the directory of the smallest stored database of key computed for a
+        superset of the source positions, or None.
+        '''
+        folder = os.path.join(self.root, key)  # noqa: PTH118
+        if not os.path.isdir(folder):  # noqa: PTH112
+            return None
+        sources = _positions(sources)
+        found = None
+        for name in os.listdir(folder):
+            if name.endswith('.part'):
+                continue
+            entry = os.path.join(folder, name)  # noqa: PTH118
+            info = self._read_entry(entry)
+            if info is None or (found is not None and info['size'] >= found[1]['size']):
+                continue
+            if not all(os.path.exists(os.path.join(entry, f)) for f in info['files']):  # noqa: PTH110, PTH118
+                continue
+            try:
+                stored = np.load(os.path.join(entry, 'sources.npy'))  # noqa: PTH118
+            except (OSError, ValueError):
+                continue
+            if len(sources) <= len(stored) and np.isin(sources, stored).all():
+                found = (entry, info)
+        return None if found is None else found[0]
+
+    def checkout(self, entry, directory):
+        '''
+        Link the files of a stored database into directory and return their paths.
+        '''
+        info = self._read_entry(entry)
+        paths = []
+        for name in info['files']:
+            paths.append(link_or_copy(os.path.join(entry, name), os.path.join(directory, name)))  # noqa: PTH118
+        info['last_used'] = time.time()
+        self._write_entry(entry, info)
+        return paths
+
+    def add(self, key, sources, files, inputs=None):
+        '''
+        Store the database files computed for the source positions under key and
+        return the directory of the entry. The files are linked when possible.
+        '''
+        sources = _positions(sources)
+        entry = os.path.join(self.root, key, digest(sources)[:16])  # noqa: PTH118
+        partial = f'{entry}.{os.getpid()}.part'
+        shutil.rmtree(partial, ignore_errors=True)
+        os.makedirs(partial)  # noqa: PTH103
+        np.save(os.path.join(partial, 'sources.npy'), sources)  # noqa: PTH118
+        names = []
+        for path in files:
+            name = os.path.basename(path)  # noqa: PTH119
+            link_or_copy(path, os.path.join(partial, name))  # noqa: PTH118
+            names.append(name)
+        info = {
+            'key': key,
+            'files': names,
+            'nsources': len(sources),
+            'size': sum(os.path.getsize(path) for path in files),  # noqa: PTH202
+            'inputs': inputs,
+            'last_used': time.time(),
+        }
+        self._write_entry(partial, info)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(partial, entry)
+        self.evict(keep=entry)
+        return entry
+
+    def evict(self, keep=None):
+        '''
+        Remove least recently used databases until the store fits in max_bytes,
+        never removing the entry keep.
+        '''
+        entries = sorted(self.entries(), key=lambda e: e[1]['last_used'], reverse=True)
+        total = 0
+        for entry, info in entries:
+            if entry == keep or total + info['size'] <= self.max_bytes:
+                total += info['size']
+            else:
+                shutil.rmtree(entry, ignore_errors=True)
+                try:
+                    os.rmdir(os.path.dirname(entry))  # noqa: PTH106, PTH120
+                except OSError:
+                    pass
+
+
+# ======================================================================================
+# Extension of a Green's function database
+# ======================================================================================
+# h5py is imported by the functions reading the databases only, the checkpoints and
+# the store do not need it.
+# run_faster matches every source-receiver pair of a model to the pairs of the
+# database by their coordinates (PAIR_FIELDS), so the pairs missing for a new
+# geometry can be computed on their own and appended to an existing database.
+def database_file(name):
+    '''
+    Return the file of the database name (name.h5 or name), or None.
+    '''
+    for path in (name + '.h5', name):
+        if os.path.isfile(path):  # noqa: PTH113
+            return path
+    return None
+
+
+def set_parameters(filename, key):
+    '''
+    Record the digest of the parameters a database was computed with.
+    '''
+    import h5py
+
+    with h5py.File(filename, 'r+') as database:
+        database.attrs[PARAMETERS_ATTRIBUTE] = key
+
+
+def parameters_match(filename, key):
+    '''
+    Whether a database was computed with the parameters of key; None if the
+    database does not record its parameters.
+    '''
+    import h5py
+
+    with h5py.File(filename, 'r') as database:
+        stored = database.attrs.get(PARAMETERS_ATTRIBUTE)
+    if stored is None:
+        return None
+    return (stored.decode() if isinstance(stored, bytes) else str(stored)) == key
+
+
+def read_pairs(filename):
+    '''
+    Return the (n, 3) coordinates of the pairs of a database.
+    '''
+    import h5py
+
+    with h5py.File(filename, 'r') as database:
+        return np.column_stack([np.asarray(database[field][()], dtype=np.float64).ravel() for field in PAIR_FIELDS])
+
+
+def match_pairs(existing, required, tolerances):
+    '''
+    Return for every required pair the index of an existing pair closer than half
+    the tolerances (delta_h, delta_v_rec, delta_v_src) in every coordinate, or -1.
+
+    The pairs are clustered by gen_greens_function_database_pairs, which is not
+    transitive: a source-receiver combination lies within the tolerances of its
+    required pair only, so matching at the full tolerances could place it up to
+    twice the tolerances from the existing pair. The existing pairs are hashed to
+    cells of the half tolerances and each required pair is compared with the pairs
+    of the neighbouring cells.
+    '''
+    existing = np.asarray(existing, dtype=np.float64).reshape(-1, 3)
+    required = np.asarray(required, dtype=np.float64).reshape(-1, 3)
+    matched = np.full(len(required), -1, dtype=np.int64)
+    if len(existing) == 0 or len(required) == 0:
+        return matched
+
+    tolerances = np.asarray(tolerances, dtype=np.float64) / 2
+    cells = np.floor(existing / tolerances).astype(np.int64)
+    targets = np.floor(required / tolerances).astype(np.int64)
+    low = np.minimum(cells.min(axis=0), targets.min(axis=0)) - 1
+    span = np.maximum(cells.max(axis=0), targets.max(axis=0)) + 2 - low
+
+    def code(c):
+        c = c - low
+        return (c[:, 0] * span[1] + c[:, 1]) * span[2] + c[:, 2]
+
+    keys = code(cells)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    for offset in itertools.product((-1, 0, 1), repeat=3):
+        rows = np.flatnonzero(matched < 0)
+        if len(rows) == 0:
+            break
+        k = code(targets[rows] + np.array(offset))
+        first = np.searchsorted(keys, k, side='left')
+        count = np.searchsorted(keys, k, side='right') - first
+        rows, first, count = rows[count > 0], first[count > 0], count[count > 0]
+        # every existing pair of the cell of every row
+        row = np.repeat(rows, count)
+        candidate = order[np.repeat(first, count) + np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)]
+        match = np.all(np.abs(existing[candidate] - required[row]) < tolerances, axis=1)
+        # several candidates of a row may match, any of them will do
+        matched[row[match]] = candidate[match]
+    return matched
+
+
+def covered_pairs(existing, required, tolerances):
+    '''
+    Return a mask of the required pairs matched by an existing pair (see match_pairs).
+    '''
+    return match_pairs(existing, required, tolerances) >= 0
+
+
+def _pair_datasets(database):
+    # Names of the per-pair datasets held by the database
+    return [name for name in PAIR_DATASETS + (PAIR_INDEX,) if name in database]
+
+
+def select_pairs(source, destination, mask):
+    '''
+    Write to destination the pairs database source reduced to the pairs of mask,
+    without Green's functions.
+    '''
+    import h5py
+
+    with h5py.File(source, 'r') as src, h5py.File(destination, 'w') as dst:
+        per_pair = set(_pair_datasets(src))
+        for name, item in src.items():
+            if name == GF_GROUP:
+                continue
+            if name in per_pair:
+                dst.create_dataset(name, data=item[()][mask])
+            else:
+                src.copy(item, dst, name=name)
+        for name, value in src.attrs.items():
+            dst.attrs[name] = value
+
+
+def append_pairs(database, extension, required, matched):
+    '''
+    Append in place the pairs and Green's functions of the database extension to
+    database, the Green's functions of the appended pairs being renumbered after
+    the existing ones. extension may be None when no pair is missing. Returns the
+    number of appended pairs.
+
+    The (station, source) indices of PAIR_INDEX are rebuilt for the geometry of the
+    pairs database required rather than appended: matched[i] is the existing pair
+    covering required pair i (see match_pairs), or -1 for the pairs of extension.
+    Existing pairs that no combination of the geometry uses get the indices -1.
+    '''
+    import h5py
+
+    with h5py.File(database, 'r+') as dst, h5py.File(required, 'r') as req:
+        offset = len(dst[PAIR_FIELDS[0]])
+        src = h5py.File(extension, 'r') if extension is not None else None
+        try:
+            added = 0 if src is None else len(src[PAIR_FIELDS[0]])
+            if src is not None:
+                for name in PAIR_DATASETS:
+                    if name not in dst and name not in src:
+                        continue
+                    if name not in dst or name not in src:
+                        raise ValueError(f'{name} is only in one of {database} and {extension}')  # noqa: EM102, TRY003
+                    data = np.concatenate([dst[name][()], src[name][()]])
+                    del dst[name]
+                    dst.create_dataset(name, data=data)
+
+            if PAIR_INDEX in req:
+                indices = req[PAIR_INDEX][()]
+                matched = np.asarray(matched)
+                rebuilt = np.full((offset + added,) + indices.shape[1:], -1, dtype=indices.dtype)
+                rebuilt[matched[matched >= 0]] = indices[matched >= 0]
+                if src is not None:
+                    rebuilt[offset:] = src[PAIR_INDEX][()]
+                if PAIR_INDEX in dst:
+                    del dst[PAIR_INDEX]
+                dst.create_dataset(PAIR_INDEX, data=rebuilt)
+
+            if src is not None:
+                group = dst.require_group(GF_GROUP)
+                for name, item in src.get(GF_GROUP, {}).items():
+                    head, sep, tail = name.partition('_')
+                    if head.isdigit():
+                        name = f'{int(head) + offset}{sep}{tail}'
+                    if name in group:
+                        del group[name]
+                    src.copy(item, group, name=name)
+        finally:
+            if src is not None:
+                src.close()
+    return added
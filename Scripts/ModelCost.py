@@ -0,0 +1,303 @@
+"""
+#############################################################
+# Cost estimates of a ShakerMaker model run.                #
+#                                                           #
+# The size of a DRM box, of its results/DRMLoad.h5drm file  #
+# and the number of Green's functions of the run are        #
+# estimated from the model inputs, before the model is      #
+# written or submitted.                                     #
+# ###########################################################
+"""
+
+import os
+
+import numpy as np
+
+# ShakerMaker uses kilometers, the inputs are in meters
+_m = 0.001
+
+# Fields written for every DRM node by the DRMHDF5StationListWriter
+# (displacement, velocity and acceleration) and their components
+DRM_FIELDS = 3
+DRM_COMPONENTS = 3
+
+# Bytes per value of the DRM results (float64)
+DRM_VALUE_BYTES = 8
+
+# Components of the Green's function of one source-receiver pair
+GF_COMPONENTS = 9
+
+# Core-seconds to compute the Green's function of one pair with GF_REFERENCE_NFFT
+# samples (scaled linearly with nfft). The default is an uncalibrated order of
+# magnitude; set SHAKERMAKER_GF_SECONDS_PER_PAIR from a run on the target machine:
+# the "elapsed" of results/manifests/database.json times the number of ranks,
+# divided by the number of pairs and scaled to GF_REFERENCE_NFFT
+GF_SECONDS_PER_PAIR = float(os.environ.get('SHAKERMAKER_GF_SECONDS_PER_PAIR', 1.0))
+GF_SECONDS_CALIBRATED = 'SHAKERMAKER_GF_SECONDS_PER_PAIR' in os.environ
+GF_REFERENCE_NFFT = 16384
+
+# npairs_max of ShakerMakermodel.py
+NPAIRS_MAX = 200000
+
+# Number of source cell and receiver column distances computed at once
+PAIR_CHUNK = 1 << 22
+
+
+def drm_elements(width_x, width_y, depth, mesh_x, mesh_y, mesh_z):
+    '''
+    Return the number of elements (nx, ny, nz) of a DRM box, as in
+    ShakerMakermodel.py: nx = int(Width X / Mesh Size X) and so on.
+    '''
+    return int(width_x / mesh_x), int(width_y / mesh_y), int(depth / mesh_z)
+
+
+def drm_box_nodes(nx, ny, nz, dx, dy, dz, center=(0.0, 0.0)):
+    '''
+    Return the (x, y, z) coordinates of the nodes of a DRM box and a mask of the
+    internal nodes.
+
+    The nodes are those of the DRM layer built by shakermaker's DRMBox: the nodes on
+    the sides and bottom of the box (internal) and the nodes one element outside
+    them (external). The box is centered at center on the surface, z is the depth.
+    Coordinates are in the units of dx, dy and dz.
+    '''
+    i = np.arange(-1, nx + 2)
+    j = np.arange(-1, ny + 2)
+    k = np.arange(0, nz + 2)
+    i, j, k = (a.ravel() for a in np.meshgrid(i, j, k, indexing='ij'))
+
+    inside = (i > 0) & (i < nx) & (j > 0) & (j < ny) & (k < nz)
+    boundary = (i >= 0) & (i <= nx) & (j >= 0) & (j <= ny) & (k <= nz)
+    layer = ~inside
+    internal = boundary[layer]
+
+    x = center[0] + (i[layer] - nx / 2) * dx
+    y = center[1] + (j[layer] - ny / 2) * dy
+    z = k[layer] * dz
+    return np.column_stack((x, y, z)), internal
+
+
+def drm_node_count(nx, ny, nz):
+    '''
+    Return the number of nodes of a DRM box of nx * ny * nz elements (see
+    drm_box_nodes), without building them. The QA station is not counted.
+    '''
+    return (nx + 3) * (ny + 3) * (nz + 2) - (nx - 1) * (ny - 1) * nz
+
+
+def time_steps(dt, tmin, tmax):
+    '''
+    Return the number of time steps of the results between tmin and tmax.
+    '''
+    return int(round((tmax - tmin) / dt)) + 1
+
+
+def h5drm_size(nnodes, dt, tmin, tmax):
+    '''
+    Return the estimated size in bytes of results/DRMLoad.h5drm for nnodes nodes:
+    every field and component of every node (and of the QA station) at every
+    time step, plus the node coordinates and flags.
+    '''
+    nt = time_steps(dt, tmin, tmax)
+    data = (nnodes + 1) * DRM_FIELDS * DRM_COMPONENTS * nt * DRM_VALUE_BYTES
+    return data + nnodes * (DRM_COMPONENTS * DRM_VALUE_BYTES + 1)
+
+
+def _bins(values, delta):
+    # Number of delta wide bins spanned by values
+    return int(np.floor(values.max() / delta) - np.floor(values.min() / delta)) + 1
+
+
+def greens_function_pairs_bound(sources, receivers, delta_h, delta_v_rec, delta_v_src):
+    '''
+    Return an upper bound of the unique Green's function pairs of a model.
+
+    sources and receivers are (n, 3) arrays of x, y and depth. A pair is identified
+    by its horizontal distance bin (delta_h), the depth bin of the receiver
+    (delta_v_rec) and the depth bin of the source (delta_v_src), as in
+    gen_greens_function_database_pairs. The bound is the product of the bins
+    spanned by the source depths, the receiver depths and the horizontal distances
+    between the bounding boxes of the two sets of points.
+    '''
+    sources = np.asarray(sources, dtype=np.float64)
+    receivers = np.asarray(receivers, dtype=np.float64)
+    if len(sources) == 0 or len(receivers) == 0:
+        return 0
+
+    smin, smax = sources[:, :2].min(axis=0), sources[:, :2].max(axis=0)
+    rmin, rmax = receivers[:, :2].min(axis=0), receivers[:, :2].max(axis=0)
+    gap = np.maximum(0.0, np.maximum(smin - rmax, rmin - smax))
+    span = np.maximum(np.abs(smax - rmin), np.abs(rmax - smin))
+    distances = np.array([np.hypot(*gap), np.hypot(*span)])
+
+    return _bins(distances, delta_h) * _bins(receivers[:, 2], delta_v_rec) * _bins(sources[:, 2], delta_v_src)
+
+
+def source_points(faults, minslip=0.0):
+    '''
+    Return the (n, 3) x, y and depth of the subfaults with slip > minslip of a list
+    of fault arrays, as staged by stage_fault_file.
+    '''
+    points = []
+    for fault in faults:
+        xyz = np.column_stack((fault['x'], fault['y'], fault['z']))
+        if minslip > 0:
+            xyz = xyz[np.asarray(fault['slip']) > minslip]
+        points.append(xyz)
+    if not points:
+        return np.empty((0, 3))
+    return np.concatenate(points)
+
+
+def greens_function_pairs(sources, receivers, delta_h, delta_v_rec, delta_v_src, cancel=None):
+    '''
+    Return the approximate number of unique Green's function pairs of a model.
+
+    The points are hashed to a horizontal grid of delta_h cells and to depth bins
+    of delta_v_src (sources) and delta_v_rec (receivers). Every occupied source cell
+    and receiver cell give one key: their horizontal distance bin, the source depth
+    bin and the receiver depth bin. The distinct keys are counted. Receiver columns
+    with the same depth bins are handled together, so the work is the number of
+    occupied source cells times the number of occupied receiver columns.
+
+    cancel is an optional callable checked between chunks; None is returned when
+    it returns True.
+    '''
+    sources = np.asarray(sources, dtype=np.float64)
+    receivers = np.asarray(receivers, dtype=np.float64)
+    if len(sources) == 0 or len(receivers) == 0:
+        return 0
+
+    def cells(points, delta_v):
+        keys = np.column_stack(
+            (points[:, 0] / delta_h, points[:, 1] / delta_h, points[:, 2] / delta_v)
+        )
+        return np.unique(np.floor(keys).astype(np.int64), axis=0)
+
+    src = cells(sources, delta_v_src)
+    rec = cells(receivers, delta_v_rec)
+
+    # receiver columns (rows of rec are sorted by column), grouped by their depth bins
+    columns, column_index = np.unique(rec[:, :2], axis=0, return_inverse=True)
+    bounds = np.flatnonzero(np.diff(column_index.ravel())) + 1
+    groups = {}
+    column_group = np.array(
+        [groups.setdefault(tuple(depths.tolist()), len(groups)) for depths in np.split(rec[:, 2], bounds)]
+    )
+    depth_bins, src_depth = np.unique(src[:, 2], return_inverse=True)
+    src_depth = src_depth.ravel()
+
+    # every key (distance bin, source depth bin, receiver column group) is marked once
+    low = np.minimum(src[:, :2].min(axis=0), columns.min(axis=0))
+    high = np.maximum(src[:, :2].max(axis=0), columns.max(axis=0))
+    ndistances = int(np.floor(np.hypot(*(high - low)))) + 1
+    seen = np.zeros(ndistances * len(depth_bins) * len(groups), dtype=bool)
+
+    step = max(1, PAIR_CHUNK // len(columns))
+    for start in range(0, len(src), step):
+        if cancel is not None and cancel():
+            return None
+        chunk = src[start : start + step]
+        distance = np.hypot(chunk[:, 0, None] - columns[None, :, 0], chunk[:, 1, None] - columns[None, :, 1])
+        code = np.floor(distance).astype(np.int64) * len(depth_bins) + src_depth[start : start + step, None]
+        seen[code * len(groups) + column_group[None, :]] = True
+
+    # each key holds for every receiver depth bin of its group
+    codes = np.flatnonzero(seen)
+    group = codes % len(groups)
+    key = codes // len(groups)
+    members = {}
+    for g, depths in enumerate(groups):
+        for depth in depths:
+            members.setdefault(depth, []).append(g)
+    counts = {}
+    total = 0
+    for depth_groups in members.values():
+        depth_groups = tuple(depth_groups)
+        if depth_groups not in counts:
+            counts[depth_groups] = len(np.unique(key[np.isin(group, depth_groups)]))
+        total += counts[depth_groups]
+    return total
+
+
+def greens_function_cost(npairs, nfft, dt, tmin, tmax):
+    '''
+    Return the estimated size in bytes of the Green's function database of npairs
+    pairs (every component over the results window) and the core-seconds to compute
+    it, from GF_SECONDS_PER_PAIR.
+    '''
+    size = npairs * GF_COMPONENTS * time_steps(dt, tmin, tmax) * DRM_VALUE_BYTES
+    seconds = npairs * GF_SECONDS_PER_PAIR * nfft / GF_REFERENCE_NFFT
+    return size, seconds
+
+
+def format_core_hours(seconds):
+    '''
+    Return core-seconds as core-hours, marked as an order of magnitude while
+    GF_SECONDS_PER_PAIR is not calibrated.
+    '''
+    text = f'≈ {seconds / 3600:.1f} core-hours'
+    if not GF_SECONDS_CALIBRATED:
+        text += ' (uncalibrated order of magnitude, set SHAKERMAKER_GF_SECONDS_PER_PAIR)'
+    return text
+
+
+def drm_estimate(drmbox, analysis, sources, center, cancel=None):
+    '''
+    Return the cost estimate of a DRM model as a dict with the number of elements
+    (nx, ny, nz), of nodes and of time steps, the size in bytes of
+    results/DRMLoad.h5drm, the number of unique Green's function pairs (see
+    greens_function_pairs) with the size and core-seconds of their database, and
+    the cheap upper bound of the pairs (see greens_function_pairs_bound).
+
+    drmbox and analysis are the "DRMbox" and "analysisdata" entries of the model
+    metadata (lengths in meters), sources the (n, 3) fault points and center the
+    position of the box in the fault coordinates (in kilometers).
+
+    cancel is an optional callable passed to greens_function_pairs; None is
+    returned when it stops the count.
+    '''
+    nx, ny, nz = drm_elements(
+        drmbox['Width X'],
+        drmbox['Width Y'],
+        drmbox['Depth'],
+        drmbox['Mesh Size X'],
+        drmbox['Mesh Size Y'],
+        drmbox['Mesh Size Z'],
+    )
+    nodes, _ = drm_box_nodes(
+        nx,
+        ny,
+        nz,
+        drmbox['Mesh Size X'] * _m,
+        drmbox['Mesh Size Y'] * _m,
+        drmbox['Mesh Size Z'] * _m,
+        center=center,
+    )
+    dt, tmin, tmax = analysis['dt'], analysis['tmin'], analysis['tmax']
+    deltas = (analysis['dh'] * _m, analysis['delta_v_rec'] * _m, analysis['delta_v_src'] * _m)
+    npairs = greens_function_pairs(sources, nodes, *deltas, cancel=cancel)
+    if npairs is None:
+        return None
+    gf_bytes, gf_seconds = greens_function_cost(npairs, analysis['nfft'], dt, tmin, tmax)
+    return {
+        'elements': (nx, ny, nz),
+        'nodes': len(nodes),
+        'time_steps': time_steps(dt, tmin, tmax),
+        'h5drm_bytes': h5drm_size(len(nodes), dt, tmin, tmax),
+        'pairs': npairs,
+        'gf_bytes': gf_bytes,
+        'gf_seconds': gf_seconds,
+        'pairs_bound': greens_function_pairs_bound(sources, nodes, *deltas),
+    }
+
+
+def format_bytes(size):
+    '''
+    Return a size in bytes as a human readable string.
+    '''
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if size < 1024 or unit == 'TiB':
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.2f} {unit}'
+        size /= 1024
+    return None
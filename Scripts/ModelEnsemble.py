@@ -0,0 +1,266 @@
+"""
+#############################################################
+# Ensemble of ShakerMaker models.                           #
+#                                                           #
+# Several realizations of the fault database are staged     #
+# into sibling model directories that share one analysis    #
+# (crust, stations, parameters) and one copy of the model   #
+# scripts. A driver script runs the models back-to-back or  #
+# one per task of a job array.                              #
+# ###########################################################
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import stat
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from FaultDatabase import DatabaseClient, DatabaseError, RealizationCache
+from FaultSources import link_or_copy, stage_fault_file
+
+# Name of the directory holding the files shared by the models of an ensemble
+SHARED_DIRECTORY = 'shared'
+
+# Name of the driver script of an ensemble
+DRIVER_SCRIPT = 'run_ensemble.sh'
+
+
+def select_realizations(realizations, selection):
+    '''
+    Return the realizations matching a selection such as "all", "1-10" or "1,3,7-9".
+
+    Ranges select the realizations whose name is a number within the range; other
+    terms select realizations by name. The order of realizations is kept.
+    '''
+    selection = selection.strip()
+    if selection.lower() in ('', 'all'):
+        return list(realizations)
+
+    names = set()
+    ranges = []
+    for term in selection.split(','):
+        term = term.strip()
+        first, dash, last = term.partition('-')
+        if dash and first and last:
+            try:
+                ranges.append((float(first), float(last)))
+                continue
+            except ValueError:
+                pass
+        names.add(term)
+
+    def selected(name):
+        if name in names:
+            return True
+        try:
+            value = float(name)
+        except ValueError:
+            return False
+        return any(first <= value <= last for first, last in ranges)
+
+    return [name for name in realizations if selected(name)]
+
+
+def write_shared_files(directory, metadata, scripts):
+    '''
+    Write the files shared by the models of an ensemble: metadata.json and the
+    model scripts (paths of the files to copy). Returns the names of the files.
+    '''
+    os.makedirs(directory, exist_ok=True)  # noqa: PTH103
+    with open(os.path.join(directory, 'metadata.json'), 'w') as file:  # noqa: PTH118, PTH123
+        json.dump(metadata, file, indent=4)
+    names = ['metadata.json']
+    for script in scripts:
+        shutil.copy(script, directory)
+        names.append(os.path.basename(script))  # noqa: PTH119
+    return names
+
+
+def stage_realization(task):
+    '''
+    Stage one cached realization into its model directory.
+
+    task is a dict with the realization path, the model directory, the cache root,
+    the minimum slip, the shared directory and the names of the shared files. The
+    fault files are staged with stage_fault_file, the source time function and the
+    shared files are linked. Runs in a worker process.
+
+    Returns (path, directory, number of kept subfaults, error message or None).
+    '''
+    path = task['path']
+    directory = task['directory']
+    source = os.path.join(directory, '.source')  # noqa: PTH118
+    try:
+        # Files of an earlier staging of the model are replaced
+        for name in os.listdir(directory):
+            if os.path.isfile(os.path.join(directory, name)):  # noqa: PTH113, PTH118
+                os.remove(os.path.join(directory, name))  # noqa: PTH107, PTH118
+        os.makedirs(source, exist_ok=True)  # noqa: PTH103
+        if not RealizationCache(task['cache']).checkout(path, source):
+            return path, directory, 0, 'realization is not in the cache'
+
+        with open(os.path.join(source, 'faultInfo.json')) as file:  # noqa: PTH118, PTH123
+            fault_info = json.load(file)
+
+        fault_files = []
+        numpoints = 0
+        for filename in fault_info['Faultfilenames']:
+            staged, kept, _ = stage_fault_file(os.path.join(source, filename), directory, task['minslip'])  # noqa: PTH118
+            fault_files.append(staged)
+            numpoints += kept
+
+        stf = fault_info['SourceTimeFunction']['filename']
+        link_or_copy(os.path.join(source, stf), os.path.join(directory, stf))  # noqa: PTH118
+        fault_info['Faultfilenames'] = fault_files
+        with open(os.path.join(directory, 'faultInfo.json'), 'w') as file:  # noqa: PTH118, PTH123
+            json.dump(fault_info, file, indent=4)
+
+        for name in task['shared_files']:
+            link_or_copy(os.path.join(task['shared'], name), os.path.join(directory, name))  # noqa: PTH118
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        return path, directory, 0, str(e)
+    finally:
+        shutil.rmtree(source, ignore_errors=True)
+    return path, directory, numpoints, None
+
+
+def write_driver(root, directories, launcher='mpirun -n "$NP"'):
+    '''
+    Write the driver script of an ensemble and return its path.
+
+    Run directly, the driver runs every model back-to-back. Submitted as a job
+    array (SLURM_ARRAY_TASK_ID, PBS_ARRAY_INDEX or PBS_ARRAYID), each task runs
+    the model at its index. The models share a Green's function database store in
+    the shared directory unless SHAKERMAKER_GF_STORE is set.
+    '''
+    names = ' '.join(f'"{os.path.relpath(d, root)}"' for d in directories)
+    driver = os.path.join(root, DRIVER_SCRIPT)  # noqa: PTH118
+    with open(driver, 'w', newline='\n') as file:  # noqa: PTH123
+        file.write(f"""#!/bin/bash
+# ShakerMaker ensemble of {len(directories)} models
+#
+# Run every model back-to-back:
+#     ./{DRIVER_SCRIPT} [number of processors]
+# Run one model per task of a job array, e.g. with SLURM:
+#     sbatch --array=0-{len(directories) - 1} {DRIVER_SCRIPT} [number of processors]
+
+NP=${{1:-1}}
+cd "$(dirname "$0")" || exit 1
+# The models share their Green's function databases when their sources allow it
+export SHAKERMAKER_GF_STORE=${{SHAKERMAKER_GF_STORE:-"$(pwd)/{SHARED_DIRECTORY}/greensfunctions"}}
+MODELS=({names})
+TASK=${{SLURM_ARRAY_TASK_ID:-${{PBS_ARRAY_INDEX:-${{PBS_ARRAYID:-}}}}}}
+
+run_model() {{
+    echo "Running $1"
+    (cd "$1" && {launcher} python ShakerMakermodel.py)
+}}
+
+if [ -n "$TASK" ]; then
+    run_model "${{MODELS[$TASK]}}"
+else
+    for model in "${{MODELS[@]}}"; do
+        run_model "$model" || exit 1
+    done
+fi
+""")
+    os.chmod(driver, os.stat(driver).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)  # noqa: PTH101, PTH116
+    return driver
+
+
+def create_ensemble(  # noqa: PLR0913
+    root,
+    paths,
+    metadata,
+    scripts,
+    cache_root,
+    minslip=0.0,
+    database=None,
+    max_workers=None,
+    report=print,
+    cache=None,
+):
+    '''
+    Create an ensemble of models in root, one directory per realization at its
+    path relative to the database root (root/country/fault/realization).
+
+    Realizations missing from the cache at cache_root are downloaded first (with
+    threads, the transfers being I/O bound), then every realization is staged by a
+    pool of max_workers processes. The workers are spawned rather than forked, as
+    the caller may be a multithreaded (GUI) process; they share the cache through
+    the lock of its root. cache is the RealizationCache of cache_root already
+    opened by the caller, if any. metadata.json and the model scripts are written
+    once to root/shared and linked into each model directory. report is called with
+    progress messages.
+
+    Returns (driver path, list of (path, directory, kept subfaults, error)).
+    '''
+    duplicates = sorted({path for path in paths if paths.count(path) > 1})
+    if duplicates:
+        raise ValueError(f'Realizations selected more than once: {", ".join(duplicates)}')  # noqa: EM102, TRY003
+
+    if cache is None:
+        cache = RealizationCache(cache_root)
+    missing = [path for path in paths if path not in cache]
+    if missing:
+        report(f'Downloading {len(missing)} realizations')
+        client = DatabaseClient(database, partial_dir=os.path.join(cache_root, 'partial'))  # noqa: PTH118
+        staging = os.path.join(cache_root, 'ensemble')  # noqa: PTH118
+
+        def download(item):
+            k, path = item
+            directory = os.path.join(staging, str(k))  # noqa: PTH118
+            os.makedirs(directory, exist_ok=True)  # noqa: PTH103
+            try:
+                _, _, errors, _ = client.load_realization(path, directory, cache=cache)
+            except DatabaseError as e:
+                errors = [(path, str(e))]
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+            return errors
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            for errors in pool.map(download, enumerate(missing)):
+                for filename, message in errors:
+                    report(f'Error: {filename}: {message}')
+        client.close()
+
+    shared = os.path.join(root, SHARED_DIRECTORY)  # noqa: PTH118
+    shared_files = write_shared_files(shared, metadata, scripts)
+
+    tasks = []
+    for path in paths:
+        directory = os.path.join(root, *path.split('/'))  # noqa: PTH118
+        os.makedirs(directory, exist_ok=True)  # noqa: PTH103
+        tasks.append(
+            {
+                'path': path,
+                'directory': directory,
+                'cache': cache_root,
+                'minslip': minslip,
+                'shared': shared,
+                'shared_files': shared_files,
+            }
+        )
+
+    workers = max(1, min(max_workers or os.cpu_count() or 1, len(tasks)))
+    report(f'Staging {len(tasks)} realizations with {workers} processes')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        results = list(pool.map(stage_realization, tasks))
+
+    driver = write_driver(root, [directory for _, directory, _, error in results if error is None])
+    return driver, results
+
+
+def ensemble_summary(results):
+    '''
+    Return the number of staged models and the total and mean number of subfaults.
+    '''
+    kept = np.array([numpoints for _, _, numpoints, error in results if error is None])
+    if len(kept) == 0:
+        return 0, 0, 0.0
+    return len(kept), int(kept.sum()), float(kept.mean())
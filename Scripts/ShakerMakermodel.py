@@ -33,7 +33,30 @@ from shakermaker.station import Station
 from shakermaker.stationlist import StationList
 from shakermaker.slw_extensions import DRMHDF5StationListWriter
 from shakermaker.sl_extensions import DRMBox
-from geopy.distance import geodesic
+from StationGeometry import north_east_offsets
+from FaultSources import (
+    SourceTimeFunctionEngine,
+    assemble_fault_sources,
+    broadcast_fault_chunks,
+    iter_fault_chunks,
+    select_fault_sources,
+)
+from GreensFunctions import (
+    PHASES,
+    GreensFunctionStore,
+    PipelineCheckpoint,
+    append_pairs,
+    artifact_files,
+    database_file,
+    detach,
+    digest,
+    match_pairs,
+    parameters_match,
+    pipeline_keys,
+    read_pairs,
+    select_pairs,
+    set_parameters,
+)
 
 import numpy as np
 from mpi4py import MPI
@@ -42,34 +65,12 @@ from mpi4py import MPI
 def calculate_distances_with_direction(lat1, lon1, lat2, lon2): 
     '''
     Calculate the distance between two points in the north-south and east-west directions 
-    based on their latitudes and longitudes. Uses the geopy library to calculate the distance
-    between two points on the Earth's surface.
+    based on their latitudes and longitudes. lat2 and lon2 may be arrays, in which case
+    the distances of all the points are computed in one call (see StationGeometry.py).
     '''
-
-    # Original points
-    point1 = (lat1, lon1)
-
-    # Calculate north-south distance (latitude changes, longitude constant)
-    north_point = (lat2, lon1)
-    north_south_distance = geodesic(point1, north_point).kilometers
-    north_south_direction = 'north' if lat2 > lat1 else 'south'
-
-    # Calculate east-west distance (longitude changes, latitude constant)
-    west_point = (lat1, lon2)
-    west_east_distance = geodesic(point1, west_point).kilometers
-    west_east_direction = 'east' if lon2 > lon1 else 'west'
-
-    # south is negative
-    north_south_distance = (
-        -north_south_distance
-        if north_south_direction == 'south'
-        else north_south_distance
-    )
-    # west is negative
-    west_east_distance = (
-        -west_east_distance if west_east_direction == 'west' else west_east_distance
-    )
-
+    north_south_distance, west_east_distance = north_east_offsets(lat1, lon1, lat2, lon2)
+    if np.ndim(north_south_distance) == 0:
+        return float(north_south_distance), float(west_east_distance)
     return north_south_distance, west_east_distance
 
 
@@ -105,6 +106,25 @@ if rank == 0:
 Vs_min = 3.14  # Minimum shear wave velocity
 Vp_max = 8.00  # Maximum primary wave velocity
 MINSLIP = 0  # Minimum slip for the fault
+FAULT_CHUNK_SIZE = 10000  # Number of subfaults decoded at a time from the fault files
+# How the fault files are read:
+#   'broadcast': rank 0 reads the files and broadcasts packed arrays to the other ranks
+#   'all'      : every rank reads the files from the filesystem
+FAULT_IO = os.environ.get('SHAKERMAKER_FAULT_IO', 'broadcast').lower()
+# Phases of the DRM pipeline whose manifest is still valid are skipped on restart
+# (see GreensFunctions.py); set SHAKERMAKER_CHECKPOINTS=off to always run them
+CHECKPOINTS = os.environ.get('SHAKERMAKER_CHECKPOINTS', 'on').lower() != 'off'
+GF_DATABASE = 'results/greensfunctions_database'  # Green's function database
+DRM_LOAD = 'results/DRMLoad.h5drm'  # DRM load of the DRM box
+# Shared store of Green's function databases, reused by the models of the same site
+# (same crust, parameters and stations) whose sources it covers; unset to disable
+GF_STORE = os.environ.get('SHAKERMAKER_GF_STORE')
+GF_STORE_MAX_BYTES = int(float(os.environ.get('SHAKERMAKER_GF_STORE_MAX_GB', 500)) * 1024**3)
+# Extend mode: the Green's function database already in results/ (of an earlier geometry)
+# is kept and only the pairs it is missing are computed and appended to it
+GF_EXTEND = os.environ.get('SHAKERMAKER_GF_EXTEND', 'off').lower() == 'on'
+GF_REQUIRED = 'results/greensfunctions_required'  # pairs of the geometry, in extend mode
+GF_MISSING = 'results/greensfunctions_missing'  # pairs missing from the database, in extend mode
 
 if rank == 0:
     print("Initial information is done")
@@ -118,6 +138,8 @@ dk = metadata['analysisdata'][
     'dk'
 ]  # (Wavelength space discretization) adjust using theory
 tb = 0  # How much to "advance" the simulation window... no advance
+smth = 1  # Densification of the output time step
+sigma = 2  # Damping of the frequency-wavenumber integration
 tmin = metadata['analysisdata']['tmin']  # Time when the final results start
 tmax = metadata['analysisdata']['tmax']  # Time when the final results end
 delta_h = metadata['analysisdata']['dh'] * _m  # Horizontal distance increment
@@ -204,7 +226,15 @@ ymean = faultdata['ymean']
 # comm.barrier()
 
 # import SourceTimeFunction from fault file
+import SourceTimeFunction  # noqa: E402
 from SourceTimeFunction import source_time_function  # noqa: E402
+
+# distinct source time functions are built once and shared between subfaults
+stf_engine = SourceTimeFunctionEngine(
+    source_time_function,
+    discrete=Discrete,
+    batch_function=getattr(SourceTimeFunction, 'source_time_function_batch', None),
+)
 # import numpy as np
 # from scipy.integrate import trapezoid
 # from shakermaker.stf_extensions import Discrete
@@ -232,58 +262,89 @@ from SourceTimeFunction import source_time_function  # noqa: E402
 
 #     return Discrete(slip_rate_function, t)
 
-for filename in filenames:
-    sources = []
-
-    # read the json fault file
-    f = open(f'{filename}')  # noqa: SIM115, PTH123
-    faultsources = json.load(f)
-    f.close()
-    for source in faultsources:
-        xsource = source['x']
-        ysource = source['y']
-        zsource = source['z']
-        strike = source['strike']
-        dip = source['dip']
-        rake = source['rake']
-        t0 = source['t0']
-        stf = source['stf']
-        stf_type = stf['type']
-        params = stf['parameters']
-        numparams = stf['numParameters']
-        stf_func = source_time_function(*params)
-        slip = source['slip']
-        if slip > MINSLIP :
-            sources.append(
-                PointSource(
-                    [xsource, ysource, zsource], [strike, dip, rake], tt=t0, stf=stf_func
-                )
-            )
-        del xsource, ysource, zsource, strike, dip, rake, t0, stf, stf_type, params, numparams, stf_func
+fault_io_start = MPI.Wtime()
 
-    del faultsources
+# rank 0 assembles every fault segment, keeping subfaults with slip > MINSLIP; it
+# holds the only full copy of the packed arrays, needed for the digests below
+faultsources, segment_counts = None, None
+if rank == 0:
+    faultsources, segment_counts = assemble_fault_sources(filenames, minslip=MINSLIP, chunk_size=FAULT_CHUNK_SIZE)
+
+# the other ranks see the fault FAULT_CHUNK_SIZE subfaults at a time, either
+# broadcast by rank 0 or streamed from the files, so their memory does not grow
+# with the fault beyond the point sources themselves
+if FAULT_IO == 'all' and rank != 0:
+    chunks = (
+        chunk
+        for filename in filenames
+        for chunk in iter_fault_chunks(filename, chunk_size=FAULT_CHUNK_SIZE, minslip=MINSLIP)
+    )
+elif FAULT_IO == 'all':
+    chunks = (
+        select_fault_sources(faultsources, slice(start, start + FAULT_CHUNK_SIZE))
+        for start in range(0, len(faultsources['x']), FAULT_CHUNK_SIZE)
+    )
+else:
+    chunks = broadcast_fault_chunks(comm, faultsources, chunk_size=FAULT_CHUNK_SIZE, root=0)
+
+# build the point sources of each chunk before dropping it
+sources = []
+for chunk in chunks:
+    stfs, stf_index = stf_engine.evaluate(chunk)
+    for j in range(len(chunk['x'])):
+        xsource = chunk['x'][j]
+        ysource = chunk['y'][j]
+        zsource = chunk['z'][j]
+        strike = chunk['strike'][j]
+        dip = chunk['dip'][j]
+        rake = chunk['rake'][j]
+        t0 = chunk['t0'][j]
+        stf_func = stfs[stf_index[j]]
+        sources.append(
+            PointSource([xsource, ysource, zsource], [strike, dip, rake], tt=t0, stf=stf_func)
+        )
+        del xsource, ysource, zsource, strike, dip, rake, t0, stf_func
+    del chunk, stfs, stf_index
+
+# digests of the source positions and of the rest of the sources, for the checkpoints
+if rank == 0:
+    source_positions = np.column_stack((faultsources['x'], faultsources['y'], faultsources['z']))
+    source_geometry = digest(source_positions)
+    with open(SourceTimeFunction.__file__, 'rb') as f:  # noqa: PTH123
+        source_digest = digest(
+            *(faultsources[key] for key in sorted(faultsources) if key not in ('x', 'y', 'z')), f.read()
+        )
+
+del faultsources
 FAULT = FaultSource(sources, metadata={'name': f'{faultName} M0={M0}'})
+
+# slowest rank decides the startup time, compare between SHAKERMAKER_FAULT_IO modes
+fault_io_time = comm.reduce(MPI.Wtime() - fault_io_start, op=MPI.MAX, root=0)
 if rank == 0:
     print("fault is loaded")
+    for filename, count in zip(filenames, segment_counts):
+        print(f"    {filename}: {count} subfaults")
+    print(f"    total: {len(sources)} subfaults in {len(filenames)} segments")
+    print(f"fault loading time: {fault_io_time:.3f} s (mode: {FAULT_IO}, {nprocs} ranks)")
+    print(f"source time functions: {stf_engine.ndistinct} distinct for {stf_engine.nsources} subfaults")
 # ======================================================================================
 # Loading the stations
 # ======================================================================================
 stationsType = metadata['stationdata']['stationType']  # noqa: N816
 # single station
 if stationsType.lower() in ['singlestation', 'single']:
-    stationslist = []
-    for station in metadata['stationdata']['Singlestations']:
-        stationLat = station['latitude']  # noqa: N816
-        stationLon = station['longitude']  # noqa: N816
-        stationDepth = station['depth']  # noqa: N816
-        meta = station['metadata']
-        xstation, ystation = calculate_distances_with_direction(
-            faultLat, faultLon, stationLat, stationLon
-        )
-        stationslist.append(
-            Station([xstation + xmean, ystation + ymean, stationDepth], metadata=meta)
-        )
-        del stationLat, stationLon, stationDepth, meta, xstation, ystation
+    singlestations = metadata['stationdata']['Singlestations']
+    stationLat = np.array([station['latitude'] for station in singlestations], dtype=float)  # noqa: N816
+    stationLon = np.array([station['longitude'] for station in singlestations], dtype=float)  # noqa: N816
+    # offsets of all the stations from the fault origin in one call
+    xstation, ystation = calculate_distances_with_direction(
+        faultLat, faultLon, stationLat, stationLon
+    )
+    stationslist = [
+        Station([x + xmean, y + ymean, station['depth']], metadata=station['metadata'])
+        for x, y, station in zip(xstation.tolist(), ystation.tolist(), singlestations)
+    ]
+    del singlestations, stationLat, stationLon, xstation, ystation
 
     meta = {'name': metadata['stationdata']['name']}
     STATIONS = StationList(stationslist, metadata=meta)
@@ -323,6 +384,24 @@ else:
 if rank == 0:
     print("stations are loaded")
 
+# keys of the phases of the DRM pipeline: the stations are placed from the station
+# data, the fault origin and the fault offsets
+if rank == 0:
+    gf_parameters = {
+        'crust': metadata['crustdata'],
+        'analysis': [dt, nfft, dk, tb, smth, sigma, tmin, tmax, delta_h, delta_v_rec, delta_v_src],
+    }
+    receivers = digest(metadata['stationdata'], [faultLat, faultLon, xmean, ymean])
+    pipeline = pipeline_keys(
+        dict(gf_parameters, npairs_max=npairs_max),
+        digest(source_geometry, receivers),
+        digest(source_digest, allow_out_of_bounds),
+    )
+    # key of the databases of the shared store, the sources being matched by position
+    store_key = digest(gf_parameters, receivers)
+    # parameters recorded in the database, checked before it is extended
+    parameters_key = digest(gf_parameters)
+
 del faultLat, faultLon, M0, faultName, filenames, xmean, ymean, metadata_file, metadata
 # ======================================================================================
 # Create the shakermaker model
@@ -330,67 +409,215 @@ del faultLat, faultLon, M0, faultName, filenames, xmean, ymean, metadata_file, m
 model = shakermaker.ShakerMaker(CRUST, FAULT, STATIONS)
 
 if stationsType.lower() in ['drmbox', 'drm', 'drm box', 'drm_box', 'drm station']:
-    # creating the pairs
-    model.gen_greens_function_database_pairs(
-         dt=dt,  # Output time-step
-         nfft=nfft,  # N timesteps
-         dk=dk,  # wavenumber discretization
-         tb=tb,  # Initial zero-padding
-         tmin=tmin,
-         tmax=tmax,
-         smth=1,
-         sigma=2,
-         verbose=True,
-         debugMPI=False,
-         showProgress=True,
-         store_here='results/greensfunctions_database',
-         delta_h=delta_h,
-         delta_v_rec=delta_v_rec,
-         delta_v_src=delta_v_src,
-         npairs_max=npairs_max,
-         using_vectorize_manner=True,
-         cfactor=0.5,
-     )
-
-    # # wait for all processes to finish
-    comm.barrier()
-    model.run_create_greens_function_database(
-        h5_database_name='results/greensfunctions_database',
-        dt=dt,  # Output time-step
-        nfft=nfft,  # N timesteps
-        dk=dk,  # wavenumber discretization
-        tb=tb,  # Initial zero-padding
-        tmin=tmin,
-        tmax=tmax,
-        smth=1,
-        sigma=2,
-        verbose=False,
-        debugMPI=False,
-        showProgress=True,
-    )
-
-    # wait for all processes to finish
-    comm.barrier()
-    writer = DRMHDF5StationListWriter('results/DRMLoad.h5drm')
-    model.run_faster(
-        h5_database_name='results/greensfunctions_database',
-        dt=dt,  # Output time-step
-        nfft=nfft,  # N timesteps
-        dk=dk,  # wavenumber discretization
-        tb=tb,  # Initial zero-padding
-        tmin=tmin,
-        tmax=tmax,
-        smth=1,
-        sigma=2,
-        verbose=False,
-        debugMPI=False,
-        showProgress=True,
-        writer=writer,
-        delta_h=delta_h,
-        delta_v_rec=delta_v_rec,
-        delta_v_src=delta_v_src,
-        allow_out_of_bounds=allow_out_of_bounds,
-    )
+    # phases completed by an earlier run with the same inputs are skipped
+    checkpoint = PipelineCheckpoint()
+    completed = set()
+    if rank == 0 and CHECKPOINTS:
+        completed = checkpoint.completed(pipeline)
+        for phase in PHASES:
+            if phase in completed:
+                print(f"skipping {phase}: checkpoint is valid")
+    completed = comm.bcast(completed, root=0)
+
+    # a stored database computed for these sources replaces the first two phases
+    if GF_STORE and 'database' not in completed:
+        linked = False
+        if rank == 0:
+            store = GreensFunctionStore(GF_STORE, GF_STORE_MAX_BYTES)
+            entry = store.lookup(store_key, source_positions)
+            if entry is not None:
+                checkpoint.invalidate('pairs')
+                artifacts = store.checkout(entry, 'results')
+                checkpoint.record('pairs', pipeline['pairs'], artifacts)
+                checkpoint.record('database', pipeline['database'], artifacts)
+                print(f"Green's function database linked from {entry}")
+                linked = True
+        if comm.bcast(linked, root=0):
+            completed |= {'pairs', 'database'}
+
+    def start_phase(phase):
+        # the manifests of the phase and of the phases after it no longer hold
+        if rank == 0:
+            checkpoint.invalidate(phase)
+        comm.barrier()
+        return MPI.Wtime()
+
+    def end_phase(phase, start, artifacts):
+        comm.barrier()
+        if rank == 0:
+            checkpoint.record(phase, pipeline[phase], artifact_files(*artifacts), elapsed=MPI.Wtime() - start)
+            print(f"{phase} checkpoint is written")
+
+    def store_database():
+        # the computed database is kept for the other models of the site
+        if GF_STORE and rank == 0:
+            entry = GreensFunctionStore(GF_STORE, GF_STORE_MAX_BYTES).add(
+                store_key,
+                source_positions,
+                artifact_files(GF_DATABASE, GF_DATABASE + '.*'),
+                inputs=gf_parameters,
+            )
+            print(f"Green's function database stored in {entry}")
+
+    # extend mode: only the pairs missing from the existing database are computed
+    if GF_EXTEND and 'database' not in completed:
+        database = None
+        if rank == 0:
+            database = database_file(GF_DATABASE)
+            if database is None:
+                print("extend: there is no Green's function database to extend, a new one is computed")
+            elif parameters_match(database, parameters_key) is None:
+                # e.g. a database computed before the parameters were recorded
+                print("Warning: extend: the database does not record its parameters, a new one is computed")
+                database = None
+            elif not parameters_match(database, parameters_key):
+                print("extend: the database was computed with other parameters, a new one is computed")
+                database = None
+            else:
+                # the database is modified in place, not the store it may be linked to
+                detach([database])
+        if comm.bcast(database is not None, root=0):
+            start = start_phase('pairs')
+            # pairs of the current geometry
+            model.gen_greens_function_database_pairs(
+                dt=dt,  # Output time-step
+                nfft=nfft,  # N timesteps
+                dk=dk,  # wavenumber discretization
+                tb=tb,  # Initial zero-padding
+                tmin=tmin,
+                tmax=tmax,
+                smth=smth,
+                sigma=sigma,
+                verbose=True,
+                debugMPI=False,
+                showProgress=True,
+                store_here=GF_REQUIRED,
+                delta_h=delta_h,
+                delta_v_rec=delta_v_rec,
+                delta_v_src=delta_v_src,
+                npairs_max=npairs_max,
+                using_vectorize_manner=True,
+                cfactor=0.5,
+            )
+            comm.barrier()
+            nmissing = 0
+            if rank == 0:
+                required = database_file(GF_REQUIRED)
+                matched = match_pairs(
+                    read_pairs(database), read_pairs(required), (delta_h, delta_v_rec, delta_v_src)
+                )
+                missing = matched < 0
+                nmissing = int(missing.sum())
+                print(f"extend: {nmissing} of {len(missing)} pairs are missing from the database")
+                if nmissing:
+                    select_pairs(required, GF_MISSING + required[len(GF_REQUIRED) :], missing)
+            nmissing = comm.bcast(nmissing, root=0)
+
+            # the missing pairs are computed by all the ranks and appended to the database
+            if nmissing:
+                model.run_create_greens_function_database(
+                    h5_database_name=GF_MISSING,
+                    dt=dt,  # Output time-step
+                    nfft=nfft,  # N timesteps
+                    dk=dk,  # wavenumber discretization
+                    tb=tb,  # Initial zero-padding
+                    tmin=tmin,
+                    tmax=tmax,
+                    smth=smth,
+                    sigma=sigma,
+                    verbose=False,
+                    debugMPI=False,
+                    showProgress=True,
+                )
+                comm.barrier()
+            if rank == 0:
+                # the pair indices are rebuilt for this geometry even when nothing is missing
+                append_pairs(database, database_file(GF_MISSING) if nmissing else None, required, matched)
+                set_parameters(database, parameters_key)
+                for path in artifact_files(GF_REQUIRED, GF_REQUIRED + '.*', GF_MISSING, GF_MISSING + '.*'):
+                    os.remove(path)  # noqa: PTH107
+            end_phase('pairs', start, [GF_DATABASE, GF_DATABASE + '.*'])
+            end_phase('database', start, [GF_DATABASE, GF_DATABASE + '.*'])
+            store_database()
+            completed |= {'pairs', 'database'}
+
+    if 'pairs' not in completed:
+        # a new database replaces the files of an earlier one, which may be linked to the store
+        if rank == 0:
+            for path in artifact_files(GF_DATABASE, GF_DATABASE + '.*'):
+                os.remove(path)  # noqa: PTH107
+        start = start_phase('pairs')
+        # creating the pairs
+        model.gen_greens_function_database_pairs(
+             dt=dt,  # Output time-step
+             nfft=nfft,  # N timesteps
+             dk=dk,  # wavenumber discretization
+             tb=tb,  # Initial zero-padding
+             tmin=tmin,
+             tmax=tmax,
+             smth=smth,
+             sigma=sigma,
+             verbose=True,
+             debugMPI=False,
+             showProgress=True,
+             store_here=GF_DATABASE,
+             delta_h=delta_h,
+             delta_v_rec=delta_v_rec,
+             delta_v_src=delta_v_src,
+             npairs_max=npairs_max,
+             using_vectorize_manner=True,
+             cfactor=0.5,
+         )
+        end_phase('pairs', start, [GF_DATABASE, GF_DATABASE + '.*'])
+
+    if 'database' not in completed:
+        if rank == 0:
+            detach(artifact_files(GF_DATABASE, GF_DATABASE + '.*'))
+        start = start_phase('database')
+        model.run_create_greens_function_database(
+            h5_database_name=GF_DATABASE,
+            dt=dt,  # Output time-step
+            nfft=nfft,  # N timesteps
+            dk=dk,  # wavenumber discretization
+            tb=tb,  # Initial zero-padding
+            tmin=tmin,
+            tmax=tmax,
+            smth=smth,
+            sigma=sigma,
+            verbose=False,
+            debugMPI=False,
+            showProgress=True,
+        )
+        # wait for all processes to finish, then record the parameters for extensions
+        comm.barrier()
+        if rank == 0:
+            set_parameters(database_file(GF_DATABASE), parameters_key)
+        end_phase('database', start, [GF_DATABASE, GF_DATABASE + '.*'])
+        store_database()
+
+    if 'drm' not in completed:
+        start = start_phase('drm')
+        writer = DRMHDF5StationListWriter(DRM_LOAD)
+        model.run_faster(
+            h5_database_name=GF_DATABASE,
+            dt=dt,  # Output time-step
+            nfft=nfft,  # N timesteps
+            dk=dk,  # wavenumber discretization
+            tb=tb,  # Initial zero-padding
+            tmin=tmin,
+            tmax=tmax,
+            smth=smth,
+            sigma=sigma,
+            verbose=False,
+            debugMPI=False,
+            showProgress=True,
+            writer=writer,
+            delta_h=delta_h,
+            delta_v_rec=delta_v_rec,
+            delta_v_src=delta_v_src,
+            allow_out_of_bounds=allow_out_of_bounds,
+        )
+        end_phase('drm', start, [DRM_LOAD])
 
 
 # single station
@@ -404,8 +631,8 @@ if stationsType.lower() in ['singlestation', 'single']:
         tb=tb,  # Initial zero-padding
         tmin=tmin,
         tmax=tmax,
-        smth=1,
-        sigma=2,
+        smth=smth,
+        sigma=sigma,
         verbose=False,
         debugMPI=False,
         showProgress=True,
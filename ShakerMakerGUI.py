@@ -10,11 +10,12 @@ from PyQt5.QtWidgets import (
     QSplitter,
     QGroupBox,
     QFileDialog,QGridLayout,QPushButton,QMenu,QTabWidget,QToolBar,QTabBar,QDialog,QAction,
-    QTableWidget,QTableWidgetItem,QHeaderView,QComboBox,QColorDialog,QSizePolicy,QLayout
+    QTableWidget,QTableWidgetItem,QHeaderView,QComboBox,QColorDialog,QSizePolicy,QLayout,
+    QProgressBar,QTableView,QAbstractItemView
 )
 
 
-from PyQt5.QtCore import Qt,QDir,QUrl
+from PyQt5.QtCore import Qt,QDir,QUrl,QThread,QTimer,pyqtSignal,QAbstractTableModel,QModelIndex
 from PyQt5.QtGui import QDoubleValidator, QIntValidator # Correct import
 from PyQt5.QtGui import QIcon,QBrush,QColor,QFont
 from PyQt5 import QtWidgets, QtCore
@@ -22,7 +23,6 @@ from PyQt5.QtWebEngineWidgets import QWebEngineView, QWebEngineSettings
 
 import pyvista as pv
 import pyvistaqt as pvqt
-import requests
 import json
 import os
 import numpy as np
@@ -31,10 +31,447 @@ from pyproj import Transformer
 import geopandas as gpd
 import pandas as pd
 import plotly.express as px
-from shapely.geometry import Point
 from geopy.distance import geodesic
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Modules shared with the model scripts live in the Scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "Scripts"))
+from FaultDatabase import (
+    CatalogIndex,
+    DatabaseClient,
+    DatabaseError,
+    MetadataStore,
+    RealizationCache,
+    RealizationPrefetcher,
+    realization_path,
+)
+from ModelCost import (
+    NPAIRS_MAX,
+    drm_box_nodes,
+    drm_elements,
+    drm_estimate,
+    format_bytes,
+    format_core_hours,
+    greens_function_cost,
+    greens_function_pairs,
+    source_points,
+)
+from ModelEnsemble import create_ensemble, ensemble_summary, select_realizations
+from StationGeometry import north_east_offsets
+from FaultSources import (
+    FAULT_COLUMNS,
+    FAULT_FORMATS,
+    FaultSourceStore,
+    aggregate_fault_points,
+    fault_file_format,
+    select_fault_sources,
+    stage_fault_file,
+)
+
+
+
+class MetadataRefreshThread(QThread):
+    """Revalidate the database metadata snapshot without blocking the GUI."""
+
+    # Emitted with the new catalog, or None if the snapshot is already current
+    refreshed = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, metadata_store, parent=None):
+        super().__init__(parent)
+        self.metadata_store = metadata_store
+
+    def run(self):
+        try:
+            data = self.metadata_store.refresh()
+        except DatabaseError as e:
+            self.failed.emit(str(e))
+            return
+        self.refreshed.emit(data)
+
+
+class RealizationDownloadThread(QThread):
+    """Load a realization from the cache or the database without blocking the GUI."""
+
+    # Bytes received and expected over all files (0 when unknown)
+    progress = pyqtSignal(object, object)
+    # (faultInfo, files, errors, cached) as returned by DatabaseClient.load_realization
+    loaded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, client, cache, path, directory, prefetcher=None, parent=None):
+        super().__init__(parent)
+        self.client = client
+        self.cache = cache
+        self.prefetcher = prefetcher
+        self.path = path
+        self.directory = directory
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+        self.files = {}
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def report(self, path, done, total):
+        # Called from the transfer threads; sum the progress of all files
+        with self.lock:
+            self.files[path] = (done, total)
+            received = sum(d for d, _ in self.files.values())
+            expected = 0 if any(t is None for _, t in self.files.values()) else sum(t for _, t in self.files.values())
+        self.progress.emit(received, expected)
+
+    def run(self):
+        try:
+            if self.prefetcher is not None:
+                # Prefetching pauses while the foreground download runs
+                with self.prefetcher.foreground():
+                    result = self.client.load_realization(
+                        self.path, self.directory, cache=self.cache, progress=self.report, cancel=self.cancel_event
+                    )
+            else:
+                result = self.client.load_realization(
+                    self.path, self.directory, cache=self.cache, progress=self.report, cancel=self.cancel_event
+                )
+        except DatabaseError as e:
+            self.failed.emit(str(e))
+            return
+        self.loaded.emit(result)
+
+
+class ArrayTableModel(QAbstractTableModel):
+    """
+    Editable table backed by a numpy structured array, one field per column.
+
+    Numeric cells hold NaN until they are set; text that is not a number is
+    rejected when edited, so the array always holds valid values.
+    """
+
+    # (field, header, dtype) of every column
+    columns = ()
+
+    def __init__(self, rows=1, parent=None):
+        super().__init__(parent)
+        self.dtype = np.dtype([(field, dtype) for field, _, dtype in self.columns])
+        self.array = self.empty(rows)
+
+    def empty(self, rows):
+        """Return rows blank rows: NaN numbers and empty strings."""
+        array = np.zeros(rows, dtype=self.dtype)
+        for field, _, dtype in self.columns:
+            if np.dtype(dtype).kind == "f":
+                array[field] = np.nan
+            elif np.dtype(dtype).kind == "O":
+                array[field] = ""
+        return array
+
+    def set_array(self, array):
+        self.beginResetModel()
+        self.array = array
+        self.endResetModel()
+
+    def insert_rows(self, row, count=1):
+        self.beginInsertRows(QModelIndex(), row, row + count - 1)
+        self.array = np.insert(self.array, row, self.empty(count))
+        self.endInsertRows()
+
+    def remove_rows(self, row, count=1):
+        self.beginRemoveRows(QModelIndex(), row, row + count - 1)
+        self.array = np.delete(self.array, np.arange(row, row + count))
+        self.endRemoveRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.array)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.columns[section][1]
+        return None
+
+    def display(self, row, column):
+        value = self.array[self.columns[column][0]][row]
+        if isinstance(value, str):
+            return value
+        return "" if np.isnan(value) else repr(float(value))
+
+    def data(self, index, role=Qt.DisplayRole):
+        if index.isValid() and role in (Qt.DisplayRole, Qt.EditRole):
+            return self.display(index.row(), index.column())
+        return None
+
+    def locked(self, row, column):
+        """Whether a cell is read-only."""
+        return False
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if not self.locked(index.row(), index.column()):
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid() or role != Qt.EditRole or self.locked(index.row(), index.column()):
+            return False
+        field = self.columns[index.column()][0]
+        if self.dtype[field].kind == "f":
+            text = str(value).strip()
+            if text == "":
+                value = np.nan
+            else:
+                try:
+                    value = float(text)
+                except ValueError:
+                    return False
+        elif self.dtype[field].kind == "O":
+            value = str(value)
+        self.array[field][index.row()] = value
+        self.dataChanged.emit(index, index)
+        return True
+
+    def invalid(self):
+        """
+        Return (row, field) of the first blank cell, or None if every cell is set.
+        """
+        for field, _, dtype in self.columns:
+            if np.dtype(dtype).kind == "f":
+                blank = np.isnan(self.array[field])
+            elif np.dtype(dtype).kind == "O":
+                blank = np.array([str(value).strip() == "" for value in self.array[field]], dtype=bool)
+            else:
+                blank = np.char.str_len(np.char.strip(self.array[field])) == 0
+            blank &= ~self.optional(field)
+            if blank.any():
+                return int(np.argmax(blank)), field
+        return None
+
+    def optional(self, field):
+        """Boolean mask of the rows whose field may be left blank."""
+        return np.zeros(len(self.array), dtype=bool)
+
+
+class StationTableModel(ArrayTableModel):
+    """Single stations: latitude, longitude and depth."""
+
+    columns = (
+        ("latitude", "Latitude", "f8"),
+        ("longitude", "Longitude", "f8"),
+        ("depth", "Depth (km)", "f8"),
+    )
+
+    def load(self, stations):
+        """Replace the stations with the dicts of a stations file (Latitude, Longitude, Depth)."""
+        array = np.empty(len(stations), dtype=self.dtype)
+        array["latitude"] = [station["Latitude"] for station in stations]
+        array["longitude"] = [station["Longitude"] for station in stations]
+        array["depth"] = [station["Depth"] for station in stations]
+        self.set_array(array)
+
+    def set_location(self, row, latitude, longitude):
+        self.array["latitude"][row] = float(latitude)
+        self.array["longitude"][row] = float(longitude)
+        self.dataChanged.emit(self.index(row, 0), self.index(row, 1))
+
+
+class CrustTableModel(ArrayTableModel):
+    """Crust layers from the top; the last row is the half space, of infinite thickness."""
+
+    columns = (
+        # object, so layer names of any length are kept
+        ("name", "Layer Name", "O"),
+        ("thick", "Thickness (km)", "f8"),
+        ("vp", "Vp (km/s)", "f8"),
+        ("vs", "Vs (km/s)", "f8"),
+        ("rho", "Density (g/cm³)", "f8"),
+        ("Qa", "Qp", "f8"),
+        ("Qb", "Qs", "f8"),
+    )
+
+    def __init__(self, parent=None):
+        super().__init__(1, parent)
+        self.array["name"][0] = "Half Space"
+        self.array["thick"][0] = 0
+
+    def load(self, layers):
+        """Replace the layers with the dicts of a crust file."""
+        array = np.empty(len(layers), dtype=self.dtype)
+        array["name"] = [layer["Layer Name"] for layer in layers]
+        array["thick"] = [layer["Thickness"] for layer in layers[:-1]] + [0]
+        for field, key in (("vp", "Vp"), ("vs", "Vs"), ("rho", "Density"), ("Qa", "Qp"), ("Qb", "Qs")):
+            array[field] = [layer[key] for layer in layers]
+        self.set_array(array)
+
+    def locked(self, row, column):
+        return row == len(self.array) - 1 and self.columns[column][0] == "thick"
+
+    def display(self, row, column):
+        if self.locked(row, column):
+            return "∞"
+        return super().display(row, column)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.FontRole and index.isValid() and self.locked(index.row(), index.column()):
+            return QFont("Arial", 20)
+        return super().data(index, role)
+
+    def optional(self, field):
+        # The thickness of the half space is not used
+        mask = np.zeros(len(self.array), dtype=bool)
+        if field == "thick":
+            mask[-1] = True
+        return mask
+
+    def thicknesses(self):
+        """Layer thicknesses with 0 for the half space."""
+        thick = self.array["thick"].copy()
+        thick[-1] = 0
+        return thick
+
+
+class CatalogTableModel(QAbstractTableModel):
+    """Table of the realizations of a CatalogIndex matching the search query."""
+
+    headers = ("Country", "Fault", "Magnitude", "Type", "Realization")
+
+    def __init__(self, catalog, parent=None):
+        super().__init__(parent)
+        self.catalog = catalog
+        self.query = ""
+        self.sort_field = None
+        self.sort_descending = False
+        self.rows = np.arange(len(catalog))
+
+    def set_catalog(self, catalog):
+        self.catalog = catalog
+        self.set_query(self.query)
+
+    def set_query(self, query):
+        self.beginResetModel()
+        self.query = query
+        self.rows = self.catalog.filter(query)
+        if self.sort_field is not None:
+            self.rows = self.catalog.sort(self.rows, self.sort_field, self.sort_descending)
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return str(self.catalog.value(self.rows[index.row()], CatalogIndex.fields[index.column()]))
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        if column < 0:
+            # No sort column: catalog order
+            self.sort_field = None
+            self.rows = np.sort(self.rows)
+        else:
+            self.sort_field = CatalogIndex.fields[column]
+            self.sort_descending = order == Qt.DescendingOrder
+            self.rows = self.catalog.sort(self.rows, self.sort_field, self.sort_descending)
+        self.layoutChanged.emit()
 
+    def entry(self, row):
+        return self.catalog.entry(self.rows[row])
+
+
+class EnsembleThread(QThread):
+    """Create an ensemble of models without blocking the GUI."""
+
+    message = pyqtSignal(str)
+    # (driver, results) as returned by create_ensemble
+    created = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, arguments, prefetcher=None, parent=None):
+        super().__init__(parent)
+        self.arguments = arguments
+        self.prefetcher = prefetcher
+
+    def run(self):
+        try:
+            if self.prefetcher is not None:
+                # Prefetching, and the cache evictions it causes, pause while the ensemble is built
+                with self.prefetcher.foreground():
+                    result = create_ensemble(**self.arguments, report=self.message.emit)
+            else:
+                result = create_ensemble(**self.arguments, report=self.message.emit)
+        except (OSError, ValueError) as e:
+            self.failed.emit(str(e))
+            return
+        self.created.emit(result)
+
+
+class PairPreviewThread(QThread):
+    """Count the unique Green's function pairs of the planned model without blocking the GUI."""
+
+    # Number of pairs, None when cancelled
+    counted = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, store, filenames, minslip, receivers, deltas, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.filenames = filenames
+        self.minslip = minslip
+        self.receivers = receivers
+        self.deltas = deltas
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            sources = source_points([self.store.get(filename) for filename in self.filenames], self.minslip)
+            npairs = greens_function_pairs(sources, self.receivers, *self.deltas, cancel=self.cancel_event.is_set)
+        except (OSError, ValueError, KeyError) as e:
+            self.failed.emit(str(e))
+            return
+        self.counted.emit(npairs)
+
+
+class DRMEstimateThread(QThread):
+    """Estimate the cost of a DRM run without blocking the GUI."""
+
+    # Dict of drm_estimate, None when cancelled
+    estimated = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, drmbox, analysis, sources, center, parent=None):
+        super().__init__(parent)
+        self.drmbox = drmbox
+        self.analysis = analysis
+        self.sources = sources
+        self.center = center
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        try:
+            estimate = drm_estimate(self.drmbox, self.analysis, self.sources, self.center, cancel=self.cancel_event.is_set)
+        except (ValueError, KeyError, ZeroDivisionError) as e:
+            self.failed.emit(str(e))
+            return
+        self.estimated.emit(estimate)
 
 
 class MainWindow(QMainWindow):
@@ -46,11 +483,34 @@ class MainWindow(QMainWindow):
 
         self.show()
 
+        # Revalidate the saved metadata snapshot in the background
+        self.update_database(quiet=True)
+
     def setup_global_variables(self):
         """Set up global variables for the main window."""
         self.tmp_lat = ""
         self.tmp_long = ""
         self.MeshObjects = {}
+        # Decoded fault files shared by plotting, mapping and model creation
+        self.fault_store = FaultSourceStore(max_bytes=2 * 1024**3)
+        # Maximum number of fault markers written to the fault map
+        self.map_max_points = 20000
+        # Pooled HTTP client for the fault database; incomplete downloads are kept
+        # in the cache folder so they can be resumed
+        ShakerMakerPath = os.path.dirname(os.path.abspath(__file__)).replace("\\", "/")
+        self.database_client = DatabaseClient(max_workers=8, partial_dir=f"{ShakerMakerPath}/Cache/partial")
+        self.download_thread = None
+        # Local cache of downloaded realizations
+        self.realization_cache = RealizationCache(f"{ShakerMakerPath}/Cache", max_bytes=10 * 1024**3)
+        # Low-priority download of the selected and next realizations into the cache
+        self.prefetcher = RealizationPrefetcher(self.database_client, self.realization_cache, max_rate=2 * 1024**2)
+        self.prefetch_depth = 3
+        # Database catalog: the saved snapshot if there is one, else the built-in catalog
+        self.metadata_store = MetadataStore(f"{ShakerMakerPath}/Cache", self.database_client)
+        self.metadata_thread = None
+        snapshot = self.metadata_store.load_snapshot()
+        if snapshot is not None:
+            self.data = snapshot
 
     def setup_toolbar_and_menu(self):
         """Create the toolbar and menu for the main window."""
@@ -216,7 +676,7 @@ class MainWindow(QMainWindow):
 
         # Active Scalars ComboBox
         active_scalars = QComboBox()
-        active_scalars.addItems(["Strike", "Dip", "Rake", "T0", "Slip", "None"])
+        active_scalars.addItems(["Strike", "Dip", "Rake", "T0", "Slip", "Segment", "None"])
         form_layout.addWidget(QLabel("Active Scalars"), 0, 2)
         form_layout.addWidget(active_scalars, 0, 3)
 
@@ -252,11 +712,10 @@ class MainWindow(QMainWindow):
         # Create a layout for the group box
         form_layout = QGridLayout(single_station_group)
 
-        # Create a table widget
-        self.single_stations_table = QTableWidget()
-        self.single_stations_table.setRowCount(1)
-        self.single_stations_table.setColumnCount(3)
-        self.single_stations_table.setHorizontalHeaderLabels(["Latitude", "Longitude", "Depth (km)"])
+        # Create a table view backed by a numpy array of stations
+        self.stations_model = StationTableModel(1, self)
+        self.single_stations_table = QTableView()
+        self.single_stations_table.setModel(self.stations_model)
         self.single_stations_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         self.single_stations_table.horizontalHeader().setStyleSheet(self.table_style)
         self.single_stations_table.setStyleSheet(self.table_style)
@@ -267,13 +726,13 @@ class MainWindow(QMainWindow):
         # Add Station button
         add_button = QPushButton("Add Station")
         add_button.setStyleSheet(self.button_style)
-        add_button.clicked.connect(lambda: self.single_stations_table.insertRow(0))
+        add_button.clicked.connect(lambda: self.stations_model.insert_rows(0))
         form_layout.addWidget(add_button, 1, 0)
 
         # Remove Station button
         remove_button = QPushButton("Remove Station")
         remove_button.setStyleSheet(self.button_style)
-        remove_button.clicked.connect(lambda: self.single_stations_table.removeRow(0) if self.single_stations_table.rowCount() > 1 else None)
+        remove_button.clicked.connect(lambda: self.stations_model.remove_rows(0) if self.stations_model.rowCount() > 1 else None)
         form_layout.addWidget(remove_button, 1, 1)
 
         # Load File button
@@ -448,25 +907,17 @@ class MainWindow(QMainWindow):
 
         # Process the data and populate the table for 'Single' station type
         if station_type == "single":
-            # Clear existing rows except the last one
-            for i in range(self.single_stations_table.rowCount() - 1):
-                self.single_stations_table.removeRow(0)
-            
-            # Populate the table with station data
-            for i, station in enumerate(data["station_info"][::-1]):
-                if "Latitude" not in station or "Longitude" not in station or "Depth" not in station:
-                    self.terminal_output.append("<font color='red'>Error: Stations file does not have all the keys in the station</font>")
-                    self.terminal_output.append(f"  format: {json.dumps({'Latitude': '', 'Longitude': '', 'Depth': ''}, indent=4)}")
-                    return
-                
-                # Insert a new row if needed
-                if i != 0:
-                    self.single_stations_table.insertRow(0)
-                
-                # Set the station data in the table
-                self.single_stations_table.setItem(0, 0, QTableWidgetItem(str(station["Latitude"])))
-                self.single_stations_table.setItem(0, 1, QTableWidgetItem(str(station["Longitude"])))
-                self.single_stations_table.setItem(0, 2, QTableWidgetItem(str(station["Depth"])))
+            # Replace the stations with the ones of the file in one step
+            try:
+                self.stations_model.load(data["station_info"])
+            except KeyError:
+                self.terminal_output.append("<font color='red'>Error: Stations file does not have all the keys in the station</font>")
+                self.terminal_output.append(f"  format: {json.dumps({'Latitude': '', 'Longitude': '', 'Depth': ''}, indent=4)}")
+                return
+            except (TypeError, ValueError):
+                self.terminal_output.append("<font color='red'>Error: Station latitude, longitude and depth must be float numbers</font>")
+                return
+            self.terminal_output.append(f"{self.stations_model.rowCount()} stations loaded")
 
         
     def show_table_context_menu(self, position):
@@ -502,8 +953,7 @@ class MainWindow(QMainWindow):
             return
 
         # Set latitude and longitude in the table's row
-        self.single_stations_table.setItem(row, 0, QTableWidgetItem(self.tmp_lat))  # Latitude
-        self.single_stations_table.setItem(row, 1, QTableWidgetItem(self.tmp_long))  # Longitude
+        self.stations_model.set_location(row, self.tmp_lat, self.tmp_long)
 
 
     def open_google_maps(self):
@@ -583,39 +1033,16 @@ class MainWindow(QMainWindow):
         # Create a layout for the group box
         form_layout = QGridLayout(crust_group)
 
-        # Add a table widget to the form layout
-        self.crust_table = QTableWidget()
-
-        # Set the number of rows and columns in the table
-        self.crust_table.setRowCount(1)
-        self.crust_table.setColumnCount(7)
-
-        # Set the headers for the table with HTML for mathematical symbols
-        self.crust_table.setHorizontalHeaderLabels([
-            "Layer Name", 
-            "Thickness (km)", 
-            "Vp (km/s)", 
-            "Vs (km/s)", 
-            "Density (g/cm³)",  # Unicode superscript for ³
-            "Qp", 
-            "Qs"
-        ])
-
-        # Set the first row of the table
-        self.crust_table.setItem(0, 0, QTableWidgetItem("Half Space"))
-        self.crust_table.setItem(0, 1, QTableWidgetItem("∞"))
-        # make the "Half Space" name and thickness bold and bigger font size for thicknees
-        # self.crust_table.item(0, 0).setFont(QFont("Arial", 10, QFont.Bold))
-        self.crust_table.item(0, 1).setFont(QFont("Arial", 20))
-
-        # Make the "Half Space" name and thickness uneditable
-        self.crust_table.item(0, 0).setFlags(Qt.ItemIsEnabled)
-        self.crust_table.item(0, 1).setFlags(Qt.ItemIsEnabled)
+        # Add a table view backed by a numpy array of layers; the model starts
+        # with the "Half Space" layer, whose infinite thickness is uneditable
+        self.crust_model = CrustTableModel(self)
+        self.crust_table = QTableView()
+        self.crust_table.setModel(self.crust_model)
 
         # Resize columns to fit contents while stretching the first column
         header = self.crust_table.horizontalHeader()
         header.setSectionResizeMode(0, QHeaderView.Stretch)  # Stretch "Layer Name" column
-        for i in range(0, self.crust_table.columnCount()):
+        for i in range(0, self.crust_model.columnCount()):
             header.setSectionResizeMode(i, QHeaderView.ResizeToContents)  # Minimize other columns
 
         # Add the table to the form layout
@@ -624,13 +1051,13 @@ class MainWindow(QMainWindow):
         # Add "Add Layer" button
         add_button = QPushButton("Add Layer")
         add_button.setStyleSheet(self.button_style)
-        add_button.clicked.connect(lambda: self.crust_table.insertRow(0))
+        add_button.clicked.connect(lambda: self.crust_model.insert_rows(0))
         form_layout.addWidget(add_button, 1, 0, 1, 3)
 
         # Add "Remove Layer" button
         remove_button = QPushButton("Remove Layer")
         remove_button.setStyleSheet(self.button_style)
-        remove_button.clicked.connect(lambda: self.crust_table.removeRow(0) if self.crust_table.rowCount() > 1 else None)
+        remove_button.clicked.connect(lambda: self.crust_model.remove_rows(0) if self.crust_model.rowCount() > 1 else None)
         form_layout.addWidget(remove_button, 1, 4, 1, 3)
 
         # Add "Load from File" button
@@ -678,24 +1105,17 @@ class MainWindow(QMainWindow):
 
             # Get the layers and populate the table
             layers = data.get("layers", data.get("crust"))
-            for i in range(self.crust_table.rowCount() - 1):
-                self.crust_table.removeRow(0)
-
-            for i, layer in enumerate(layers[::-1]):
-                if not all(key in layer for key in ["Layer Name", "Thickness", "Vp", "Vs", "Density", "Qp", "Qs"]):
-                    self.terminal_output.append("<font color='red'>Error: Crust file does not have all the keys in the layer</font>")
-                    return
-
-                if i != 0:
-                    self.crust_table.insertRow(0)
-
-                self.crust_table.setItem(0, 0, QTableWidgetItem(layer["Layer Name"]))
-                self.crust_table.setItem(0, 1, QTableWidgetItem(str(layer["Thickness"])))
-                self.crust_table.setItem(0, 2, QTableWidgetItem(str(layer["Vp"])))
-                self.crust_table.setItem(0, 3, QTableWidgetItem(str(layer["Vs"])))
-                self.crust_table.setItem(0, 4, QTableWidgetItem(str(layer["Density"])))
-                self.crust_table.setItem(0, 5, QTableWidgetItem(str(layer["Qp"])))
-                self.crust_table.setItem(0, 6, QTableWidgetItem(str(layer["Qs"])))
+            if not layers:
+                self.terminal_output.append("<font color='red'>Error: Crust file does not have any layer</font>")
+                return
+            try:
+                self.crust_model.load(layers)
+            except KeyError:
+                self.terminal_output.append("<font color='red'>Error: Crust file does not have all the keys in the layer</font>")
+                return
+            except (TypeError, ValueError):
+                self.terminal_output.append("<font color='red'>Error: Crust layer properties must be float numbers</font>")
+                return
 
         # Apply table and group styles
         self.crust_table.horizontalHeader().setStyleSheet(self.table_style)
@@ -713,15 +1133,13 @@ class MainWindow(QMainWindow):
         if clear:
             self.Plotter.clear()
 
-        thicknesses = []
-        # Read all the thicknesses in the table
-        for i in range(self.crust_table.rowCount()):
-            thickness = self.crust_table.item(i, 1).text()
-            # Check for the last row
-            if thickness == "∞":
-                thicknesses.append(0)
-            else:
-                thicknesses.append(float(thickness))
+        # Read all the thicknesses in the table (0 for the half space)
+        thicknesses = self.crust_model.thicknesses()
+        if np.isnan(thicknesses).any():
+            row = int(np.argmax(np.isnan(thicknesses)))
+            self.terminal_output.append(f"<font color='red'>Error: Thickness for layer {row + 1} is not set</font>")
+            return
+        names = self.crust_model.array["name"]
 
         # Create the mesh
         # Check if the fault mesh exists
@@ -758,11 +1176,11 @@ class MainWindow(QMainWindow):
                 else:
                     thick = thicknesses[i]
 
-                if self.crust_table.item(i, 0) is None:
+                if names[i].strip() == "":
                     self.terminal_output.append(f"<font color='red'>Error: Layer name for layer {i + 1} is not set</font>")
                     return
 
-                Crust.append(pv.Cube(bounds=[xmin, xmax, ymin, ymax, depth, depth + thick]), name=self.crust_table.item(i, 0).text())
+                Crust.append(pv.Cube(bounds=[xmin, xmax, ymin, ymax, depth, depth + thick]), name=str(names[i]))
                 depth += thicknesses[i]
 
         # Add the crust mesh to the plotter
@@ -770,6 +1188,71 @@ class MainWindow(QMainWindow):
         self.view_ShakerMaker()
         self.MeshObjects["Crust"] = Crust
 
+    def get_fault_files(self):
+        """Returns the validated fault file paths of the file table, or None on error."""
+        # Check if there are any fault files
+        if self.source_filestable.rowCount() == 0:
+            self.terminal_output.append("<font color='red'>Error: No fault files are set</font>")
+            return None
+
+        file_paths = []
+        for i in range(self.source_filestable.rowCount()):
+            # Get the file path
+            if self.source_filestable.item(i, 0) is None:
+                self.terminal_output.append(f"<font color='red'>Error: File path for fault {i + 1} is not set</font>")
+                return None
+
+            file_path = self.source_filestable.item(i, 0).text()
+
+            if file_path == "":
+                self.terminal_output.append(f"<font color='red'>Error: File path for fault {i + 1} is not set</font>")
+                return None
+
+            # Check if the file exists
+            if not os.path.exists(file_path):
+                self.terminal_output.append(f"<font color='red'>Error: File {file_path} does not exist</font>")
+                return None
+
+            # Check if the file format is supported
+            if fault_file_format(file_path) not in FAULT_FORMATS:
+                self.terminal_output.append(f"<font color='red'>Error: File {file_path} is not a json or npz file</font>")
+                self.terminal_output.append(f"<font color='red'>Error: File {file_path} is not supported</font>")
+                return None
+
+            file_paths.append(file_path)
+
+        return file_paths
+
+    def build_fault_mesh(self, file_paths, minslip=None):
+        """
+        Builds a single point mesh of all fault segments.
+        The files are decoded in parallel, the columns of all segments are concatenated once
+        and every point carries the index of its segment in the "Segment" array.
+        Returns the mesh and the number of points of each segment.
+        """
+        # Decode the segments in parallel (the fault store skips files already decoded)
+        with ThreadPoolExecutor(max_workers=min(8, len(file_paths))) as pool:
+            segments = list(pool.map(self.fault_store.get, file_paths))
+
+        # Filter the sources based on the minimum slip
+        if minslip is not None:
+            segments = [select_fault_sources(segment, segment['slip'] > minslip) for segment in segments]
+        counts = [len(segment['x']) for segment in segments]
+
+        # Concatenate the columns of all segments once
+        columns = {name: np.concatenate([segment[name] for segment in segments]) for name in FAULT_COLUMNS}
+
+        # Create the mesh
+        Mesh = pv.PolyData(np.column_stack((columns['x'], columns['y'], columns['z'])))
+        Mesh['Strike'] = columns['strike']
+        Mesh['Dip'] = columns['dip']
+        Mesh['Rake'] = columns['rake']
+        Mesh['T0'] = columns['t0']
+        Mesh['Slip'] = columns['slip']
+        Mesh['Segment'] = np.repeat(np.arange(len(segments), dtype=np.int32), counts)
+
+        return Mesh, counts
+
     def create_fault_mesh(self, active_scalar, clear=True):
         """Creates the fault mesh based on the metadata and fault files."""
         # First clean the plotter
@@ -781,91 +1264,28 @@ class MainWindow(QMainWindow):
             self.terminal_output.append("<font color='red'>Error: Fault meta data file is not set</font>")
             return
 
-        meshlist = []
-
-        # Check if there are any fault files
-        if self.source_filestable.rowCount() == 0:
-            self.terminal_output.append("<font color='red'>Error: No fault files are set</font>")
+        # Check the fault files
+        file_paths = self.get_fault_files()
+        if file_paths is None:
             return
 
-        numFaults = self.source_filestable.rowCount()
+        numFaults = len(file_paths)
 
         # Read the fault meta data file
         faultinfo = json.load(open(self.source_meta_input.text(), "r"))
         xfault = faultinfo['xmean']
         yfault = faultinfo['ymean']
 
-        # Load the fault files
-        for i in range(numFaults):
-            # Get the file path
-            if self.source_filestable.item(i, 0) is None:
-                self.terminal_output.append(f"<font color='red'>Error: File path for fault {i + 1} is not set</font>")
-                return
-
-            file_path = self.source_filestable.item(i, 0).text()
-
-            if file_path == "":
-                self.terminal_output.append(f"<font color='red'>Error: File path for fault {i + 1} is not set</font>")
-                return
-
-            # Check if the file exists
-            if not os.path.exists(file_path):
-                self.terminal_output.append(f"<font color='red'>Error: File {file_path} does not exist</font>")
-                return
-            
-            # Check if the file is a valid JSON
-            if file_path.split(".")[-1] != "json":
-                self.terminal_output.append(f"<font color='red'>Error: File {file_path} is not a json file</font>")
-                self.terminal_output.append(f"<font color='red'>Error: File {file_path} is not supported</font>")
-                return
-
-            # Read the file
-            with open(file_path, "r") as f:
-                sources = json.load(f)
-
-            x = np.zeros(len(sources))
-            y = np.zeros(len(sources))
-            z = np.zeros(len(sources))
-            c1 = np.zeros(len(sources))
-            c2 = np.zeros(len(sources))
-            c3 = np.zeros(len(sources))
-            c4 = np.zeros(len(sources))
-            c5 = np.zeros(len(sources))
-
-            for j, source in enumerate(sources):
-                x[j] = source['x']
-                y[j] = source['y']
-                z[j] = source['z']
-                c1[j] = source['strike']
-                c2[j] = source['dip']
-                c3[j] = source['rake']
-                c4[j] = source['t0']
-                c5[j] = source['slip']
-
-            # Filter the sources based on the minimum slip
-            #check that minum slip can be converted to float
-            try:
-                minslip = float(self.source_min_slip_input.text())
-            except ValueError:
-                self.terminal_output.append("<font color='red'>Error: Minimum slip must be a number</font>")
-                return 
+        # Filter the sources based on the minimum slip
+        #check that minum slip can be converted to float
+        try:
             minslip = float(self.source_min_slip_input.text())
-            indicies = np.where(c5 > minslip)[0]
-            x, y, z, c1, c2, c3, c4, c5 = x[indicies], y[indicies], z[indicies], c1[indicies], c2[indicies], c3[indicies], c4[indicies], c5[indicies]
-
-            # Create the mesh
-            mesh = pv.PolyData(np.c_[x, y, z])
-            mesh['Strike'] = c1
-            mesh['Dip'] = c2
-            mesh['Rake'] = c3
-            mesh['T0'] = c4
-            mesh['Slip'] = c5
-            meshlist.append(mesh)
-
-        # Merge the meshes
-        Mesh = meshlist[0]
-        for i in range(1, numFaults):
-            Mesh = Mesh.merge(meshlist[i])
+        except ValueError:
+            self.terminal_output.append("<font color='red'>Error: Minimum slip must be a number</font>")
+            return 
+
+        # Create the mesh of all the fault files
+        Mesh, counts = self.build_fault_mesh(file_paths, minslip=minslip)
 
         # Shift the mesh to the center of the fault
         Mesh.points -= np.array([xfault, yfault, 0])
@@ -884,8 +1304,7 @@ class MainWindow(QMainWindow):
         self.terminal_output.append(f"Number of faults: {numFaults}")
         self.terminal_output.append(f"Fault meta data file: {self.source_meta_input.text()}")
         for i in range(numFaults):
-            npoints = len(meshlist[i].points)
-            self.terminal_output.append(f"Fault {i + 1}: {npoints} points")
+            self.terminal_output.append(f"Fault {i + 1}: {counts[i]} points")
 
     def view_ShakerMaker(self, do_iso=True):
         """Defines the ShakerMaker style view."""
@@ -920,126 +1339,49 @@ class MainWindow(QMainWindow):
             self.terminal_output.append("<font color='red'>Error: Fault meta data file is not set</font>")
             return
 
-        meshlist = []
-
-        # Check for fault files
-        if self.source_filestable.rowCount() == 0:
-            self.terminal_output.append("<font color='red'>Error: No fault files are set</font>")
+        # Check the fault files
+        file_paths = self.get_fault_files()
+        if file_paths is None:
             return
 
-        numFaults = self.source_filestable.rowCount()  
-
         # Read the fault meta data file
         faultinfo = json.load(open(self.source_meta_input.text(), "r"))
         xfault = faultinfo['xmean']
         yfault = faultinfo['ymean']
 
-        # Load the fault files
-        for i in range(self.source_filestable.rowCount()):
-            # Get the file path
-            if self.source_filestable.item(i, 0) is None:
-                self.terminal_output.append(f"<font color='red'>Error: File path for fault {i + 1} is not set</font>")
-                return
-            
-            file_path = self.source_filestable.item(i, 0).text()
-
-            if file_path == "":
-                self.terminal_output.append(f"<font color='red'>Error: File path for fault {i + 1} is not set</font>")
-                return
-
-            # Check if the file exists
-            if not os.path.exists(file_path):
-                self.terminal_output.append(f"<font color='red'>Error: File {file_path} does not exist</font>")
-                return
-
-            # Get the format of the file
-            format = file_path.split(".")[-1]
-            if format != "json":
-                self.terminal_output.append(f"<font color='red'>Error: File {file_path} is not a json file</font>")
-                self.terminal_output.append(f"<font color='red'>Error: File {file_path} is not supported</font>")
-                return
-            
-            # Read the file
-            with open(file_path, "r") as f:
-                sources = json.load(f)
-            x = np.zeros(len(sources))
-            y = np.zeros(len(sources))
-            z = np.zeros(len(sources))
-
-            for j, source in enumerate(sources):
-                sourcetype = source['stf']['type']  # noqa: F841
-                x[j] = source['x']
-                y[j] = source['y']
-                z[j] = source['z']
-
-            mesh = pv.PolyData(np.c_[x, y, z])
-            meshlist.append(mesh)
-
-        Mesh = meshlist[0]  
-        for i in range(1, numFaults):
-            Mesh = Mesh.merge(meshlist[i]) 
+        # Create the mesh of all the fault files
+        Mesh, _ = self.build_fault_mesh(file_paths)
 
+        # Aggregate dense fault points on a grid so the map stays light
         xy = Mesh.points[:, :2]
+        npoints = len(xy)
+        x, y, counts = aggregate_fault_points(xy[:, 0], xy[:, 1], max_points=self.map_max_points)
+        if len(x) < npoints:
+            self.terminal_output.append(f"Map: {npoints} fault points aggregated into {len(x)} cells")
+
         transformer = Transformer.from_crs(faultinfo['epsg'], 'epsg:4326')
-        xy = xy * 1000
 
-        # Add (xfault, yfault) to the first row of xy
-        xy = np.vstack((xy, [xfault, yfault]))
+        # Add (xfault, yfault) to the last row of xy
+        xy = np.column_stack((np.append(x * 1000, xfault), np.append(y * 1000, yfault)))
         x2, y2 = transformer.transform(xy[:, 1], xy[:, 0])
-        geometry1 = [Point(xy) for xy in zip(x2, y2)]
-        gdf1 = gpd.GeoDataFrame(geometry=geometry1)
-        gdf1['type'] = 'Fault'
-        gdf1.loc[gdf1.index[-1], 'type'] = 'Fault Center'
-
-        # if info['plottingStation'].lower() in ['yes', 'true']:
-        #     stationCoordinates = info['stationCoordinates']  # noqa: N806
-        #     coords = []
-        #     xy2 = []
-        #     for coord in stationCoordinates:
-        #         north, east = calculate_distances_with_direction(
-        #             faultinfo['latitude'], faultinfo['longitude'], coord[0], coord[1]
-        #         )
-        #         coords.append([north, east, coord[2]])
-        #         xy2.append([north + xfault, east + yfault])
-
-        #     stations = pv.PolyData(np.array(coords))
-
-        #     xmin0, xmax0, ymin0, ymax0, zmin0, zmax0 = stations.bounds
-        #     # Update extreme values
-        #     xmin = min(xmin, xmin0)
-        #     xmax = max(xmax, xmax0)
-        #     ymin = min(ymin, ymin0)
-        #     ymax = max(ymax, ymax0)
-        #     zmin = min(zmin, zmin0)
-        #     zmax = max(zmax, zmax0)
-
-        # if info['plottingStation'].lower() in ['yes', 'true']:
-        #     xy2 = np.array(xy2) * 1000
-        #     x2, y2 = transformer.transform(xy2[:, 1], xy2[:, 0])
-        #     geometry2 = [Point(xy) for xy in zip(x2, y2)]
-        #     gdf2 = gpd.GeoDataFrame(geometry=geometry2)
-        #     gdf2['type'] = 'Station'
-        #     # Make the first row of the type column of gdf2 to be "Fault Center"
-
-        #     gdf = gpd.GeoDataFrame(pd.concat([gdf1, gdf2], ignore_index=True))
-        # else:
-        gdf = gdf1
+        gdf = gpd.GeoDataFrame(geometry=gpd.points_from_xy(x2, y2))
+        types = np.full(len(gdf), 'Fault', dtype=object)
+        types[-1] = 'Fault Center'
 
         # Move the row with 'Fault Center' type to the last row
         faultlat = faultinfo['latitude']
         faultlon = faultinfo['longitude']
 
-        # Find the closest station to the fault center
-        fault_center = Point(faultlat, faultlon)
-        # Find the closest point and change the type to "Fault Center"
-        gdf['distance'] = gdf['geometry'].apply(lambda x: x.distance(fault_center))
-        gdf = gdf.sort_values('distance', ascending=False)
-        gdf.loc[gdf.index[-1], 'type'] = 'Fault Center'
+        # Find the closest point to the fault center and change the type to "Fault Center"
+        distance = np.hypot(np.asarray(x2) - faultlat, np.asarray(y2) - faultlon)
+        types[np.argmin(distance)] = 'Fault Center'
+        gdf['type'] = types
+        gdf['points'] = np.append(counts, 1)
 
         # Use different colors for fault and stations
         color_map = {'Fault': 'blue', 'Station': 'red', 'Fault Center': 'green'}
-        gdf['size'] = gdf['type'].apply(lambda x: 50 if x != 'Fault' else 0.25)
-        gdf['marker'] = gdf['type'].apply(lambda x: 'x' if x == 'Fault Center' else 'o')
+        gdf['size'] = np.where(types != 'Fault', 50, 0.25)
+        gdf['marker'] = np.where(types == 'Fault Center', 'x', 'o')
 
         # Plot with custom colors
         fig = px.scatter_mapbox(
@@ -1048,6 +1390,7 @@ class MainWindow(QMainWindow):
             lon=gdf.geometry.y,
             color=gdf['type'],
             size=gdf['size'],
+            hover_data={'points': True},
             color_discrete_map=color_map,  # Apply the custom color map
         )
         
@@ -1066,7 +1409,7 @@ class MainWindow(QMainWindow):
         basepath = self.dir_input.text().replace("\\", "/")
         file = f'{basepath}/faults_map.html'
         file = file.replace('\\', '/')
-        fig.write_html(file)
+        fig.write_html(file, include_plotlyjs='cdn')
 
         # Open new window and view with the webengine view
         new_window = QDialog(self)
@@ -1260,7 +1603,50 @@ class MainWindow(QMainWindow):
         updateDatabase_button = QPushButton("Update Database")
         updateDatabase_button.setStyleSheet(self.button_style)
         form_layout.addWidget(updateDatabase_button, 5,1)
-        updateDatabase_button.clicked.connect(self.update_database)
+        updateDatabase_button.clicked.connect(lambda: self.update_database())
+
+        # download progress and cancel button, shown while a realization downloads
+        self.database_progress = QProgressBar()
+        self.database_progress.setVisible(False)
+        form_layout.addWidget(self.database_progress, 6, 0)
+        self.database_cancel_button = QPushButton("Cancel")
+        self.database_cancel_button.setStyleSheet(self.button_style)
+        self.database_cancel_button.setVisible(False)
+        form_layout.addWidget(self.database_cancel_button, 6, 1)
+        self.database_cancel_button.clicked.connect(self.cancel_load_database)
+
+        # prefetch the selected realization and the next ones into the local cache
+        self.prefetch_checkbox = QtWidgets.QCheckBox("Prefetch realizations")
+        self.prefetch_checkbox.setChecked(False)
+        form_layout.addWidget(self.prefetch_checkbox, 7, 0, 1, 2)
+        self.prefetch_checkbox.toggled.connect(lambda checked: self.prefetch_realizations())
+
+        # searchable table of all realizations; double click selects one
+        self.catalog_search = QLineEdit()
+        self.catalog_search.setPlaceholderText('Search, e.g. country:"United States" m>=7 type=hf')
+        form_layout.addWidget(self.catalog_search, 8, 0, 1, 2)
+        self.catalog_model = CatalogTableModel(CatalogIndex(self.data), self)
+        self.catalog_view = QTableView()
+        self.catalog_view.setModel(self.catalog_model)
+        self.catalog_view.setSortingEnabled(True)
+        self.catalog_view.sortByColumn(-1, Qt.AscendingOrder)
+        self.catalog_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.catalog_view.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.catalog_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.catalog_view.verticalHeader().setVisible(False)
+        self.catalog_view.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        form_layout.addWidget(self.catalog_view, 9, 0, 1, 2)
+        self.catalog_count = QLabel()
+        form_layout.addWidget(self.catalog_count, 10, 0, 1, 2)
+        self.update_catalog_count()
+
+        # filter as the user types, once typing pauses
+        self.catalog_timer = QTimer(self)
+        self.catalog_timer.setSingleShot(True)
+        self.catalog_timer.setInterval(150)
+        self.catalog_timer.timeout.connect(self.filter_catalog)
+        self.catalog_search.textChanged.connect(lambda text: self.catalog_timer.start())
+        self.catalog_view.doubleClicked.connect(lambda index: self.select_catalog_entry(index.row()))
 
 
 
@@ -1305,6 +1691,7 @@ class MainWindow(QMainWindow):
             self.realizations_input.clear()
             self.realizations_input.addItems(realizations)
             self.realizations_input.blockSignals(False)
+            self.prefetch_realizations()
 
 
 
@@ -1314,12 +1701,17 @@ class MainWindow(QMainWindow):
         self.fault_input.currentTextChanged.connect(update_magnitudes)
         self.magnitude_input.currentTextChanged.connect(update_types)
         self.types_input.currentTextChanged.connect(update_realizations)
+        self.realizations_input.currentTextChanged.connect(lambda text: self.prefetch_realizations())
 
         return database_group
     
 
     
     def load_database(self):
+        if self.download_thread is not None and self.download_thread.isRunning():
+            self.terminal_output.append("<font color='orange'>Warning: A realization is already downloading</font>")
+            return
+
         # Check that the input directory is set
         if self.dir_input.text() == "":
             self.terminal_output.append("<font color='red'>Error: Working directory is not set</font>")
@@ -1332,7 +1724,8 @@ class MainWindow(QMainWindow):
         
         # Clear the directory before loading new files
         for file in os.listdir(self.dir_input.text()):
-            os.remove(os.path.join(self.dir_input.text(), file))
+            if os.path.isfile(os.path.join(self.dir_input.text(), file)):
+                os.remove(os.path.join(self.dir_input.text(), file))
 
         # Read selected options
         country = self.country_input.currentText()
@@ -1340,17 +1733,94 @@ class MainWindow(QMainWindow):
         magnitude = self.magnitude_input.currentText()
         type = self.types_input.currentText()
         realization = self.realizations_input.currentText()
+        path = realization_path(country, fault, magnitude, type, realization)
+
+        # Take the realization from the local cache, or download the fault info JSON file
+        # and then the fault and source time function files concurrently in the background
+        self.download_thread = RealizationDownloadThread(self.database_client, self.realization_cache, path, self.dir_input.text(), self.prefetcher, self)
+        self.download_thread.progress.connect(self.load_database_progress)
+        self.download_thread.loaded.connect(self.load_database_finished)
+        self.download_thread.failed.connect(self.load_database_failed)
+        self.download_thread.finished.connect(self.load_database_done)
+
+        self.database_progress.setRange(0, 0)
+        self.database_progress.setVisible(True)
+        self.database_cancel_button.setVisible(True)
+        self.terminal_output.append(f"Loading realization {path}")
+        self.download_thread.start()
+
+    def filter_catalog(self):
+        """Show the realizations matching the search box."""
+        self.catalog_model.set_query(self.catalog_search.text())
+        self.update_catalog_count()
+
+    def update_catalog_count(self):
+        self.catalog_count.setText(f"{self.catalog_model.rowCount()} of {len(self.catalog_model.catalog)} realizations")
+
+    def select_catalog_entry(self, row):
+        """Select a realization of the catalog table in the database comboboxes."""
+        country, fault, magnitude, type, realization = self.catalog_model.entry(row)
+        # each change repopulates the comboboxes below it
+        self.country_input.setCurrentText(country)
+        self.fault_input.setCurrentText(fault)
+        self.magnitude_input.setCurrentText(magnitude)
+        self.types_input.setCurrentText(type)
+        self.realizations_input.setCurrentText(realization)
+
+    def prefetch_realizations(self):
+        """Prefetch the selected realization and the next ones in the list when enabled."""
+        if not self.prefetch_checkbox.isChecked():
+            self.prefetcher.request([])
+            return
+
+        country = self.country_input.currentText()
+        fault = self.fault_input.currentText()
+        magnitude = self.magnitude_input.currentText()
+        type = self.types_input.currentText()
+        index = self.realizations_input.currentIndex()
+        if index < 0:
+            return
+        realizations = [self.realizations_input.itemText(i) for i in range(index, min(index + 1 + self.prefetch_depth, self.realizations_input.count()))]
+        self.prefetcher.request([realization_path(country, fault, magnitude, type, r) for r in realizations])
+
+    def load_database_progress(self, received, expected):
+        """Show the download progress in megabytes."""
+        if expected:
+            self.database_progress.setRange(0, max(1, expected // 1024**2))
+            self.database_progress.setValue(received // 1024**2)
+            self.database_progress.setFormat(f"{received / 1024**2:.1f} / {expected / 1024**2:.1f} MB")
+        else:
+            self.database_progress.setRange(0, 0)
+
+    def cancel_load_database(self):
+        """Stop the running download; its partial files are kept for a later resume."""
+        if self.download_thread is not None and self.download_thread.isRunning():
+            self.download_thread.cancel()
 
-        # Download fault info JSON file
-        url = f"https://raw.githubusercontent.com/amnp95/ShakerMakerFaultDatabase/Pythoninterface/{country}/{fault}/M_{magnitude}_type_{type}_number_{realization}/faultInfo.json"
-        res = requests.get(url)
+    def load_database_done(self):
+        self.database_progress.setVisible(False)
+        self.database_cancel_button.setVisible(False)
 
-        if res.status_code != 200:
-            self.terminal_output.append(f"<font color='red'>Error: Database failed to load </font>")
-            self.terminal_output.append(f"  message: {res.text}")
+    def load_database_failed(self, message):
+        self.terminal_output.append(f"<font color='red'>Error: Database failed to load </font>")
+        self.terminal_output.append(f"  message: {message}")
+
+    def load_database_finished(self, result):
+        """Fill the source inputs with a loaded realization."""
+        faultInfo, downloaded, errors, cached = result
+        basePath = self.download_thread.directory + "/"
+
+        # A cancelled download resumes from where it stopped when loaded again
+        if errors and self.download_thread.cancel_event.is_set():
+            self.terminal_output.append("<font color='orange'>Warning: Download cancelled, load the realization again to resume it</font>")
             return
 
-        faultInfo = res.json()
+        # Report every file that failed
+        if errors:
+            for file, message in errors:
+                self.terminal_output.append(f"<font color='red'>Error: {file} failed to download </font>")
+                self.terminal_output.append(f"  message: {message}")
+            return
         
         # Set latitude and longitude in the input fields
         lat = faultInfo["latitude"]
@@ -1358,64 +1828,24 @@ class MainWindow(QMainWindow):
         self.source_lat_input.setText(str(lat))
         self.source_lon_input.setText(str(lon))
 
-        # Clear the table and prepare to add new files
+        # Clear the table and add the downloaded fault files
         self.source_filestable.setRowCount(0)
-        basePath = self.dir_input.text() + "/"
-        faultfiles = faultInfo["Faultfilenames"]
-
-        # Download fault files
-        for file in faultfiles:
-            url = f"https://raw.githubusercontent.com/amnp95/ShakerMakerFaultDatabase/Pythoninterface/{country}/{fault}/M_{magnitude}_type_{type}_number_{realization}/{file}"
-            try:
-                response = requests.get(url, stream=True)
-                if response.status_code == 200:
-                    filePath = basePath + file
-                    with open(filePath, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            if chunk:  # Only write non-empty chunks
-                                f.write(chunk)
-                    
-                    row_count = self.source_filestable.rowCount()
-                    self.source_filestable.setRowCount(row_count + 1)
-                    self.source_filestable.setItem(row_count, 0, QTableWidgetItem(basePath + file))
-
-                    # Create Browse button
-                    browse_button = QPushButton("Browse")
-                    browse_button.setStyleSheet(self.button_style)
-                    self.source_filestable.setCellWidget(row_count, 1, browse_button)
-                    browse_button.clicked.connect(lambda: self.find_button_location_and_browse(browse_button))
-
-                    # Create Remove button
-                    remove_button = QPushButton("Remove")
-                    remove_button.setStyleSheet(self.button_style)
-                    self.source_filestable.setCellWidget(row_count, 2, remove_button)
-                    remove_button.clicked.connect(lambda: self.remove_table_row(remove_button))
-                else:
-                    self.terminal_output.append(f"<font color='red'>Error: {file} failed to download </font>")
-                    return
-            except requests.exceptions.RequestException as e:
-                print(f"Download failed due to: {e}")
-
-        # Download additional required files
-        additional_files = [
-            faultInfo["SourceTimeFunction"]["filename"],
-            "faultInfo.json"
-        ]
-        for file in additional_files:
-            url = f"https://raw.githubusercontent.com/amnp95/ShakerMakerFaultDatabase/Pythoninterface/{country}/{fault}/M_{magnitude}_type_{type}_number_{realization}/{file}"
-            try:
-                response = requests.get(url, stream=True)
-                if response.status_code == 200:
-                    filePath = basePath + file
-                    with open(filePath, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            if chunk:  # Only write non-empty chunks
-                                f.write(chunk)
-                else:
-                    self.terminal_output.append(f"<font color='red'>Error: {file} failed to download </font>")
-                    return
-            except requests.exceptions.RequestException as e:
-                print(f"Download failed due to: {e}")
+        for file in faultInfo["Faultfilenames"]:
+            row_count = self.source_filestable.rowCount()
+            self.source_filestable.setRowCount(row_count + 1)
+            self.source_filestable.setItem(row_count, 0, QTableWidgetItem(basePath + file))
+
+            # Create Browse button
+            browse_button = QPushButton("Browse")
+            browse_button.setStyleSheet(self.button_style)
+            self.source_filestable.setCellWidget(row_count, 1, browse_button)
+            browse_button.clicked.connect(lambda checked, button=browse_button: self.find_button_location_and_browse(button))
+
+            # Create Remove button
+            remove_button = QPushButton("Remove")
+            remove_button.setStyleSheet(self.button_style)
+            self.source_filestable.setCellWidget(row_count, 2, remove_button)
+            remove_button.clicked.connect(lambda checked, button=remove_button: self.remove_table_row(button))
 
         # Set paths for meta and time function files
         self.source_meta_input.setText(basePath + "faultInfo.json")
@@ -1427,22 +1857,41 @@ class MainWindow(QMainWindow):
         self.terminal_output.append(f"\tLatitude: {lat}")
         self.terminal_output.append(f"\tLongitude: {lon}")
         self.terminal_output.append(f"\tEPSG: {faultInfo['epsg']}")
-        self.terminal_output.append(f"\tFiles downloaded to: {self.dir_input.text()}")
+        if cached:
+            self.terminal_output.append(f"\tFiles loaded from the local cache to: {self.download_thread.directory}")
+        else:
+            self.terminal_output.append(f"\tFiles downloaded to: {self.download_thread.directory}")
 
 
 
 
-    def update_database(self):
-        """Update the database metadata and populate the country input."""
-        res = requests.get("https://raw.githubusercontent.com/amnp95/ShakerMakerFaultDatabase/Pythoninterface/DatabaseMetadata.json")
-        
-        if res.status_code != 200:
-            self.terminal_output.append("<font color='red'>Error: Database Metadata failed to load </font>")
-            self.terminal_output.append(f"  message: {res.text}")
+    def update_database(self, quiet=False):
+        """Revalidate the database metadata in the background and repopulate the country input."""
+        if self.metadata_thread is not None and self.metadata_thread.isRunning():
             return
-        
-        # Update global variable and populate country input
-        self.data = res.json()
+
+        self.metadata_thread = MetadataRefreshThread(self.metadata_store, self)
+        self.metadata_thread.refreshed.connect(lambda data: self.apply_database_metadata(data, quiet))
+        self.metadata_thread.failed.connect(lambda message: self.database_metadata_failed(message, quiet))
+        self.metadata_thread.start()
+
+    def database_metadata_failed(self, message, quiet):
+        """Report a failed metadata refresh; the current catalog stays in use."""
+        color = "orange" if quiet else "red"
+        self.terminal_output.append(f"<font color='{color}'>Warning: Database Metadata could not be refreshed, using the saved catalog</font>")
+        self.terminal_output.append(f"  message: {message}")
+
+    def apply_database_metadata(self, data, quiet=False):
+        """Use a refreshed catalog and populate the country input."""
+        if data is None:
+            if not quiet:
+                self.terminal_output.append("<font color='green'>Success: Database Metadata is up to date</font>")
+            return
+
+        # Update global variable, the catalog table and populate country input
+        self.data = data
+        self.catalog_model.set_catalog(CatalogIndex(self.data))
+        self.update_catalog_count()
         countries = self.data['Countries']
         
         self.country_input.blockSignals(True)
@@ -1943,16 +2392,37 @@ class MainWindow(QMainWindow):
         # Add push button to create the model
         self.model_dir = QLineEdit()
         self.model_dir.setText(f"{ShakerMakerPath}"   + "/Model")
-        form_layout.addWidget(QLabel("Model Directory"), 8,0)
-        form_layout.addWidget(self.model_dir, 8,1)
-        form_layout.addWidget(QLabel("Directory to save the model"), 8,2)
+        form_layout.addWidget(QLabel("Model Directory"), 9,0)
+        form_layout.addWidget(self.model_dir, 9,1)
+        form_layout.addWidget(QLabel("Directory to save the model"), 9,2)
 
 
         
         create_button = QPushButton("Create Model")
         create_button.setStyleSheet(self.button_style)
         create_button.clicked.connect(self.create_model)
-        form_layout.addWidget(create_button, 9,0,1,3)
+        form_layout.addWidget(create_button, 10,0,1,3)
+
+        # Ensemble of models, one per selected realization of the database selection
+        self.ensemble_input = QLineEdit()
+        self.ensemble_input.setText("all")
+        form_layout.addWidget(QLabel("Ensemble Realizations"), 11,0)
+        form_layout.addWidget(self.ensemble_input, 11,1)
+        form_layout.addWidget(QLabel("Realizations of the selected database entry, e.g. all, 1-10 or 1,3,5"), 11,2)
+
+        ensemble_button = QPushButton("Create Ensemble")
+        ensemble_button.setStyleSheet(self.button_style)
+        ensemble_button.clicked.connect(self.create_ensemble)
+        form_layout.addWidget(ensemble_button, 12,0,1,3)
+        self.ensemble_thread = None
+
+        # Preview of the unique Green's function pairs of the planned model
+        self.pairs_preview = QLabel()
+        self.pairs_preview.setWordWrap(True)
+        form_layout.addWidget(QLabel("GF Pairs"), 8,0)
+        form_layout.addWidget(self.pairs_preview, 8,1,1,2)
+        self.pairs_thread = None
+        self.estimate_thread = None
 
 
         # Set the layout for the group box
@@ -1976,6 +2446,27 @@ class MainWindow(QMainWindow):
         self.dv_rec_input.setText("5.0")
         self.dv_src_input.setText("200")
 
+        # The preview is updated shortly after the deltas, the stations or the faults change
+        self.pairs_timer = QTimer(self)
+        self.pairs_timer.setSingleShot(True)
+        self.pairs_timer.setInterval(300)
+        self.pairs_timer.timeout.connect(self.preview_pairs)
+        for field in (
+            self.dt_input, self.nfft_input, self.tmin_input, self.tmax_input,
+            self.dh_input, self.dv_rec_input, self.dv_src_input,
+            self.source_lat_input, self.source_lon_input, self.source_meta_input, self.source_min_slip_input,
+            self.drm_lat, self.drm_long, self.drm_width_x, self.drm_width_y, self.drm_depth,
+            self.drm_mesh_size_x, self.drm_mesh_size_y, self.drm_mesh_size_z,
+        ):
+            field.textChanged.connect(lambda text: self.pairs_timer.start())
+        self.source_filestable.itemChanged.connect(lambda item: self.pairs_timer.start())
+        self.source_filestable.model().rowsRemoved.connect(lambda *args: self.pairs_timer.start())
+        self.stations_dropdown.currentTextChanged.connect(lambda text: self.pairs_timer.start())
+        self.stations_model.dataChanged.connect(lambda *args: self.pairs_timer.start())
+        self.stations_model.modelReset.connect(self.pairs_timer.start)
+        self.stations_model.rowsRemoved.connect(lambda *args: self.pairs_timer.start())
+        self.pairs_timer.start()
+
         return self.analysis_group
     
     
@@ -1984,16 +2475,6 @@ class MainWindow(QMainWindow):
         """
         This method gather all the infomation and create the model in the working directory
         """
-        # Create Model folder in the working directory
-        if not os.path.exists(self.model_dir.text()):
-            os.makedirs(self.model_dir.text())
-            if not os.path.exists(f"{self.model_dir.text()}"):
-                os.makedirs(f"{self.model_dir.text()}")
-        else:
-            if not os.path.exists(f"{self.model_dir.text()}"):
-                os.makedirs(f"{self.model_dir.text()}")
-
-        
         # Create the model
         # Check  that fault metadata file is set
         if self.source_meta_input == None or self.source_meta_input.text() == "":
@@ -2024,12 +2505,26 @@ class MainWindow(QMainWindow):
         except ValueError:
             self.terminal_output.append("<font color='red'>Error: Minimum slip must be a float number</font>")
             return 
-        minslip = float(self.source_min_slip_input.text())
+        if minslip < 1e-13:
+            minslip = 0
+
+        # lat and lon
+        # check if the source lat and lon can be converted to a float
+        try:
+            lat = float(self.source_lat_input.text())
+            lon = float(self.source_lon_input.text())
+        except ValueError:
+            self.terminal_output.append("<font color='red'>Error: Source latitude and longitude must be float numbers</font>")
+            return
+
+        # analysis, crust and station data
+        metadata = self.collect_model_metadata()
+        if metadata is None:
+            return
     
         # read the files in table 
         # fault files in the table
-        fault_files = []
-        numpoints = 0
+        faults = []
         for row in range(self.source_filestable.rowCount()):
             # check if the row is empty
             if self.source_filestable.item(row, 0) == None :
@@ -2048,39 +2543,46 @@ class MainWindow(QMainWindow):
             # just 
             filename = self.source_filestable.item(row, 0).text()
 
-            # open the file and read the json file
-            with open(filename, 'r') as file:
-                fault = json.load(file)
+            # check if the file format is supported
+            if fault_file_format(filename) not in FAULT_FORMATS:
+                self.terminal_output.append(f"<font color='red'>Error: Fault file {filename} is not a json or npz file</font>")
+                return
 
+            # open the file and read the fault sources
+            fault = self.fault_store.get(filename)
 
-            if fault == None:
+
+            if len(fault['x']) == 0:
                 self.terminal_output.append("<font color='red'>Error: Fault file is empty</font>")
                 return
-            
-            # iterate through the file points and filter based on the minimum slip
-            # fault is list of dictionaries
-            if minslip < 1e-13:
-                minslip = 0
-            if minslip > 0:
-                # print waiting warning message
-                self.terminal_output.append("<font color='orange'>Warning: Filtering fault file based on minimum slip</font>")
-                
-                indicies = []
-                for i, point in enumerate(fault):
-                    if point["slip"] > minslip:
-                        indicies.append(i)
-                
-                # filter the fault file based on the indicies
-                fault = [fault[i] for i in indicies]
-
-            # write the filtered fault file to the model directory
-            with open(f"{self.model_dir.text()}/{os.path.basename(filename)}", 'w') as file:
-                json.dump(fault, file, indent=4)
-
-            numpoints += len(fault)
+
+            faults.append((filename, fault))
+
+        # load the fault metadata file
+        with open(self.source_meta_input.text(), 'r') as file:
+            fault_info = json.load(file)
+
+        # cost of a DRM run, estimated in the background while the model is written
+        if metadata["stationdata"].get("stationType") == "DRM":
+            self.report_drm_estimate(metadata, faults, fault_info, minslip, lat, lon)
+
+        # Create Model folder in the working directory
+        if not os.path.exists(self.model_dir.text()):
+            os.makedirs(self.model_dir.text())
+
+        fault_files = []
+        numpoints = 0
+        for filename, fault in faults:
+            # stage the fault file to the model directory, filtered based on the minimum slip
+            # unfiltered files are linked, filtered files are written as npz
+            staged, kept, total = stage_fault_file(filename, self.model_dir.text(), minslip, arrays=fault)
+            if kept < total:
+                self.terminal_output.append(f"<font color='orange'>Warning: Filtering fault file based on minimum slip ({kept} of {total} points kept)</font>")
+
+            numpoints += kept
 
             # drop the path and get the file name
-            fault_files.append(os.path.basename(filename))
+            fault_files.append(staged)
 
 
         # print the number of points in the fault files
@@ -2091,40 +2593,269 @@ class MainWindow(QMainWindow):
         shutil.copy(self.source_time_input.text(), self.model_dir.text())
         
 
-        # load the fault metadata file
-        with open(self.source_meta_input.text(), 'r') as file:
-            fault_info = json.load(file)
-
         # edit the fault info
         # fault_info["min_slip"] = minslip
 
         fault_info["Faultfilenames"] = fault_files
         fault_info["SourceTimeFunction"]["filename"] = os.path.basename(self.source_time_input.text())
 
-        # lat and lon
-        # check if the source lat and lon can be converted to a float
+        fault_info["latitude"] = lat
+        fault_info["longitude"] = lon
+
+        # write the fault info to the model directory
+        with open(f"{self.model_dir.text()}/faultInfo.json", 'w') as file:
+            json.dump(fault_info, file, indent=4)
+
+        # copy the Scripts\ShakerMakermodel.py and the modules it imports to the model directory
+        ShakerMakerPath = os.path.dirname(os.path.abspath(__file__)).replace("\\", "/")
+        for script in self.model_scripts:
+            shutil.copy(f"{ShakerMakerPath}/Scripts/{script}", self.model_dir.text())
+
+
+        # write the metadata to the model directory
+        with open(f"{self.model_dir.text()}/metadata.json", 'w') as file:
+            json.dump(metadata, file, indent=4)
+
+
+        # print success message and the model directory and how to run the model
+        self.terminal_output.append("<font color='green'>Success: Model created successfully</font>")
+        self.terminal_output.append(f"\t Model directory: {self.model_dir.text()}")
+        self.terminal_output.append("\t To run the model, open the model directory and run the command:")
+        self.terminal_output.append("\t mpirun/mpiexec -n <number of processors> python ShakerMakermodel.py")
+
+
+
+        
+
+
+
+
+
+    def report_drm_estimate(self, metadata, faults, fault_info, minslip, lat, lon):
+        """
+        Estimate in the background the size of the DRM box, of results/DRMLoad.h5drm
+        and the unique Green's function pairs of the model with the cost of their
+        database, for the fault points kept by the minimum slip.
+        """
+        sources = source_points([fault for _, fault in faults], minslip)
+
+        drmbox = metadata["stationdata"]["DRMbox"]
+        north, east = north_east_offsets(lat, lon, drmbox["latitude"], drmbox["longitude"])
+        center = (float(north) + fault_info.get("xmean", 0.0), float(east) + fault_info.get("ymean", 0.0))
+
+        # an estimate of an earlier model is no longer wanted
+        if self.estimate_thread is not None and self.estimate_thread.isRunning():
+            self.estimate_thread.cancel()
+        self.estimate_thread = DRMEstimateThread(drmbox, metadata["analysisdata"], sources, center, self)
+        self.estimate_thread.estimated.connect(self.drm_estimated)
+        self.estimate_thread.failed.connect(lambda message: self.terminal_output.append(f"<font color='orange'>Warning: DRM run estimate failed: {message}</font>"))
+        self.terminal_output.append("Estimating the DRM run cost in the background...")
+        self.estimate_thread.start()
+
+    def drm_estimated(self, estimate):
+        """Report the cost estimate of a DRM run."""
+        if estimate is None:
+            return
+        nx, ny, nz = estimate["elements"]
+        self.terminal_output.append("DRM run estimate:")
+        self.terminal_output.append(f"\t Elements: {nx} x {ny} x {nz} = {nx * ny * nz}")
+        self.terminal_output.append(f"\t DRM nodes: {estimate['nodes']}")
+        self.terminal_output.append(
+            f"\t results/DRMLoad.h5drm: {format_bytes(estimate['h5drm_bytes'])} ({estimate['time_steps']} time steps)"
+        )
+        text = f"\t Unique Green's function pairs: ≈ {estimate['pairs']} (upper bound {estimate['pairs_bound']})"
+        if estimate["pairs"] > NPAIRS_MAX:
+            text = f"<font color='red'>{text}: above npairs_max ({NPAIRS_MAX})</font>"
+        self.terminal_output.append(text)
+        self.terminal_output.append(
+            f"\t Green's function database: ≈ {format_bytes(estimate['gf_bytes'])}, {format_core_hours(estimate['gf_seconds'])}"
+        )
+
+
+    def planned_receivers(self, lat, lon, xmean, ymean):
+        """
+        Return the (n, 3) x, y and depth in km of the planned stations or DRM nodes,
+        in the fault coordinates, or None if the station inputs are not complete.
+        """
+        if self.stations_dropdown.currentText() == "DRM Stations":
+            try:
+                center = north_east_offsets(lat, lon, float(self.drm_lat.text()), float(self.drm_long.text()))
+                sizes = [
+                    float(field.text())
+                    for field in (
+                        self.drm_width_x, self.drm_width_y, self.drm_depth,
+                        self.drm_mesh_size_x, self.drm_mesh_size_y, self.drm_mesh_size_z,
+                    )
+                ]
+            except ValueError:
+                return None
+            if min(sizes) <= 0:
+                return None
+            nodes, _ = drm_box_nodes(
+                *drm_elements(*sizes),
+                *(size * 0.001 for size in sizes[3:]),
+                center=(float(center[0]) + xmean, float(center[1]) + ymean),
+            )
+            return nodes
+
+        stations = self.stations_model.array
+        stations = stations[~(np.isnan(stations["latitude"]) | np.isnan(stations["longitude"]) | np.isnan(stations["depth"]))]
+        if len(stations) == 0:
+            return None
+        north, east = north_east_offsets(lat, lon, stations["latitude"], stations["longitude"])
+        return np.column_stack((north + xmean, east + ymean, stations["depth"]))
+
+    def preview_pairs(self):
+        """
+        Count the unique Green's function pairs of the planned model in the
+        background and show them with the size and time they imply.
+        """
+        if self.pairs_thread is not None and self.pairs_thread.isRunning():
+            # The running count is outdated; start again once it stops
+            self.pairs_thread.cancel()
+            self.pairs_timer.start()
+            return
+
+        try:
+            deltas = [float(field.text()) * 0.001 for field in (self.dh_input, self.dv_rec_input, self.dv_src_input)]
+        except ValueError:
+            self.pairs_preview.setText("Set dh, dv_rec and dv_src")
+            return
+        if min(deltas) <= 0:
+            self.pairs_preview.setText("dh, dv_rec and dv_src must be positive")
+            return
+
+        filenames = []
+        for row in range(self.source_filestable.rowCount()):
+            item = self.source_filestable.item(row, 0)
+            if item is not None and os.path.isfile(item.text()) and fault_file_format(item.text()) in FAULT_FORMATS:
+                filenames.append(item.text())
+        if not filenames:
+            self.pairs_preview.setText("Set the fault files to preview the pairs")
+            return
+
         try:
             lat = float(self.source_lat_input.text())
             lon = float(self.source_lon_input.text())
         except ValueError:
-            self.terminal_output.append("<font color='red'>Error: Source latitude and longitude must be float numbers</font>")
+            self.pairs_preview.setText("Set the fault latitude and longitude to preview the pairs")
+            return
+        try:
+            minslip = max(float(self.source_min_slip_input.text()), 0.0)
+        except ValueError:
+            minslip = 0.0
+        xmean = ymean = 0.0
+        try:
+            with open(self.source_meta_input.text(), 'r') as file:
+                fault_info = json.load(file)
+            xmean, ymean = float(fault_info.get("xmean", 0.0)), float(fault_info.get("ymean", 0.0))
+        except (OSError, ValueError, TypeError, AttributeError):
+            pass
+
+        receivers = self.planned_receivers(lat, lon, xmean, ymean)
+        if receivers is None:
+            self.pairs_preview.setText("Set the stations to preview the pairs")
             return
-        lat = float(self.source_lat_input.text())
-        lon = float(self.source_lon_input.text())
 
+        self.pairs_preview.setText("Counting pairs...")
+        self.pairs_thread = PairPreviewThread(self.fault_store, filenames, minslip, receivers, deltas, self)
+        self.pairs_thread.counted.connect(self.pairs_counted)
+        self.pairs_thread.failed.connect(lambda message: self.pairs_preview.setText(f"Pairs not available: {message}"))
+        self.pairs_thread.start()
 
-        fault_info["latitude"] = lat
-        fault_info["longitude"] = lon
+    def pairs_counted(self, npairs):
+        if npairs is None:
+            return
+        text = f"≈ {npairs} unique pairs"
+        try:
+            size, seconds = greens_function_cost(
+                npairs,
+                int(self.nfft_input.text()),
+                float(self.dt_input.text()),
+                float(self.tmin_input.text()),
+                float(self.tmax_input.text()),
+            )
+            text += f", database ≈ {format_bytes(size)}, {format_core_hours(seconds)}"
+        except (ValueError, ZeroDivisionError):
+            pass
+        if npairs > NPAIRS_MAX:
+            text = f"<font color='red'>{text}: above npairs_max ({NPAIRS_MAX})</font>"
+        else:
+            text = f"<font color='green'>{text}: within npairs_max ({NPAIRS_MAX})</font>"
+        self.pairs_preview.setText(text)
 
-        # write the fault info to the model directory
-        with open(f"{self.model_dir.text()}/faultInfo.json", 'w') as file:
-            json.dump(fault_info, file, indent=4)
 
-        # copy the Scripts\ShakerMakermodel.py to the model directory
-        ShakerMakerPath = os.path.dirname(os.path.abspath(__file__)).replace("\\", "/")
-        shutil.copy(f"{ShakerMakerPath}/Scripts/ShakerMakermodel.py", self.model_dir.text())
+    def create_ensemble(self):
+        """
+        Create one model per selected realization of the database selection, in
+        sibling directories of the model directory, with a driver script to run them.
+        """
+        if self.ensemble_thread is not None and self.ensemble_thread.isRunning():
+            self.terminal_output.append("<font color='orange'>Warning: An ensemble is already being created</font>")
+            return
+
+        country = self.country_input.currentText()
+        fault = self.fault_input.currentText()
+        magnitude = self.magnitude_input.currentText()
+        type = self.types_input.currentText()
+        realizations = select_realizations(self.data[country][fault][magnitude][type]["Realizations"], self.ensemble_input.text())
+        if not realizations:
+            self.terminal_output.append("<font color='red'>Error: No realization matches the ensemble selection</font>")
+            return
+
+        try:
+            minslip = float(self.source_min_slip_input.text())
+        except ValueError:
+            self.terminal_output.append("<font color='red'>Error: Minimum slip must be a float number</font>")
+            return
+        if minslip < 1e-13:
+            minslip = 0
 
+        # analysis, crust and station data shared by all the models
+        metadata = self.collect_model_metadata()
+        if metadata is None:
+            return
 
+        ShakerMakerPath = os.path.dirname(os.path.abspath(__file__)).replace("\\", "/")
+        arguments = {
+            "root": self.model_dir.text(),
+            "paths": [realization_path(country, fault, magnitude, type, r) for r in realizations],
+            "metadata": metadata,
+            "scripts": [f"{ShakerMakerPath}/Scripts/{script}" for script in self.model_scripts],
+            "cache_root": self.realization_cache.root,
+            "cache": self.realization_cache,
+            "minslip": minslip,
+            "database": self.database_client.base_url,
+        }
+        self.terminal_output.append(f"Creating an ensemble of {len(realizations)} models of {fault} M{magnitude} type {type}")
+        self.ensemble_thread = EnsembleThread(arguments, self.prefetcher, self)
+        self.ensemble_thread.message.connect(self.terminal_output.append)
+        self.ensemble_thread.created.connect(self.ensemble_created)
+        self.ensemble_thread.failed.connect(lambda message: self.terminal_output.append(f"<font color='red'>Error: Ensemble creation failed</font><br>  message: {message}"))
+        self.ensemble_thread.start()
+
+    def ensemble_created(self, result):
+        """Report the models of a created ensemble and how to run them."""
+        driver, results = result
+        for path, _directory, _numpoints, error in results:
+            if error is not None:
+                self.terminal_output.append(f"<font color='red'>Error: {path} could not be staged</font>")
+                self.terminal_output.append(f"  message: {error}")
+        count, total, mean = ensemble_summary(results)
+        if count == 0:
+            return
+        self.terminal_output.append(f"<font color='green'>Success: Ensemble of {count} models created successfully</font>")
+        self.terminal_output.append(f"\t Model directory: {self.model_dir.text()}")
+        self.terminal_output.append(f"\t Number of points in the fault files: {total} ({mean:.0f} per model)")
+        self.terminal_output.append("\t To run the models back-to-back, open the model directory and run the command:")
+        self.terminal_output.append(f"\t ./{os.path.basename(driver)} <number of processors>")
+        self.terminal_output.append(f"\t or submit it as a job array, e.g. sbatch --array=0-{count - 1} {os.path.basename(driver)}")
+
+    def collect_model_metadata(self):
+        """
+        Gather the analysis, crust and station data of the model from the inputs.
+        Returns None, after reporting the error, if an input is missing or invalid.
+        """
         metadata = {}
         metadata["analysisdata"] = {}
         # check if the dt is not None
@@ -2232,121 +2963,28 @@ class MainWindow(QMainWindow):
 
 
 
-        metadata["crustdata"] =  []
-
-        # loop over crust files in the table
-        rowindex = 0
-        for row in range(self.crust_table.rowCount()):
-            layerinfo = {}
-            # check if the row is empty
-            if self.crust_table.item(row, 0) == None :
-                self.terminal_output.append("<font color='red'>Error: layer name is not set</font>")
-                self.terminal_output.append("Please set the layer name in the table")
-                return
-            if self.crust_table.item(row, 0).text() == "":
-                self.terminal_output.append("<font color='red'>Error: layer name is not set</font>")
-                self.terminal_output.append("Please set the layer name in the table")
-                return
-            
-            layerinfo["name"] = self.crust_table.item(row, 0).text()
-
-            # check if the thickness is not None
-            if self.crust_table.item(row, 1) == None :
-                self.terminal_output.append("<font color='red'>Error: thickness is not set</font>")
-                self.terminal_output.append("Please set the thickness in the table")
-                return
-            if self.crust_table.item(row, 1).text() == "":
-                self.terminal_output.append("<font color='red'>Error: thickness is not set</font>")
-                self.terminal_output.append("Please set the thickness in the table")
-                return
-            if rowindex == (self.crust_table.rowCount()-1):
-                layerinfo["thick"] = 0
-            else:
-                try:
-                    layerinfo["thick"] = float(self.crust_table.item(row, 1).text())
-                except ValueError:
-                    self.terminal_output.append("<font color='red'>Error: thickness must be a float number</font>")
-                    return
-            
-            # check if the vp is not None
-            if self.crust_table.item(row, 2) == None :
-                self.terminal_output.append("<font color='red'>Error: vp is not set</font>")
-                self.terminal_output.append("Please set the vp in the table")
-                return
-            if self.crust_table.item(row, 2).text() == "":
-                self.terminal_output.append("<font color='red'>Error: vp is not set</font>")
-                self.terminal_output.append("Please set the vp in the table")
-                return
-            try:
-                layerinfo["vp"] = float(self.crust_table.item(row, 2).text())
-            except ValueError:
-                self.terminal_output.append("<font color='red'>Error: vp must be a float number</font>")
-                return
-            
-            # check if the vs is not None
-            if self.crust_table.item(row, 3) == None :
-                self.terminal_output.append("<font color='red'>Error: vs is not set</font>")
-                self.terminal_output.append("Please set the vs in the table")
-                return
-            if self.crust_table.item(row, 3).text() == "":
-                self.terminal_output.append("<font color='red'>Error: vs is not set</font>")
-                self.terminal_output.append("Please set the vs in the table")
-                return
-            try:
-                layerinfo["vs"] = float(self.crust_table.item(row, 3).text())
-            except ValueError:
-                self.terminal_output.append("<font color='red'>Error: vs must be a float number</font>")
-                return
-            
-            # check if the rho is not None
-            if self.crust_table.item(row, 4) == None :
-                self.terminal_output.append("<font color='red'>Error: rho is not set</font>")
-                self.terminal_output.append("Please set the rho in the table")
-                return
-            if self.crust_table.item(row, 4).text() == "":
-                self.terminal_output.append("<font color='red'>Error: rho is not set</font>")
-                self.terminal_output.append("Please set the rho in the table")
-                return
-            try:
-                layerinfo["rho"] = float(self.crust_table.item(row, 4).text())
-            except ValueError:
-                self.terminal_output.append("<font color='red'>Error: rho must be a float number</font>")
-                return
-            
-            # check if the Qp is not None
-            if self.crust_table.item(row, 5) == None :
-                self.terminal_output.append("<font color='red'>Error: Qp is not set</font>")
-                self.terminal_output.append("Please set the Qp in the table")
-                return
-            if self.crust_table.item(row, 5).text() == "":
-                self.terminal_output.append("<font color='red'>Error: Qp is not set</font>")
-                self.terminal_output.append("Please set the Qp in the table")
-                return
-            try:
-                layerinfo["Qa"] = float(self.crust_table.item(row, 5).text())
-            except ValueError:
-                self.terminal_output.append("<font color='red'>Error: Qp must be a float number</font>")
-                return
-            
-            # check if the Qs is not None
-            if self.crust_table.item(row, 6) == None :
-                self.terminal_output.append("<font color='red'>Error: Qs is not set</font>")
-                self.terminal_output.append("Please set the Qs in the table")
-                return
-            if self.crust_table.item(row, 6).text() == "":
-                self.terminal_output.append("<font color='red'>Error: Qs is not set</font>")
-                self.terminal_output.append("Please set the Qs in the table")
-                return
-            try:
-                layerinfo["Qb"] = float(self.crust_table.item(row, 6).text())
-            except ValueError:
-                self.terminal_output.append("<font color='red'>Error: Qs must be a float number</font>")
-                return
-            
-            # add the layer info to metadata
-            metadata["crustdata"].append(layerinfo)
-
-            rowindex += 1
+        # crust layers, read and validated from the table array at once
+        crust = self.crust_model.array
+        invalid = self.crust_model.invalid()
+        if invalid is not None:
+            row, field = invalid
+            label = {"name": "layer name", "thick": "thickness", "vp": "vp", "vs": "vs", "rho": "rho", "Qa": "Qp", "Qb": "Qs"}[field]
+            self.terminal_output.append(f"<font color='red'>Error: {label} is not set (layer {row + 1})</font>")
+            self.terminal_output.append(f"Please set the {label} in the table")
+            return
+        thicknesses = self.crust_model.thicknesses()
+        metadata["crustdata"] = [
+            {"name": str(name), "thick": thick, "vp": vp, "vs": vs, "rho": rho, "Qa": qa, "Qb": qb}
+            for name, thick, vp, vs, rho, qa, qb in zip(
+                crust["name"].tolist(),
+                thicknesses.tolist(),
+                crust["vp"].tolist(),
+                crust["vs"].tolist(),
+                crust["rho"].tolist(),
+                crust["Qa"].tolist(),
+                crust["Qb"].tolist(),
+            )
+        ]
 
 
 
@@ -2358,109 +2996,74 @@ class MainWindow(QMainWindow):
             metadata["stationdata"]["name"] = "Station provided by user"
             metadata["stationdata"]["Singlestations"] = []
 
-            # loop over the station files in the table
-            if self.single_stations_table.rowCount() == 0:
+            # stations, read and validated from the table array at once
+            if self.stations_model.rowCount() == 0:
                 self.terminal_output.append("<font color='red'>Error: No station file is set</font>")
                 self.terminal_output.append("Please set the station files in the table")
                 return
 
-            for row in range(self.single_stations_table.rowCount()):
-                stationInfo = {}
-                # check if lat 
-                if self.single_stations_table.item(row, 0) == None :
-                    self.terminal_output.append("<font color='red'>Error: Station latitude is not set</font>")
-                    self.terminal_output.append("Please set the station latitude in the table")
-                    return
-                if self.single_stations_table.item(row, 0).text() == "":
-                    self.terminal_output.append("<font color='red'>Error: Station latitude is not set</font>")
-                    self.terminal_output.append("Please set the station latitude in the table")
-                    return
-                try:
-                    lat = float(self.single_stations_table.item(row, 0).text())
-                except ValueError:
-                    self.terminal_output.append("<font color='red'>Error: Station latitude must be a float number</font>")
-                    return
-                
-                stationInfo["latitude"] = lat
-
-                # check if lon
-                if self.single_stations_table.item(row, 1) == None :
-                    self.terminal_output.append("<font color='red'>Error: Station longitude is not set</font>")
-                    self.terminal_output.append("Please set the station longitude in the table")
-                    return
-                if self.single_stations_table.item(row, 1).text() == "":
-                    self.terminal_output.append("<font color='red'>Error: Station longitude is not set</font>")
-                    self.terminal_output.append("Please set the station longitude in the table")
-                    return
-                try:
-                    lon = float(self.single_stations_table.item(row, 1).text())
-                except ValueError:
-                    self.terminal_output.append("<font color='red'>Error: Station longitude must be a float number</font>")
-                    return
-                
-                stationInfo["longitude"] = lon
+            invalid = self.stations_model.invalid()
+            if invalid is not None:
+                row, field = invalid
+                label = {"latitude": "latitude", "longitude": "longitude", "depth": "depth"}[field]
+                self.terminal_output.append(f"<font color='red'>Error: Station {label} is not set (station {row + 1})</font>")
+                self.terminal_output.append(f"Please set the station {label} in the table")
+                return
 
-                # check if the elevation is not None
-                if self.single_stations_table.item(row, 2) == None :
-                    self.terminal_output.append("<font color='red'>Error: Station depth is not set</font>")
-                    self.terminal_output.append("Please set the station depth in the table")
-                    return
-                if self.single_stations_table.item(row, 2).text() == "":
-                    self.terminal_output.append("<font color='red'>Error: Station depth is not set</font>")
-                    self.terminal_output.append("Please set the station depth in the table")
-                    return
-                try:
-                    depth = float(self.single_stations_table.item(row, 2).text())
-                except ValueError:
-                    self.terminal_output.append("<font color='red'>Error: Station depth must be a float number</font>")
-                    return
-                
-                stationInfo["depth"] = depth
-                stationInfo["metadata"] = {"filter_parameters": {"fmax": 10},"filter_results": False, "name": "Station 1"}
-                
-                # add the station info to metadata
-                metadata["stationdata"]["Singlestations"].append(stationInfo)
+            stations = self.stations_model.array
+            metadata["stationdata"]["Singlestations"] = [
+                {
+                    "latitude": lat,
+                    "longitude": lon,
+                    "depth": depth,
+                    "metadata": {"filter_parameters": {"fmax": 10}, "filter_results": False, "name": "Station 1"},
+                }
+                for lat, lon, depth in zip(stations["latitude"].tolist(), stations["longitude"].tolist(), stations["depth"].tolist())
+            ]
 
 
 
         if self.stations_dropdown.currentText() == "DRM Stations":
-            # print not implemented error
-            self.terminal_output.append("<font color='red'>Error: DRM Stations is not implemented</font>")
-            return
-        
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-        # write the metadata to the model directory
-        with open(f"{self.model_dir.text()}/metadata.json", 'w') as file:
-            json.dump(metadata, file, indent=4)
-
-
-        # print success message and the model directory and how to run the model
-        self.terminal_output.append("<font color='green'>Success: Model created successfully</font>")
-        self.terminal_output.append(f"\t Model directory: {self.model_dir.text()}")
-        self.terminal_output.append("\t To run the model, open the model directory and run the command:")
-        self.terminal_output.append("\t mpirun/mpiexec -n <number of processors> python ShakerMakermodel.py")
-
+            metadata["stationdata"]["stationType"] = "DRM"
+            metadata["stationdata"]["name"] = "DRM box provided by user"
 
+            # center of the box
+            try:
+                drm_lat = float(self.drm_lat.text())
+                drm_lon = float(self.drm_long.text())
+            except ValueError:
+                self.terminal_output.append("<font color='red'>Error: DRM latitude and longitude must be float numbers</font>")
+                return
 
-        
+            # sizes of the box and of its elements in meters
+            drmbox = {"name": "DRM box", "latitude": drm_lat, "longitude": drm_lon}
+            for key, field in [
+                ("Width X", self.drm_width_x),
+                ("Width Y", self.drm_width_y),
+                ("Depth", self.drm_depth),
+                ("Mesh Size X", self.drm_mesh_size_x),
+                ("Mesh Size Y", self.drm_mesh_size_y),
+                ("Mesh Size Z", self.drm_mesh_size_z),
+            ]:
+                try:
+                    value = float(field.text())
+                except ValueError:
+                    self.terminal_output.append(f"<font color='red'>Error: DRM {key} is not set</font>")
+                    self.terminal_output.append(f"Please set the DRM {key}")
+                    return
+                if value <= 0:
+                    self.terminal_output.append(f"<font color='red'>Error: DRM {key} must be positive</font>")
+                    return
+                drmbox[key] = value
 
+            for width, mesh in [("Width X", "Mesh Size X"), ("Width Y", "Mesh Size Y"), ("Depth", "Mesh Size Z")]:
+                if drmbox[mesh] > drmbox[width]:
+                    self.terminal_output.append(f"<font color='red'>Error: DRM {mesh} is larger than the {width}</font>")
+                    return
 
+            metadata["stationdata"]["DRMbox"] = drmbox
 
+        return metadata
 
 
     def choose_directory(self):
@@ -2504,6 +3107,13 @@ class MainWindow(QMainWindow):
 
 
 
+    # ===================================================================================
+    # Model scripts
+    # ===================================================================================
+    # Files copied from the Scripts folder to every model directory
+    model_scripts = ["ShakerMakermodel.py", "FaultSources.py", "StationGeometry.py", "GreensFunctions.py"]
+
+
     # ===================================================================================
     # Data Base
     # ===================================================================================
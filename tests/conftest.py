@@ -0,0 +1,57 @@
+import json
+import os
+import sys
+
+import pytest
+
+# The scripts import each other as top level modules, as in a model directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Scripts'))  # noqa: PTH100, PTH118, PTH120
+
+
+def write_realization(root, path, files, stf='SourceTimeFunction.py'):
+    '''
+    Write a realization of a local database: its files (name -> bytes) and a
+    faultInfo.json listing them. Returns the faultInfo dict.
+    '''
+    directory = os.path.join(root, *path.split('/'))  # noqa: PTH118
+    os.makedirs(directory, exist_ok=True)  # noqa: PTH103
+    for name, content in files.items():
+        with open(os.path.join(directory, name), 'wb') as f:  # noqa: PTH118, PTH123
+            f.write(content)
+    faultinfo = {
+        'name': path,
+        'Faultfilenames': [name for name in files if name != stf],
+        'SourceTimeFunction': {'filename': stf},
+    }
+    with open(os.path.join(directory, 'faultInfo.json'), 'w') as f:  # noqa: PTH118, PTH123
+        json.dump(faultinfo, f)
+    return faultinfo
+
+
+@pytest.fixture
+def database(tmp_path):
+    '''
+    Local fault database of two realizations of one fault, served through file:// URLs.
+    '''
+    root = str(tmp_path / 'database')
+    catalog = {
+        'Countries': ['Chile'],
+        'Chile': {
+            'Faults': ['F1'],
+            'F1': {'Magnitudes': ['7'], '7': {'Types': ['A'], 'A': {'Realizations': ['1', '2']}}},
+        },
+    }
+    os.makedirs(root)  # noqa: PTH103
+    with open(os.path.join(root, 'DatabaseMetadata.json'), 'w') as f:  # noqa: PTH118, PTH123
+        json.dump(catalog, f)
+    for number in ('1', '2'):
+        write_realization(
+            root,
+            f'Chile/F1/M_7_type_A_number_{number}',
+            {
+                'fault_0.json': b'[]',
+                'fault_1.json': number.encode() * 1000,
+                'SourceTimeFunction.py': b'# stf\n',
+            },
+        )
+    return root
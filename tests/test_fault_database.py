@@ -0,0 +1,165 @@
+import json
+import os
+import threading
+
+import FaultDatabase
+import pytest
+from FaultDatabase import DatabaseClient, DatabaseMirror, DownloadCancelled, RealizationCache, pack_realization
+
+PATH_1 = 'Chile/F1/M_7_type_A_number_1'
+PATH_2 = 'Chile/F1/M_7_type_A_number_2'
+
+
+def mirrored_catalog(root):
+    with open(os.path.join(root, 'DatabaseMetadata.json')) as f:  # noqa: PTH118, PTH123
+        data = json.load(f)
+    return data['Chile']['F1']['7']['A']['Realizations']
+
+
+def test_mirror_sync_and_unchanged_resync(database, tmp_path):
+    root = str(tmp_path / 'mirror')
+    mirror = DatabaseMirror(DatabaseClient(database), root)
+
+    summary = mirror.sync()
+    assert summary['errors'] == []
+    assert summary['realizations'] == 2  # noqa: PLR2004
+    assert summary['transferred'] == 6  # noqa: PLR2004
+    assert mirrored_catalog(root) == ['1', '2']
+    with open(os.path.join(root, *PATH_2.split('/'), 'fault_1.json'), 'rb') as f:  # noqa: PTH118, PTH123
+        assert f.read() == b'2' * 1000
+
+    summary = DatabaseMirror(DatabaseClient(database), root).sync()
+    assert summary['transferred'] == 0
+    assert summary['unchanged'] == 6  # noqa: PLR2004
+
+
+def test_mirror_missing_file_is_reported_and_resumed(database, tmp_path):
+    root = str(tmp_path / 'mirror')
+    source = os.path.join(database, *PATH_1.split('/'), 'fault_1.json')  # noqa: PTH118
+    os.rename(source, source + '.hidden')  # noqa: PTH104
+
+    summary = DatabaseMirror(DatabaseClient(database), root).sync()
+    assert [path for path, _ in summary['errors']] == [f'{PATH_1}/fault_1.json']
+    # the state and the catalog are saved, without the incomplete realization
+    assert mirrored_catalog(root) == ['2']
+    with open(os.path.join(root, '.mirror', 'state.json')) as f:  # noqa: PTH118, PTH123
+        assert json.load(f)['realizations'] == [PATH_2]
+
+    os.rename(source + '.hidden', source)  # noqa: PTH104
+    summary = DatabaseMirror(DatabaseClient(database), root).sync()
+    assert summary['errors'] == []
+    assert summary['transferred'] == 1
+    assert mirrored_catalog(root) == ['1', '2']
+
+
+def packed_realization(database, size):
+    # Realization 1 with a large incompressible first fault file, packed as a gz bundle
+    directory = os.path.join(database, *PATH_1.split('/'))  # noqa: PTH118
+    with open(os.path.join(directory, 'fault_0.json'), 'wb') as f:  # noqa: PTH118, PTH123
+        f.write(os.urandom(size))
+    pack_realization(directory, compressions=('gz',), level=1)
+    with open(os.path.join(directory, 'faultInfo.json')) as f:  # noqa: PTH118, PTH123
+        return json.load(f)
+
+
+def test_download_bundle(database, tmp_path):
+    faultinfo = packed_realization(database, 1 << 20)
+    target = tmp_path / 'model'
+    target.mkdir()
+    files = DatabaseClient(database).download_bundle(PATH_1, faultinfo, str(target))
+    assert sorted(files) == ['SourceTimeFunction.py', 'fault_0.json', 'fault_1.json']
+    assert (target / 'fault_1.json').read_bytes() == b'1' * 1000
+    assert not [name for name in os.listdir(target) if name.endswith('.part')]
+
+
+def test_cancelled_bundle_leaves_no_partial_files(database, tmp_path):
+    faultinfo = packed_realization(database, 8 << 20)
+    target = tmp_path / 'model'
+    target.mkdir()
+    cancel = threading.Event()
+
+    def progress(path, done, total):  # noqa: ARG001
+        # stop while the first member is being written
+        if done > 1 << 20:
+            cancel.set()
+
+    with pytest.raises(DownloadCancelled):
+        DatabaseClient(database).download_bundle(PATH_1, faultinfo, str(target), progress=progress, cancel=cancel)
+    assert os.listdir(target) == []
+
+
+def test_cache_checkout_is_independent_copy(tmp_path):
+    source = tmp_path / 'source'
+    source.mkdir()
+    (source / 'a.json').write_text('original')
+    cache = RealizationCache(str(tmp_path / 'cache'))
+    cache.add('x/1', str(source), ['a.json'])
+
+    out = tmp_path / 'out'
+    out.mkdir()
+    assert RealizationCache(str(tmp_path / 'cache')).checkout('x/1', str(out))
+    (out / 'a.json').write_text('modified in place')
+    assert 'x/1' in cache
+    out2 = tmp_path / 'out2'
+    out2.mkdir()
+    assert cache.checkout('x/1', str(out2))
+    assert (out2 / 'a.json').read_text() == 'original'
+
+
+def test_cache_lookup_trusts_fingerprints_and_detects_changes(tmp_path, monkeypatch):
+    source = tmp_path / 'source'
+    source.mkdir()
+    (source / 'a.json').write_text('content')
+    cache = RealizationCache(str(tmp_path / 'cache'))
+    digest = cache.add('x/1', str(source), ['a.json'])['files']['a.json']
+
+    hashed = []
+    real = FaultDatabase.file_sha256
+    monkeypatch.setattr(FaultDatabase, 'file_sha256', lambda f: hashed.append(f) or real(f))
+    assert 'x/1' in RealizationCache(str(tmp_path / 'cache'))
+    assert hashed == []
+    assert cache.lookup('x/1', verify=True) is not None
+    assert len(hashed) == 1
+
+    # an object written in place no longer matches its fingerprint and hash
+    obj = cache._object(digest)  # noqa: SLF001
+    os.chmod(obj, 0o644)  # noqa: PTH101
+    with open(obj, 'w') as f:  # noqa: PTH123
+        f.write('corrupted!')
+    assert 'x/1' not in cache
+    assert not os.path.exists(obj)  # noqa: PTH110
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = RealizationCache(str(tmp_path / 'cache'), max_bytes=2500)
+    for k in range(3):
+        source = tmp_path / f'source{k}'
+        source.mkdir()
+        (source / 'f.bin').write_bytes(bytes([k]) * 1000)
+        (source / 'stf.py').write_text('# shared\n')
+        cache.add(f'x/{k}', str(source), ['f.bin', 'stf.py'])
+    assert 'x/0' not in cache
+    assert 'x/1' in cache
+    assert 'x/2' in cache
+    assert cache.size() <= 2500  # noqa: PLR2004
+
+
+def test_metadata_snapshot_is_revalidated(database, tmp_path):
+    from FaultDatabase import MetadataStore
+
+    store = MetadataStore(str(tmp_path / 'snapshot'), DatabaseClient(database))
+    assert store.load_snapshot() is None
+    catalog = store.refresh()
+    assert catalog['Countries'] == ['Chile']
+    assert store.load_snapshot() == catalog
+
+    # unchanged catalog: 304, nothing parsed
+    assert store.refresh() is None
+
+    catalog['Countries'].append('Peru')
+    metadata = os.path.join(database, 'DatabaseMetadata.json')  # noqa: PTH118
+    with open(metadata, 'w') as f:  # noqa: PTH123
+        json.dump(catalog, f)
+    os.utime(metadata, ns=(1, 1))
+    assert store.refresh()['Countries'] == ['Chile', 'Peru']
+    assert store.load_snapshot()['Countries'] == ['Chile', 'Peru']
@@ -0,0 +1,219 @@
+import math
+import os
+
+import numpy as np
+import pytest
+from FaultSources import (
+    FAULT_COLUMNS,
+    SourceTimeFunctionEngine,
+    assemble_fault_sources,
+    broadcast_fault_chunks,
+    concatenate_fault_arrays,
+    count_fault_sources,
+    database_stf_batch,
+    faultsources_to_arrays,
+    iter_fault_chunks,
+    link_or_copy,
+    load_fault_file,
+    read_fault_sources,
+    write_fault_file,
+)
+
+
+def fault(n, offset=0, stf_type='database', nparams=5):
+    # Subfaults with distinct positions, half of them with zero slip and four
+    # distinct STF parameter sets
+    return [
+        {
+            'x': float(offset + i),
+            'y': 2.0 * i,
+            'z': 1.0 + i / 10,
+            'strike': 10.0,
+            'dip': 45.0,
+            'rake': 90.0,
+            't0': i / 100,
+            'slip': float(i % 2),
+            'stf': {
+                'type': stf_type,
+                'parameters': [0.5, 1.0, 2.0 + i % 4, 0.01, 1.0][:nparams],
+                'numParameters': nparams,
+            },
+        }
+        for i in range(n)
+    ]
+
+
+def assert_same_sources(arrays, faultsources):
+    expected = faultsources_to_arrays(faultsources)
+    for name in FAULT_COLUMNS:
+        assert np.array_equal(arrays[name], expected[name]), name
+    types = np.asarray(arrays['stf_types'])[arrays['stf_type_index']]
+    assert types.tolist() == [source['stf']['type'] for source in faultsources]
+    for row, source in enumerate(faultsources):
+        n = int(arrays['stf_nparams'][row])
+        assert arrays['stf_params'][row, :n].tolist() == source['stf']['parameters']
+
+
+@pytest.mark.parametrize('extension', ['json', 'npz'])
+def test_fault_file_round_trip_and_streaming(tmp_path, extension):
+    # chunks hold at most chunk_size rows, NPZ chunks are filtered after slicing
+    sources = fault(25)
+    filename = str(tmp_path / f'fault_0.{extension}')
+    write_fault_file(filename, faultsources_to_arrays(sources))
+    assert_same_sources(load_fault_file(filename), sources)
+
+    chunks = list(iter_fault_chunks(filename, chunk_size=4, minslip=0.5))
+    assert all(0 < len(chunk['x']) <= 4 for chunk in chunks)  # noqa: PLR2004
+    kept = [source for source in sources if source['slip'] > 0.5]  # noqa: PLR2004
+    assert_same_sources(concatenate_fault_arrays(chunks), kept)
+    assert count_fault_sources(filename, minslip=0.5) == (12, 5)
+    assert_same_sources(read_fault_sources(filename, minslip=0.5, chunk_size=4), kept)
+
+
+def test_json_streaming_across_blocks(tmp_path):
+    from FaultSources import iter_fault_json
+
+    sources = fault(50)
+    filename = str(tmp_path / 'fault_0.json')
+    write_fault_file(filename, faultsources_to_arrays(sources))
+    assert list(iter_fault_json(filename, block_size=17)) == sources
+
+
+def test_assemble_segments_with_different_stfs(tmp_path):
+    first = fault(10, stf_type='database', nparams=5)
+    second = fault(7, offset=100, stf_type='other', nparams=3)
+    filenames = [str(tmp_path / 'fault_0.json'), str(tmp_path / 'fault_1.npz')]
+    write_fault_file(filenames[0], faultsources_to_arrays(first))
+    write_fault_file(filenames[1], faultsources_to_arrays(second))
+
+    arrays, counts = assemble_fault_sources(filenames, minslip=0.5, chunk_size=3)
+    assert counts == [5, 3]
+    assert_same_sources(arrays, [source for source in first + second if source['slip'] > 0.5])  # noqa: PLR2004
+
+
+class Discrete:
+    def __init__(self, data, t):
+        self.data = np.asarray(data)
+        self.t = np.asarray(t)
+
+
+def database_stf(tp, te, tr, dt, slip, a=1.0, b=100.0):
+    # Scalar source time function of the database realizations
+    t = np.arange(0, tr, dt)
+    svf = np.empty(len(t))
+    for i, ti in enumerate(t):
+        if ti < tp:
+            svf[i] = ti / tp * math.sqrt(a + b / tp**2) * math.sin(math.pi * ti / (2 * tp))
+        elif ti < te:
+            svf[i] = math.sqrt(a + b / ti**2)
+        else:
+            svf[i] = math.sqrt(a + b / ti**2) * math.sin(5 / 3 * math.pi * (tr - ti) / tr)
+    area = (svf.sum() - (svf[0] + svf[-1]) / 2) * dt
+    return Discrete(svf / area * slip, t)
+
+
+def counting(function):
+    def wrapper(*params):
+        wrapper.calls += 1
+        return function(*params)
+
+    wrapper.calls = 0
+    return wrapper
+
+
+def test_database_stf_batch_matches_the_scalar_function():
+    params = np.array([[0.5, 1.0, 2.0, 0.01, 1.0], [0.3, 0.8, 3.5, 0.02, 2.5], [0.2, 0.2, 1.0, 0.005, 0.1]])
+    data, lengths, dt = database_stf_batch(params)
+    for row, p in enumerate(params):
+        expected = database_stf(*p)
+        n = lengths[row]
+        assert n == len(expected.t)
+        assert np.allclose(data[row, :n], expected.data)
+        assert np.allclose(np.arange(n) * dt[row], expected.t)
+        assert not data[row, n:].any()
+
+
+def test_engine_shares_and_memoizes_stfs():
+    stf = counting(database_stf)
+    engine = SourceTimeFunctionEngine(stf, Discrete)
+    arrays = faultsources_to_arrays(fault(20))
+
+    stfs, inverse = engine.evaluate(arrays)
+    assert len(stfs) == 4  # noqa: PLR2004
+    assert engine.batch_function is database_stf_batch
+    # the candidate is verified on one parameter set, the others are batched
+    assert stf.calls == 1
+    for row in range(20):
+        expected = database_stf(*arrays['stf_params'][row])
+        assert np.allclose(stfs[inverse[row]].data, expected.data)
+        assert np.allclose(stfs[inverse[row]].t, expected.t)
+
+    # the same STFs in arrays with another type table are not built again
+    again = faultsources_to_arrays(fault(8, offset=50))
+    stfs_again, _ = engine.evaluate(again)
+    assert engine.ndistinct == 4  # noqa: PLR2004
+    assert {id(s) for s in stfs_again} <= {id(s) for s in stfs}
+    assert engine.nsources == 28  # noqa: PLR2004
+
+
+def test_engine_falls_back_to_the_scalar_function():
+    def other_stf(tp, te, tr, dt, slip):
+        t = np.arange(0, tr, dt)
+        return Discrete(np.full(len(t), slip), t)
+
+    stf = counting(other_stf)
+    engine = SourceTimeFunctionEngine(stf, Discrete)
+    stfs, inverse = engine.evaluate(faultsources_to_arrays(fault(20)))
+    assert engine.batch_function is None
+    assert len(stfs) == 4  # noqa: PLR2004
+    assert stf.calls == 5  # noqa: PLR2004
+    assert all((s.data == 1.0).all() for s in stfs)
+    assert len(inverse) == 20  # noqa: PLR2004
+
+
+def test_engine_keys_stfs_by_type_name():
+    stf = counting(lambda *params: tuple(params))
+    engine = SourceTimeFunctionEngine(stf)
+    first = faultsources_to_arrays(fault(4, stf_type='a', nparams=3))
+    second = faultsources_to_arrays(fault(4, stf_type='b', nparams=3))
+    engine.evaluate(first)
+    engine.evaluate(second)
+    # same parameters, different types
+    assert engine.ndistinct == 8  # noqa: PLR2004
+    engine.evaluate(concatenate_fault_arrays([second, first]))
+    assert engine.ndistinct == 8  # noqa: PLR2004
+
+
+class SingleRank:
+    # Communicator of a single rank
+    def Get_rank(self):  # noqa: N802
+        return 0
+
+    def bcast(self, obj, root=0):
+        return obj
+
+    def Bcast(self, buffer, root=0):  # noqa: N802
+        pass
+
+
+def test_broadcast_fault_chunks():
+    sources = fault(23)
+    arrays = faultsources_to_arrays(sources)
+    chunks = list(broadcast_fault_chunks(SingleRank(), arrays, chunk_size=10))
+    assert [len(chunk['x']) for chunk in chunks] == [10, 10, 3]
+    assert_same_sources(concatenate_fault_arrays(chunks), sources)
+
+
+@pytest.mark.parametrize('hardlink', [True, False])
+def test_link_or_copy_replaces_without_writing_through(tmp_path, hardlink):
+    source = tmp_path / 'source'
+    source.write_bytes(b'new')
+    destination = tmp_path / 'destination'
+    destination.write_bytes(b'old')
+    shared = tmp_path / 'shared'
+    os.link(destination, shared)
+
+    link_or_copy(str(source), str(destination), hardlink=hardlink)
+    assert destination.read_bytes() == b'new'
+    assert shared.read_bytes() == b'old'
+    assert os.path.samefile(source, destination) == hardlink  # noqa: PTH121
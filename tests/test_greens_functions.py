@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+from GreensFunctions import GF_GROUP, PAIR_INDEX, append_pairs, match_pairs, read_pairs, select_pairs
+
+h5py = pytest.importorskip('h5py')
+
+TOLERANCES = (1.0, 0.5, 0.5)
+
+
+def write_database(filename, pairs, indices, gf=True):
+    # Database in the layout of gen_greens_function_database_pairs and run_create_greens_function_database
+    pairs = np.asarray(pairs, dtype=np.float64)
+    with h5py.File(filename, 'w') as database:
+        database.create_dataset('dh_of_pairs', data=pairs[:, 0])
+        database.create_dataset('zrec_of_pairs', data=pairs[:, 1])
+        database.create_dataset('zsrc_of_pairs', data=pairs[:, 2])
+        database.create_dataset('dv_of_pairs', data=pairs[:, 2] - pairs[:, 1])
+        database.create_dataset(PAIR_INDEX, data=np.asarray(indices, dtype=np.int64))
+        database.create_dataset('delta_h', data=TOLERANCES[0])
+        if gf:
+            group = database.create_group(GF_GROUP)
+            for i, pair in enumerate(pairs):
+                group.create_dataset(f'{i}_tdata', data=np.full(4, pair[0]))
+                group.create_dataset(f'{i}_t0', data=pair[0] / 10)
+
+
+def test_match_pairs_agrees_with_brute_force():
+    rng = np.random.default_rng(0)
+    existing = rng.uniform(0, 10, (200, 3))
+    required = rng.uniform(0, 10, (300, 3))
+    required[:50] = existing[:50] + rng.uniform(-0.2, 0.2, (50, 3))
+    matched = match_pairs(existing, required, TOLERANCES)
+
+    half = np.asarray(TOLERANCES) / 2
+    close = np.all(np.abs(required[:, None] - existing[None]) < half, axis=2)
+    assert np.array_equal(matched >= 0, close.any(axis=1))
+    hits = np.flatnonzero(matched >= 0)
+    assert close[hits, matched[hits]].all()
+    assert (matched[:50] >= 0).all()
+
+
+def test_append_pairs_renumbers_and_rebuilds_indices(tmp_path):
+    database = str(tmp_path / 'database.h5')
+    required = str(tmp_path / 'required.h5')
+    extension = str(tmp_path / 'extension.h5')
+
+    # three existing pairs, the second one is not used by the new geometry
+    write_database(database, [(1, 0, 2), (5, 0, 2), (9, 1, 3)], [(0, 0), (0, 1), (1, 1)])
+    # the new geometry needs the first and third existing pairs and two new ones
+    write_database(required, [(9.1, 1, 3), (20, 0, 2), (1.1, 0, 2), (30, 2, 4)], [(0, 0), (0, 1), (1, 0), (1, 1)], gf=False)
+
+    matched = match_pairs(read_pairs(database), read_pairs(required), TOLERANCES)
+    assert matched.tolist() == [2, -1, 0, -1]
+
+    # the missing pairs are computed on their own, numbered from 0
+    select_pairs(required, extension, matched < 0)
+    with h5py.File(extension, 'r+') as ext:
+        assert GF_GROUP not in ext
+        group = ext.create_group(GF_GROUP)
+        for i, dh in enumerate(ext['dh_of_pairs'][()]):
+            group.create_dataset(f'{i}_tdata', data=np.full(4, dh))
+            group.create_dataset(f'{i}_t0', data=dh / 10)
+
+    assert append_pairs(database, extension, required, matched) == 2  # noqa: PLR2004
+
+    with h5py.File(database, 'r') as db:
+        assert db['dh_of_pairs'][()].tolist() == [1, 5, 9, 20, 30]
+        assert db['dv_of_pairs'][()].tolist() == [2, 2, 2, 2, 2]
+        assert db[PAIR_INDEX][()].tolist() == [[1, 0], [-1, -1], [0, 0], [0, 1], [1, 1]]
+        assert db['delta_h'][()] == TOLERANCES[0]
+        group = db[GF_GROUP]
+        assert sorted(group) == sorted(f'{i}_{name}' for i in range(5) for name in ('tdata', 't0'))
+        for i, dh in enumerate(db['dh_of_pairs'][()]):
+            assert group[f'{i}_tdata'][()].tolist() == [dh] * 4
+            assert group[f'{i}_t0'][()] == pytest.approx(dh / 10)
+
+    # every combination of the new geometry finds its Green's function
+    pairs = read_pairs(database)
+    with h5py.File(database, 'r') as db, h5py.File(required, 'r') as req:
+        indices = db[PAIR_INDEX][()]
+        combinations = req[PAIR_INDEX][()]
+    for pair, combination in zip(read_pairs(required), combinations):
+        row = np.flatnonzero((indices == combination).all(axis=1))
+        assert len(row) == 1
+        assert np.all(np.abs(pairs[row[0]] - pair) < np.asarray(TOLERANCES) / 2)
+
+
+def test_append_pairs_without_missing_pairs(tmp_path):
+    database = str(tmp_path / 'database.h5')
+    required = str(tmp_path / 'required.h5')
+    write_database(database, [(1, 0, 2), (5, 0, 2)], [(0, 0), (0, 1)])
+    write_database(required, [(5, 0, 2)], [(3, 4)], gf=False)
+
+    matched = match_pairs(read_pairs(database), read_pairs(required), TOLERANCES)
+    assert append_pairs(database, None, required, matched) == 0
+    with h5py.File(database, 'r') as db:
+        assert db[PAIR_INDEX][()].tolist() == [[-1, -1], [3, 4]]
+        assert sorted(db[GF_GROUP]) == ['0_t0', '0_tdata', '1_t0', '1_tdata']
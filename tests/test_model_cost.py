@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from ModelCost import (
+    drm_box_nodes,
+    drm_estimate,
+    drm_node_count,
+    greens_function_pairs,
+    greens_function_pairs_bound,
+)
+
+
+def brute_force_pairs(sources, receivers, delta_h, delta_v_rec, delta_v_src):
+    # Distinct (distance bin, source depth bin, receiver depth bin) of every pair
+    # of occupied source and receiver cells
+    def cells(points, delta_v):
+        return {
+            (int(np.floor(x / delta_h)), int(np.floor(y / delta_h)), int(np.floor(z / delta_v))) for x, y, z in points
+        }
+
+    keys = set()
+    for sx, sy, sz in cells(sources, delta_v_src):
+        for rx, ry, rz in cells(receivers, delta_v_rec):
+            keys.add((int(np.floor(np.hypot(sx - rx, sy - ry))), sz, rz))
+    return len(keys)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_pairs_match_brute_force_and_bound(seed):
+    rng = np.random.default_rng(seed)
+    sources = rng.uniform((-5, -5, 1), (5, 5, 10), (80, 3))
+    nodes, _ = drm_box_nodes(4, 3, 2, 0.25, 0.25, 0.5, center=(rng.uniform(-3, 3), rng.uniform(-3, 3)))
+    deltas = (0.5, 0.3, 0.7)
+
+    npairs = greens_function_pairs(sources, nodes, *deltas)
+    assert npairs == brute_force_pairs(sources, nodes, *deltas)
+    assert npairs <= greens_function_pairs_bound(sources, nodes, *deltas)
+
+
+def test_pairs_without_points():
+    assert greens_function_pairs(np.empty((0, 3)), np.ones((2, 3)), 1, 1, 1) == 0
+    assert greens_function_pairs_bound(np.ones((2, 3)), np.empty((0, 3)), 1, 1, 1) == 0
+
+
+@pytest.mark.parametrize('shape', [(1, 1, 1), (2, 3, 4), (10, 6, 5)])
+def test_drm_node_count(shape):
+    nodes, internal = drm_box_nodes(*shape, 1.0, 1.0, 1.0)
+    assert len(nodes) == drm_node_count(*shape)
+    assert len(np.unique(nodes, axis=0)) == len(nodes)
+    nx, ny, nz = shape
+    assert internal.sum() == (nx + 1) * (ny + 1) * (nz + 1) - max(nx - 1, 0) * max(ny - 1, 0) * nz
+
+
+DRMBOX = {'Width X': 40.0, 'Width Y': 40.0, 'Depth': 20.0, 'Mesh Size X': 5.0, 'Mesh Size Y': 5.0, 'Mesh Size Z': 5.0}
+ANALYSIS = {'dt': 0.005, 'tmin': 0.0, 'tmax': 10.0, 'nfft': 4096, 'dh': 40.0, 'delta_v_rec': 5.0, 'delta_v_src': 200.0}
+
+
+def test_drm_estimate():
+    sources = np.random.default_rng(0).uniform((-2, -2, 1), (2, 2, 5), (100, 3))
+    estimate = drm_estimate(DRMBOX, ANALYSIS, sources, (0.5, 0.5))
+    assert estimate['elements'] == (8, 8, 4)
+    assert estimate['nodes'] == drm_node_count(8, 8, 4)
+    assert estimate['time_steps'] == 2001  # noqa: PLR2004
+    assert 0 < estimate['pairs'] <= estimate['pairs_bound']
+    assert estimate['gf_bytes'] > 0
+    assert estimate['gf_seconds'] > 0
+
+
+def test_drm_estimate_cancelled():
+    sources = np.random.default_rng(0).uniform((-2, -2, 1), (2, 2, 5), (100, 3))
+    assert drm_estimate(DRMBOX, ANALYSIS, sources, (0.5, 0.5), cancel=lambda: True) is None
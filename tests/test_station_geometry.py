@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+from StationGeometry import OFFSET_TOLERANCE, benchmark, north_east_offsets
+
+pytest.importorskip('geopy')
+
+
+def test_offsets_match_geopy_and_are_faster():
+    result = benchmark(2000, extent=2.0)
+    assert result['max_error'] <= OFFSET_TOLERANCE
+    assert result['speedup'] > 1
+
+
+def test_offset_signs_and_scalars():
+    north, east = north_east_offsets(-33.0, -71.0, [-32.0, -34.0, -33.0], [-71.0, -71.0, -70.0])
+    assert np.sign(north).tolist() == [1, -1, 0]
+    assert np.sign(east).tolist() == [0, 0, 1]
+    assert north[0] == pytest.approx(110.9, abs=0.5)
+    north, east = north_east_offsets(-33.0, -71.0, -33.0, -71.0)
+    assert north.shape == () and abs(north) == 0 and abs(east) == 0